@@ -1,30 +1,649 @@
-import requests
 import json
 import os
 import webbrowser
-import secret_drugs
 import sqlite3
-import plotly
-import plotly.graph_objects as go
-import plotly.express as px
-import numpy
-from flask import Flask
-from flask import request
 import logging
-import requests.auth
+import importlib
+import subprocess
+import multiprocessing
+import threading
+import atexit
+import time
+import zlib
+import hashlib
+import zipfile
+import io
+import re
+import sys
+import argparse
+import csv
+import lzma
 import urllib
 import urllib.parse
-import click
-from prettytable import PrettyTable
 import textwrap
+import tempfile
+from datetime import datetime, timedelta
 from textwrap import fill
-from pandas import DataFrame
+from collections import deque, OrderedDict, Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed
 
-CLIENT_ID = secret_drugs.REDDIT_CLIENT_ID
-CLIENT_SECRET = secret_drugs.REDDIT_CLIENT_SECRET
-REDIRECT_URI = secret_drugs.REDIRECT_URI
-REDDIT_USERNAME = secret_drugs.REDDIT_USERNAME
-REDDIT_PASSWORD = secret_drugs.REDDIT_PASSWORD
+
+class LazyModule:
+    '''
+    Stands in for a module that is slow to import and imports it
+    on first attribute access, so starting the program only pays
+    for the modules the selected menu or command actually uses.
+
+    Parameters:
+    -----------
+    name: string
+        full module name, e.g. 'plotly.graph_objects'
+    '''
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(importlib.import_module(self._name), attr)
+        setattr(self, attr, value) # later lookups skip __getattr__
+        return value
+
+    def __repr__(self):
+        return f"LazyModule({self._name!r})"
+
+
+requests = LazyModule('requests')
+numpy = LazyModule('numpy')
+go = LazyModule('plotly.graph_objects')
+px = LazyModule('plotly.express')
+flask = LazyModule('flask')
+prettytable = LazyModule('prettytable')
+
+# DB write rates and search timings (logged with the --verbose option)
+logger = logging.getLogger('drugs')
+
+# Keys and passwords are read from secret_drugs.py on first use
+# (see get_credential), so the program starts without the file
+CREDENTIALS_MODULE = 'secret_drugs'
+credentials = None
+
+# Time allowed from starting the program to the first prompt (see check_startup)
+STARTUP_BUDGET_MS = 200
+STARTUP_RUNS = 5
+# Imported at startup only if something defeated the lazy loading
+STARTUP_HEAVY_MODULES = ['requests', 'numpy', 'pandas', 'plotly', 'flask', 'click',
+    'prettytable', CREDENTIALS_MODULE]
+
+# openFDA paging limits (see https://open.fda.gov/apis/paging/)
+# FDA_BASE_URL can point at a local stand-in (see the stub-fda command)
+FDA_BASE_URL = os.environ.get('FDA_BASE_URL', 'https://api.fda.gov').rstrip('/')
+FDA_EVENT_URL = FDA_BASE_URL + "/drug/event.json"
+FDA_PAGE_SIZE = 1000    # maximum 'limit' allowed per request
+FDA_MAX_SKIP = 25000    # maximum 'skip' allowed; beyond this use search_after
+FDA_PAGE_WORKERS = 4    # pages requested at once (well under 240 requests/min)
+
+# Number of reports to retrieve per search.  Anything above FDA_PAGE_SIZE
+# switches find_by_drug/find_by_reaction to the paginated fetch mode.
+REPORT_BUDGET = int(os.environ.get('FDA_REPORT_BUDGET', FDA_PAGE_SIZE))
+
+# Database settings
+DB_PATH = 'FDA_DRUGS.db'
+DB_CACHE_KB = 64 * 1024  # SQLite page cache per connection, in KB
+DB_STATEMENT_CACHE = 256 # prepared statements kept per connection
+db_write_stats = {'rows': 0, 'seconds': 0.0, 'writes': 0} # totals for this session
+
+# Schema changes applied by migrate_database; entry N upgrades
+# a database from user_version N to N + 1.  Only ever append.
+SCHEMA_MIGRATIONS = [
+    # 1: indexes for the per-drug and per-reaction lookups; they keep rows
+    # in insertion (highest count first) order.  Report_Summary is indexed
+    # by migration 2, which replaces it.  (Databases migrated before this
+    # also have Report_Summary_by_Drug/_by_Reaction; migration 2 drops them
+    # with the table.)
+    [
+        '''CREATE INDEX IF NOT EXISTS "Reactions_per_Drug_by_Drug"
+            ON "Reactions_per_Drug" ("Drugs")''',
+        '''CREATE INDEX IF NOT EXISTS "Drug_per_Reaction_by_Reaction"
+            ON "Drug_per_Reaction" ("Reactions")'''
+    ],
+    # 2: normalized storage for Report_Summary.  Drug and reaction names are
+    # stored once in Drug_Names/Reaction_Names; reports reference them by id
+    # in Report_Facts (clustered by drug, indexed by reaction).  Report_Summary
+    # becomes a view with the original columns, so queries are unchanged.
+    [
+        '''CREATE TABLE IF NOT EXISTS "Drug_Names" (
+            "DrugID"    INTEGER PRIMARY KEY,
+            "Drugs"     TEXT NOT NULL UNIQUE
+        )''',
+        '''CREATE TABLE IF NOT EXISTS "Reaction_Names" (
+            "ReactionID"    INTEGER PRIMARY KEY,
+            "Reactions"     TEXT NOT NULL UNIQUE
+        )''',
+        '''CREATE TABLE IF NOT EXISTS "Report_Facts" (
+            "ReportID"      INTEGER NOT NULL,
+            "DrugID"        INTEGER NOT NULL,
+            "ReactionID"    INTEGER NOT NULL,
+            "Age"           INTEGER,
+            "Gender"        INTEGER,
+            PRIMARY KEY ("DrugID", "ReportID", "ReactionID")
+        ) WITHOUT ROWID''',
+        '''CREATE INDEX IF NOT EXISTS "Report_Facts_by_Reaction"
+            ON "Report_Facts" ("ReactionID", "ReportID", "Gender", "Age")''',
+        '''INSERT OR IGNORE INTO "Drug_Names" ("Drugs")
+            SELECT DISTINCT Drugs FROM "Report_Summary"''',
+        '''INSERT OR IGNORE INTO "Reaction_Names" ("Reactions")
+            SELECT DISTINCT Reactions FROM "Report_Summary"''',
+        '''INSERT OR IGNORE INTO "Report_Facts"
+            SELECT s.ReportID, d.DrugID, r.ReactionID, s.Age, s.Gender
+            FROM "Report_Summary" s
+            JOIN "Drug_Names" d ON d.Drugs = s.Drugs
+            JOIN "Reaction_Names" r ON r.Reactions = s.Reactions''',
+        '''DROP TABLE "Report_Summary"''',
+        '''CREATE VIEW "Report_Summary" AS
+            SELECT f.ReportID, d.Drugs, r.Reactions, f.Age, f.Gender
+            FROM "Report_Facts" f
+            JOIN "Drug_Names" d ON d.DrugID = f.DrugID
+            JOIN "Reaction_Names" r ON r.ReactionID = f.ReactionID'''
+    ],
+    # 3: progress of bulk file ingests, see ingest_bulk_file
+    [
+        '''CREATE TABLE IF NOT EXISTS "Ingest_Checkpoints" (
+            "File"      TEXT NOT NULL PRIMARY KEY,
+            "Reports"   INTEGER NOT NULL,
+            "Done"      INTEGER NOT NULL
+        )'''
+    ],
+    # 4: aggregates for counting reactions per drug and drugs per reaction
+    # locally.  Pair_Counts holds the number of reports for each drug/reaction
+    # pair and the Reports columns the number of distinct reports per name;
+    # both are kept current by REPORT_AGGREGATE_UPDATES.  Search_Totals
+    # holds the number of reports the FDA has for each search.
+    [
+        '''CREATE TABLE IF NOT EXISTS "Pair_Counts" (
+            "DrugID"        INTEGER NOT NULL,
+            "ReactionID"    INTEGER NOT NULL,
+            "Reports"       INTEGER NOT NULL,
+            PRIMARY KEY ("DrugID", "ReactionID")
+        ) WITHOUT ROWID''',
+        '''CREATE INDEX IF NOT EXISTS "Pair_Counts_by_Reaction"
+            ON "Pair_Counts" ("ReactionID", "Reports")''',
+        '''CREATE TABLE IF NOT EXISTS "Search_Totals" (
+            "Kind"  TEXT NOT NULL,
+            "Name"  TEXT NOT NULL,
+            "Total" INTEGER NOT NULL,
+            PRIMARY KEY ("Kind", "Name")
+        )''',
+        'ALTER TABLE "Drug_Names" ADD COLUMN "Reports" INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE "Reaction_Names" ADD COLUMN "Reports" INTEGER NOT NULL DEFAULT 0',
+        '''INSERT INTO "Pair_Counts"
+            SELECT DrugID, ReactionID, COUNT(*) FROM "Report_Facts"
+            GROUP BY DrugID, ReactionID''',
+        '''UPDATE "Drug_Names" SET Reports = (SELECT COUNT(DISTINCT ReportID)
+            FROM "Report_Facts" f WHERE f.DrugID = Drug_Names.DrugID)''',
+        '''UPDATE "Reaction_Names" SET Reports = (SELECT COUNT(DISTINCT ReportID)
+            FROM "Report_Facts" f WHERE f.ReactionID = Reaction_Names.ReactionID)'''
+    ],
+    # 5: age histograms (report rows per whole year of age, up to 100) for
+    # each drug and reaction, kept current by REPORT_AGGREGATE_UPDATES so
+    # the age box plot never reads the report rows themselves
+    [
+        '''CREATE TABLE IF NOT EXISTS "Drug_Ages" (
+            "DrugID"    INTEGER NOT NULL,
+            "Age"       INTEGER NOT NULL,
+            "Rows"      INTEGER NOT NULL,
+            PRIMARY KEY ("DrugID", "Age")
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE IF NOT EXISTS "Reaction_Ages" (
+            "ReactionID"    INTEGER NOT NULL,
+            "Age"           INTEGER NOT NULL,
+            "Rows"          INTEGER NOT NULL,
+            PRIMARY KEY ("ReactionID", "Age")
+        ) WITHOUT ROWID''',
+        '''INSERT INTO "Drug_Ages"
+            SELECT DrugID, CAST(Age AS INTEGER), COUNT(*) FROM "Report_Facts"
+            WHERE Age <= 100 GROUP BY 1, 2''',
+        '''INSERT INTO "Reaction_Ages"
+            SELECT ReactionID, CAST(Age AS INTEGER), COUNT(*) FROM "Report_Facts"
+            WHERE Age <= 100 GROUP BY 1, 2'''
+    ],
+    # 6: case-insensitive name lookups, and a Version per name that
+    # REPORT_AGGREGATE_UPDATES bumps whenever the name's reports change
+    # (tells demographics when a memoized summary is stale)
+    [
+        '''CREATE INDEX IF NOT EXISTS "Drug_Names_nocase"
+            ON "Drug_Names" ("Drugs" COLLATE NOCASE)''',
+        '''CREATE INDEX IF NOT EXISTS "Reaction_Names_nocase"
+            ON "Reaction_Names" ("Reactions" COLLATE NOCASE)''',
+        'ALTER TABLE "Drug_Names" ADD COLUMN "Version" INTEGER NOT NULL DEFAULT 0',
+        'ALTER TABLE "Reaction_Names" ADD COLUMN "Version" INTEGER NOT NULL DEFAULT 0'
+    ],
+    # 7: latest FDA receivedate (YYYYMMDD) among the reports retrieved for
+    # each search, from which refresh_search asks only for newer reports
+    [
+        'ALTER TABLE "Search_Totals" ADD COLUMN "Received" TEXT'
+    ],
+    # 8: set by 'ingest --complete' once the bulk files loaded make up the
+    # whole FAERS dataset; only then do names never searched through the
+    # API count as fully stored (see local_coverage)
+    [
+        '''CREATE TABLE IF NOT EXISTS "Ingest_Complete" (
+            "Files"     INTEGER NOT NULL,
+            "Completed" TEXT NOT NULL
+        )'''
+    ]
+]
+
+# Run (in order) for the report rows staged in temp.New_Facts before they
+# are copied to Report_Facts; keeps the aggregate tables current
+REPORT_AGGREGATE_UPDATES = [
+    # drop rows that are already stored
+    '''DELETE FROM temp.New_Facts WHERE EXISTS (SELECT 1 FROM Report_Facts f
+        WHERE f.DrugID = New_Facts.DrugID AND f.ReportID = New_Facts.ReportID
+        AND f.ReactionID = New_Facts.ReactionID)''',
+    '''INSERT INTO Pair_Counts
+        SELECT DrugID, ReactionID, COUNT(*) FROM temp.New_Facts
+        WHERE true GROUP BY DrugID, ReactionID
+        ON CONFLICT (DrugID, ReactionID) DO UPDATE SET Reports = Reports + excluded.Reports''',
+    # reports not stored before for the drug/reaction
+    '''UPDATE Drug_Names SET Reports = Reports + (SELECT COUNT(DISTINCT n.ReportID)
+        FROM temp.New_Facts n WHERE n.DrugID = Drug_Names.DrugID
+        AND NOT EXISTS (SELECT 1 FROM Report_Facts f
+            WHERE f.DrugID = n.DrugID AND f.ReportID = n.ReportID))
+        WHERE DrugID IN (SELECT DrugID FROM temp.New_Facts)''',
+    '''UPDATE Reaction_Names SET Reports = Reports + (SELECT COUNT(DISTINCT n.ReportID)
+        FROM temp.New_Facts n WHERE n.ReactionID = Reaction_Names.ReactionID
+        AND NOT EXISTS (SELECT 1 FROM Report_Facts f
+            WHERE f.ReactionID = n.ReactionID AND f.ReportID = n.ReportID))
+        WHERE ReactionID IN (SELECT ReactionID FROM temp.New_Facts)''',
+    '''INSERT INTO Drug_Ages
+        SELECT DrugID, CAST(Age AS INTEGER), COUNT(*) FROM temp.New_Facts
+        WHERE Age <= 100 GROUP BY 1, 2
+        ON CONFLICT (DrugID, Age) DO UPDATE SET Rows = Rows + excluded.Rows''',
+    '''INSERT INTO Reaction_Ages
+        SELECT ReactionID, CAST(Age AS INTEGER), COUNT(*) FROM temp.New_Facts
+        WHERE Age <= 100 GROUP BY 1, 2
+        ON CONFLICT (ReactionID, Age) DO UPDATE SET Rows = Rows + excluded.Rows''',
+    '''UPDATE Drug_Names SET Version = Version + 1
+        WHERE DrugID IN (SELECT DrugID FROM temp.New_Facts)''',
+    '''UPDATE Reaction_Names SET Version = Version + 1
+        WHERE ReactionID IN (SELECT ReactionID FROM temp.New_Facts)'''
+]
+
+db_conn = None # shared write connection, see get_db
+db_lock = threading.RLock()
+db_readers = [] # read-only connections, see get_read_db
+db_readers_local = threading.local()
+name_id_cache = {} # ids of drug/reaction names, see name_ids
+REPORT_BATCH_CHUNK = 4096 # rows converted at a time by ReportBatch.rows
+
+# Cache store settings: cache tables and the JSON files they replace
+CACHE_TABLES = {
+    'drugs_cache': 'drugs_cache.json',
+    'summary_cache': 'summary_cache.json'
+}
+cache_path = 'drugs_cache.db'
+CACHE_MMAP_SIZE = 256 * 1024 * 1024 # bytes of the cache file mapped into memory
+
+# Format of cache entries: full FDA responses (written by earlier
+# versions) or compact reports holding only the fields we use
+CACHE_FORMAT_RAW = 1
+CACHE_FORMAT_PROJECTED = 2
+CACHE_CODEC = os.environ.get('FDA_CACHE_CODEC', 'zlib') # 'zlib', 'lzma' or 'none'
+
+# Eviction policy, applied to each cache table separately
+CACHE_MAX_BYTES = int(os.environ.get('FDA_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+CACHE_MAX_ENTRIES = int(os.environ.get('FDA_CACHE_MAX_ENTRIES', 5000))
+# Entries are expired when the FDA publishes a new dataset (see
+# dataset_version); CACHE_TTL can also expire them by age
+CACHE_TTL = int(os.environ.get('FDA_CACHE_TTL', 0)) # seconds; 0 = never expire
+
+cache_stats = {table: {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0, 'outdated': 0}
+    for table in CACHE_TABLES}
+cache_lock = threading.Lock()
+cache_conn = None # opened on first use by get_cache_store
+cache_sizes = {} # table -> [entries, bytes], counted when the store is opened
+
+# FDA dataset version (meta.last_updated), see dataset_version
+DATASET_PROBE_INTERVAL = int(os.environ.get('FDA_DATASET_PROBE_INTERVAL', 6 * 60 * 60)) # seconds
+dataset_state = {'version': None, 'checked': None}
+dataset_lock = threading.RLock()
+
+# Demographic summaries (see demographics), memoized per name until
+# the name's Version changes
+DEMOGRAPHICS_SAMPLE_IDS = 100 # report ids kept per summary
+DEMOGRAPHICS_CACHE_ENTRIES = 256
+demographics_cache = OrderedDict() # (kind, key) -> (versions, summary)
+demographics_lock = threading.Lock()
+GENDER_NAMES = {0: 'Unknown', 1: 'Male', 2: 'Female'}
+
+# Presentation data computed in the background once a search completes,
+# while the user is choosing from the menu (see start_prefetch)
+PREFETCH_WORKERS = 4
+prefetch_pool = None
+prefetch_state = {'search': None, 'parts': {}} # (kind, NAME) -> part -> Future
+prefetch_lock = threading.Lock()
+
+# Reddit access tokens expire after an hour; each is reused for a while
+REDDIT_TOKEN_LIFETIME = 50 * 60 # seconds
+reddit_token = {'refresh_token': None, 'access_token': None, 'expires': 0.0}
+reddit_token_lock = threading.Lock()
+
+# Share of a search's FDA reports that must be stored locally before its
+# reaction/drug counts are computed from the DB instead of the count API
+LOCAL_COUNTS_MIN_COVERAGE = 0.95
+LOCAL_COUNTS_LIMIT = 100 # same as the FDA count API
+
+BATCH_WORKERS = 4 # searches run at the same time by the batch command
+REFRESH_WORKERS = 4 # searches refreshed at the same time by the refresh command
+
+# Query service (see the serve command).  Responses are cached until
+# the DB is written to or SERVICE_CACHE_TTL seconds pass.
+SERVICE_PORT = 8000
+SERVICE_CACHE_ENTRIES = 1024
+SERVICE_CACHE_TTL = int(os.environ.get('FDA_SERVICE_CACHE_TTL', 300))
+SERVICE_KINDS = ('drug', 'reaction')
+service_cache = OrderedDict() # request -> (DB writes, created, body)
+service_cache_lock = threading.Lock()
+
+# Synthetic data served by the stub-fda command
+STUB_PORT = 8090
+STUB_REPORTS = 5000 # reports available for every search
+STUB_LAST_UPDATED = os.environ.get('FDA_STUB_LAST_UPDATED', '2026-01-01')
+STUB_DRUGS = ['ASPIRIN', 'IBUPROFEN', 'AMLODIPINE', 'METFORMIN', 'LISINOPRIL',
+    'ATORVASTATIN', 'OMEPRAZOLE', 'LEVOTHYROXINE']
+STUB_REACTIONS = ['Nausea', 'Headache', 'Dizziness', 'Fatigue', 'Rash',
+    'Cough', 'Vomiting', 'Diarrhoea']
+
+# Chart output: 'show' opens each chart in the browser; 'html' or 'json'
+# writes it to CHART_DIR instead (see show_figure)
+CHART_OUTPUT = os.environ.get('FDA_CHART_OUTPUT', 'show')
+CHART_DIR = os.environ.get('FDA_CHART_DIR', 'charts')
+CHART_PLOTLYJS = os.environ.get('FDA_CHART_PLOTLYJS', 'inline') # 'inline', 'cdn' or 'directory'
+RENDER_WORKERS = min(4, os.cpu_count() or 1) # processes used by the render command
+chart_stats = {'rendered': 0, 'cached': 0} # charts written/found this session
+chart_quiet = False # True in render workers
+
+# Bulk ingest settings
+INGEST_CHUNK_SIZE = 1024 * 1024  # characters read from a bulk file at a time
+INGEST_BATCH_REPORTS = 2000      # reports written to the DB per transaction
+RESULTS_LIST_START = re.compile(r'"results"\s*:\s*\[')
+BULK_PART_NAME = re.compile(r'^(.*-)(\d+)-of-(\d+)(\..*)$') # drug-event-0001-of-0029.json.zip
+
+# Shared HTTP client settings (used for both FDA and Reddit calls)
+HTTP_CONNECT_TIMEOUT = 5    # seconds to establish a connection
+HTTP_READ_TIMEOUT = 30      # seconds to wait for a response
+HTTP_POOL_SIZE = 8          # keep-alive connections kept per host
+HTTP_RETRIES = 3            # retries on 429/5xx responses and dropped connections
+HTTP_BACKOFF = 0.5          # base of the exponential backoff between retries
+HTTP_BACKOFF_JITTER = 0.5   # random seconds added to each backoff
+
+http_session = None
+http_session_lock = threading.Lock()
+
+# openFDA quotas per API key (see https://open.fda.gov/apis/authentication/).
+# Every FDA request takes a token from a bucket refilled at
+# FDA_REQUESTS_PER_MINUTE (see acquire_fda_token).  Requests per day are
+# counted in the cache store, so the count carries over between runs.
+FDA_REQUESTS_PER_MINUTE = int(os.environ.get('FDA_REQUESTS_PER_MINUTE', 240))
+FDA_REQUESTS_PER_DAY = int(os.environ.get('FDA_REQUESTS_PER_DAY', 120000))
+FDA_BURST = 4        # requests that may be sent back to back
+FDA_QUOTA_FLUSH = 20 # requests counted in memory before the day's count is saved
+fda_tokens = FDA_BURST
+fda_tokens_time = time.monotonic()
+fda_quota = {'day': None, 'used': 0, 'unsaved': 0}
+fda_bucket_lock = threading.Lock()
+fda_inflight = {} # url -> Future shared by identical concurrent requests
+fda_inflight_lock = threading.Lock()
+
+# The count summary of a search is requested while its reports are
+# fetched and written (see start_summary_fetch)
+SUMMARY_WORKERS = 4 # summary requests in flight at once
+summary_pool = None
+summary_pool_lock = threading.Lock()
+
+# Stage timings of the search running in each thread (see begin_search_timings)
+SEARCH_STAGES = ['fetch', 'write', 'summary', 'summary_wait', 'total']
+search_timings_local = threading.local()
+
+
+class CredentialError(Exception):
+    '''
+    Raised when secret_drugs.py, or a key or password it
+    should define, is missing.
+    '''
+
+
+class FdaRateLimitError(Exception):
+    '''
+    Raised when the FDA answers 429 Too Many Requests, or when
+    the day's request quota has been used.
+    '''
+
+
+class BulkFileError(Exception):
+    '''
+    Raised when a bulk file ends before its "results" list does,
+    or holds something other than JSON reports.
+    '''
+
+
+def get_credential(name):
+    '''
+    Returns an API key or password from secret_drugs.py, importing
+    the file on first use.
+
+    Parameters:
+    -----------
+    name: string
+        name of the setting, e.g. 'FDA_API_KEY'
+
+    Returns:
+    --------
+    value: string
+        the key or password
+    '''
+    global credentials
+
+    if credentials is None:
+        try:
+            credentials = importlib.import_module(CREDENTIALS_MODULE)
+        except ModuleNotFoundError as error:
+            if error.name != CREDENTIALS_MODULE:
+                raise
+            raise CredentialError(f"{CREDENTIALS_MODULE}.py was not found.  It must be in "
+                "the same directory as drugs.py and define FDA_API_KEY (and the "
+                "REDDIT_* settings for Reddit searches).") from None
+
+    try:
+        return getattr(credentials, name)
+    except AttributeError:
+        raise CredentialError(f"{CREDENTIALS_MODULE}.py does not define {name}.") from None
+
+
+def get_http_session():
+    '''
+    Returns the shared HTTP session used for every network call,
+    creating it on first use.  The session keeps connections alive
+    (one pool per host, HTTP_POOL_SIZE connections each), retries
+    429/5xx responses with jittered exponential backoff and
+    negotiates gzip compressed responses.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    http_session: requests.Session
+        the shared session
+    '''
+    global http_session
+
+    with http_session_lock:
+        if http_session is None:
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry_settings = dict(total=HTTP_RETRIES, backoff_factor=HTTP_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None, # token requests are safe to retry too
+                raise_on_status=False)
+            try:
+                retries = Retry(backoff_jitter=HTTP_BACKOFF_JITTER, **retry_settings)
+            except TypeError: # urllib3 before 2.0 has no jitter
+                retries = Retry(**retry_settings)
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE, max_retries=retries, pool_block=True)
+
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept-Encoding": "gzip, deflate"})
+            http_session = session
+
+    return http_session
+
+
+def http_get(url, **kwargs):
+    '''
+    GET request through the shared HTTP session, with the
+    default connect/read timeouts unless others are given.
+
+    Parameters:
+    -----------
+    url: string
+        url to retrieve
+
+    kwargs: keyword arguments
+        passed on to requests (e.g. headers)
+
+    Returns:
+    --------
+    response: requests.Response
+    '''
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_http_session().get(url, **kwargs)
+
+
+def fda_get(url):
+    '''
+    GET request to the openFDA API; every FDA call goes through
+    here.  The request waits for a token (see acquire_fda_token).
+    If an identical request is already in flight it is not sent
+    again; the caller waits for and shares that response.
+
+    Parameters:
+    -----------
+    url: string
+        FDA API url to retrieve
+
+    Returns:
+    --------
+    response: requests.Response
+
+    Raises:
+    -------
+    FdaRateLimitError
+        if the FDA still answers 429 after the session's retries,
+        or the day's quota has been used
+    '''
+    with fda_inflight_lock:
+        pending = fda_inflight.get(url)
+        if pending is None:
+            pending = fda_inflight[url] = Future()
+            owner = True
+        else:
+            owner = False
+
+    if not owner:
+        return pending.result() # raises the sender's error, if any
+
+    try:
+        acquire_fda_token()
+        response = http_get(url)
+        if response.status_code == 429:
+            raise FdaRateLimitError("The FDA rate limit was reached (HTTP 429).  "
+                "Please try again in a minute.")
+        response.content # read the body before other threads share the response
+        pending.set_result(response)
+    except BaseException as error:
+        pending.set_exception(error)
+        raise
+    finally:
+        with fda_inflight_lock:
+            del fda_inflight[url]
+
+    return response
+
+
+def acquire_fda_token():
+    '''
+    Blocks until another FDA request may be sent: a token bucket
+    holding up to FDA_BURST tokens, refilled at
+    FDA_REQUESTS_PER_MINUTE, shared by all threads.  Counts the
+    request against the day's quota.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    None
+
+    Raises:
+    -------
+    FdaRateLimitError
+        if FDA_REQUESTS_PER_DAY requests were already sent today
+    '''
+    global fda_tokens, fda_tokens_time
+
+    while True:
+        with fda_bucket_lock:
+            today = time.strftime('%Y-%m-%d', time.gmtime()) # FDA quotas reset daily
+            if fda_quota['day'] != today:
+                save_fda_quota()
+                fda_quota.update(day=today, used=load_fda_quota(today), unsaved=0)
+            if fda_quota['used'] >= FDA_REQUESTS_PER_DAY:
+                raise FdaRateLimitError(f"The daily quota of {FDA_REQUESTS_PER_DAY} FDA "
+                    "requests has been used.  It resets at midnight UTC.")
+
+            now = time.monotonic()
+            fda_tokens = min(FDA_BURST, fda_tokens +
+                (now - fda_tokens_time) * FDA_REQUESTS_PER_MINUTE / 60)
+            fda_tokens_time = now
+
+            if fda_tokens >= 1:
+                fda_tokens -= 1
+                fda_quota['used'] += 1
+                fda_quota['unsaved'] += 1
+                if fda_quota['unsaved'] >= FDA_QUOTA_FLUSH:
+                    save_fda_quota()
+                return None
+
+            wait = (1 - fda_tokens) * 60 / FDA_REQUESTS_PER_MINUTE
+
+        time.sleep(wait)
+
+
+def http_post(url, **kwargs):
+    '''
+    POST request through the shared HTTP session, with the
+    default connect/read timeouts unless others are given.
+
+    Parameters:
+    -----------
+    url: string
+        url to post to
+
+    kwargs: keyword arguments
+        passed on to requests (e.g. auth, data, headers)
+
+    Returns:
+    --------
+    response: requests.Response
+    '''
+    kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+    return get_http_session().post(url, **kwargs)
 
 
 def print_for_Reddit(response_Dict, drug_name):
@@ -56,7 +675,7 @@ def print_for_Reddit(response_Dict, drug_name):
             title_list.append(response_Dict['Title'][i])
 
         # Building table for Reddit comment thread display to user
-        RedditTable = PrettyTable(border=False, header=True)
+        RedditTable = prettytable.PrettyTable(border=False, header=True)
         RedditTable.field_names = ["ID","TITLE OF COMMENT THREAD"]
         RedditTable.align["ID"] = "r"
         RedditTable.align["TITLE OF COMMENT THREAD"] = "l"
@@ -123,92 +742,283 @@ def handle_numeric(search_term, response_Dict):
         webbrowser.open(url)
 
 
-def find_by_drug(drug_name):
+def begin_search_timings():
+    '''
+    Starts timing the stages of a search in this thread: 'fetch'
+    (reports from the cache or FDA), 'write' (reports to the DB),
+    'summary' (count summary, in the summary pool), 'summary_wait'
+    (time the search waited for the summary) and 'total'.  Without
+    the overlap the total would be about fetch + write + summary.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    timings: dictionary
+        seconds per stage, filled in as the search runs
+    '''
+    timings = dict.fromkeys(SEARCH_STAGES, 0.0)
+    timings['started'] = time.perf_counter()
+    search_timings_local.timings = timings
+    return timings
+
+
+def add_stage_time(stage, start):
+    '''
+    Adds the seconds since start to a stage of the search
+    running in this thread (if it is being timed).
+
+    Parameters:
+    -----------
+    stage: string
+        one of SEARCH_STAGES
+
+    start: float
+        time.perf_counter() when the stage started
+
+    Returns:
+    --------
+    now: float
+        time.perf_counter(), to start the next stage from
+    '''
+    now = time.perf_counter()
+    timings = getattr(search_timings_local, 'timings', None)
+    if timings is not None:
+        timings[stage] += now - start
+    return now
+
+
+def end_search_timings(user_search):
+    '''
+    Finishes timing the search running in this thread and logs
+    its stage timings.  They are kept (see get_search_timings)
+    until the thread starts another search.
+
+    Parameters:
+    -----------
+    user_search: string
+        name of the drug or reaction
+
+    Returns:
+    --------
+    None
+    '''
+    timings = getattr(search_timings_local, 'timings', None)
+    if timings is None:
+        return None
+
+    timings['total'] = time.perf_counter() - timings.pop('started')
+    search_timings_local.timings = None
+    search_timings_local.last = {stage: round(timings[stage], 3) for stage in SEARCH_STAGES}
+    logger.info("search %s: fetch %.3fs, write %.3fs, summary %.3fs "
+        "(waited %.3fs), total %.3fs", user_search, *(timings[stage] for stage in SEARCH_STAGES))
+
+
+def get_search_timings():
+    '''
+    Returns the stage timings of the last search finished in this
+    thread (see begin_search_timings).
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    timings: dictionary
+        seconds per stage (SEARCH_STAGES), or None if no
+        search has finished
+    '''
+    return getattr(search_timings_local, 'last', None)
+
+
+def timed_search(find):
+    '''
+    Decorator timing the stages of every call of a search
+    function (find_by_drug, find_by_reaction).
+
+    Parameters:
+    -----------
+    find: function
+        search function taking the drug or reaction name first
+
+    Returns:
+    --------
+    timed_find: function
+        find, timed
+    '''
+    def timed_find(user_search, *args, **kwargs):
+        begin_search_timings()
+        try:
+            return find(user_search, *args, **kwargs)
+        finally:
+            end_search_timings(user_search)
+
+    timed_find.__name__ = find.__name__
+    timed_find.__doc__ = find.__doc__
+    return timed_find
+
+
+@timed_search
+def find_by_drug(drug_name, max_reports=None):
     '''
     Returns a list of rections reported to the FDA
     for the drug entered by the user.
     Will return data from cache, if found.  Otherwise,
     will use FDA API to retrieve the information.
+    If more reports are requested than a single FDA call
+    can return, the reports are retrieved page by page
+    (see paginated_search).
+    The FDA count summary, if the reports will not cover the
+    search, is fetched at the same time (see start_summary_fetch).
 
     Parameters:
     -----------
     drug_name: string
         name of drug entered by user
 
+    max_reports: integer
+        number of reports to retrieve; default is REPORT_BUDGET
+
     Returns:
     --------
-    results_list: list
-        List of tuples containing the FDA Report ID,
-        drug name of user's search,
-        and the associated reaction reported.
+    report_batch: ReportBatch
+        Rows holding the FDA Report ID,
+        drug name of user's search, the associated reaction
+        reported, age and gender; None if the drug
+        was not found.
     '''
+    if max_reports is None:
+        max_reports = REPORT_BUDGET
 
+    # Count summary, fetched alongside the reports unless they will cover
+    # the drug; decided now if it was searched before, else from the first page
+    summary = start_summary_fetch(drug_name, 'drug', max_reports)
+
+    def first_page(total):
+        nonlocal summary
+        summary = summary or start_summary_fetch(drug_name, 'drug', max_reports, total)
+
+    if max_reports > FDA_PAGE_SIZE:
+        report_batch = paginated_search(drug_name, drug_name, 'drug', max_reports, first_page)
+        if report_batch is None:
+            print('Drug not found in FDA database. Please try another search.')
+            return None
+        total_reaction_by_drug(drug_name, summary) # get summarized list
+        return report_batch
+
+    start = time.perf_counter()
     drug_dict = {}
     drug_dict = check_cache(drug_name)
 
     # Retrieve information from cache, if found
     if drug_dict:
         reactions = drug_dict['results']
-        results_list = results_loop_drug(reactions, drug_name)
+        report_batch = extract_columns(reactions, drug_name, 'drug')
 
     # Retrieve information from FDA if not in cache
     elif drug_dict is None:
-        fda_url_base = "https://api.fda.gov/drug/event.json?api_key="
-        api_key = secret_drugs.FDA_API_KEY
+        fda_url_base = FDA_EVENT_URL + "?api_key="
+        api_key = get_credential('FDA_API_KEY')
         limit = '&limit=1000'
 
         # More generalized search appears to be most effective for brand/generic/substance_name
         try:
-            output = requests.get(fda_url_base + api_key + '&search=' + drug_name + limit)
+            output = fda_get(fda_url_base + api_key + '&search=' + drug_name + limit)
             reaction_results = json.loads(output.text)
 
             reactions = reaction_results['results']
             add_to_cache(drug_name, reaction_results)
+            record_search_total('drug', drug_name,
+                reaction_results['meta']['results']['total'],
+                complete_receivedate(reactions, reaction_results['meta']['results']['total']))
+            first_page(reaction_results['meta']['results']['total'])
 
         # Building a dictionary to list reporting reactions and number of occurrences
-            results_list = results_loop_drug(reactions, drug_name)
+            report_batch = extract_columns(reactions, drug_name, 'drug')
 
+        except FdaRateLimitError:
+            raise
+        except requests.RequestException as error: # retries used up
+            print(f'Could not reach the FDA ({type(error).__name__}). Please try again later.')
+            return None
         except: # if output is a failure, then drug not in database
             print('Drug not found in FDA database. Please try another search.')
             return None
+    start = add_stage_time('fetch', start)
 
-    if results_list:
-        write_to_DB(drug_name, results_list, 'drug') # store in DB
-        total_reaction_by_drug(drug_name) # get summarized list
+    # Written while the summary is still being fetched
+    if len(report_batch):
+        write_to_DB(drug_name, report_batch, 'drug') # store in DB
+        add_stage_time('write', start)
+        total_reaction_by_drug(drug_name, summary) # get summarized list
 
-    return results_list
+    return report_batch
 
 
 
-def find_by_reaction(user_reaction):
+@timed_search
+def find_by_reaction(user_reaction, max_reports=None):
     '''
     Returns a list of drugs associated with reaction
     entered in the user search which has been reported
     to the FDA.
     Will return data from cache, if found.  Otherwise,
     will use FDA API to retrieve the information.
+    If more reports are requested than a single FDA call
+    can return, the reports are retrieved page by page
+    (see paginated_search).
+    The FDA count summary, if the reports will not cover the
+    search, is fetched at the same time (see start_summary_fetch).
 
     Parameters:
     -----------
     user_reaction: string
         name of reaction entered by user
 
+    max_reports: integer
+        number of reports to retrieve; default is REPORT_BUDGET
+
     Returns: (NONE)
     --------
-    results_list: list
-        List of tuples containing the FDA Report ID,
+    report_batch: ReportBatch
+        Rows holding the FDA Report ID,
         the drug associated with the reaction reported,
-        and the reaction name of user's search.
+        the reaction name of user's search, age and gender;
+        None if the reaction was not found.
     '''
+    if max_reports is None:
+        max_reports = REPORT_BUDGET
+
+    # Count summary, fetched alongside the reports unless they will cover
+    # the reaction; decided now if it was searched before, else from the first page
+    summary = start_summary_fetch(user_reaction, 'reaction', max_reports)
+
+    def first_page(total):
+        nonlocal summary
+        summary = summary or start_summary_fetch(user_reaction, 'reaction', max_reports, total)
+
+    if max_reports > FDA_PAGE_SIZE:
+        fda_search = "patient.reaction.reactionmeddrapt:" + user_reaction
+        report_batch = paginated_search(user_reaction, fda_search, 'reaction', max_reports,
+            first_page)
+        if report_batch is None:
+            print('Reaction not found in FDA database. Please try another search.')
+            return None
+        total_drugs_by_reaction(user_reaction, summary) # get summarized list
+        return report_batch
 
     # Can use the same base as 'find_my_drug' probably, but search
     # for different values in 'output'
+    start = time.perf_counter()
     reaction_dict = {}
     reaction_dict = check_cache(user_reaction)
 
     if reaction_dict:
         drugs = reaction_dict['results']
-        results_list = results_loop_reactions(drugs, user_reaction)
+        report_batch = extract_columns(drugs, user_reaction, 'reaction')
         # results_list = []
         # drugs = reaction_dict['results']
         # for i in range(len(drugs)):
@@ -218,18 +1028,23 @@ def find_by_reaction(user_reaction):
         #         results_list.append((report_id, found_drug, user_reaction))
 
     elif reaction_dict is None:
-        fda_url_base = "https://api.fda.gov/drug/event.json?api_key="
-        api_key = secret_drugs.FDA_API_KEY
+        fda_url_base = FDA_EVENT_URL + "?api_key="
+        api_key = get_credential('FDA_API_KEY')
         fda_search_drug = "&search=patient.reaction.reactionmeddrapt:" + user_reaction
         limit = '&limit=1000'
 
-        drugs_output = requests.get(fda_url_base + api_key + fda_search_drug + limit)
-        drug_results = json.loads(drugs_output.text)
         try:
+            drugs_output = fda_get(fda_url_base + api_key + fda_search_drug + limit)
+            drug_results = json.loads(drugs_output.text)
+
             drugs = drug_results['results']
             add_to_cache(user_reaction, drug_results)
+            record_search_total('reaction', user_reaction,
+                drug_results['meta']['results']['total'],
+                complete_receivedate(drugs, drug_results['meta']['results']['total']))
+            first_page(drug_results['meta']['results']['total'])
 
-            results_list = results_loop_reactions(drugs, user_reaction)
+            report_batch = extract_columns(drugs, user_reaction, 'reaction')
             # results_list = []
             # for i in range(len(drugs)):
             #     for x in range(len(drugs[i]['patient']['drug'])):
@@ -237,803 +1052,3373 @@ def find_by_reaction(user_reaction):
             #         report_id = drugs[i]['safetyreportid']
             #         results_list.append((report_id, found_drug, user_reaction))
 
+        except FdaRateLimitError:
+            raise
+        except requests.RequestException as error: # retries used up
+            print(f'Could not reach the FDA ({type(error).__name__}). Please try again later.')
+            return None
         except:
             print('Reaction not found in FDA database. Please try another search.')
             return None
+    start = add_stage_time('fetch', start)
 
-    if results_list:
-        write_to_DB(user_reaction, results_list, 'reaction') # store in DB
-        total_drugs_by_reaction(user_reaction) # get summarized list
+    # Written while the summary is still being fetched
+    if len(report_batch):
+        write_to_DB(user_reaction, report_batch, 'reaction') # store in DB
+        add_stage_time('write', start)
+        total_drugs_by_reaction(user_reaction, summary) # get summarized list
 
-    return results_list
+    return report_batch
 
-def results_loop_drug(raw_data, drug_name):
-    '''Takes the raw results from the FDA API
-    and creates a list of desired values:
-    report_id, drug, reaction
+def fetch_report_page(url):
+    '''
+    Retrieves a single page of reports from the FDA API.
 
     Parameters:
     -----------
-    raw_results: list
-        raw results returned from FDA for drug searched
+    url: string
+        complete FDA API url for the page (including skip/limit
+        or search_after)
 
     Returns:
     --------
-    results_list: list
-        List of tuples containing the FDA Report ID,
-        drug name of user's search,
-        and the associated reaction reported.
-
+    page: tuple
+        (list of raw reports, total number of reports available,
+        url of the next page or None).  The list is empty if
+        the FDA returned no results.
     '''
-    results_list = []
-    for i in range(len(raw_data)):
-        try:  # if there is no age listed, set age = None
-            age = raw_data[i]['patient']['patientonsetage']
-        except:
-            age = None
+    output = fda_get(url)
+    page_results = json.loads(output.text)
 
-        try:  # if no age listed, set gender = 0 (unknown)
-            gender = raw_data[i]['patient']['patientsex']
-        except:
-            gender = 0
+    if 'results' not in page_results:
+        return ([], 0, None)
 
-        for x in range(len(raw_data[i]['patient']['reaction'])):
-            drug_reaction = raw_data[i]['patient']['reaction'][x]['reactionmeddrapt']
-            report_id = raw_data[i]['safetyreportid']
-            results_list.append((report_id, drug_name.upper(), drug_reaction, age, gender))
+    total = page_results['meta']['results']['total']
+    next_url = output.links.get('next', {}).get('url')
 
-    return results_list
+    return (page_results['results'], total, next_url)
 
-def results_loop_reactions(raw_data, user_reaction):
-    '''Takes the raw results from the FDA API
-    and creates a list of desired values:
-    report_id, drug, reaction
+
+def fetch_report_pages(search_query, max_reports, sort=None):
+    '''
+    Generator walking the FDA API results for a search one page
+    at a time.  Pages within the 'skip' window are requested
+    concurrently (FDA_PAGE_WORKERS at a time) and yielded in order;
+    once the 'skip' window is exhausted the 'search_after' cursor
+    returned by the FDA is followed.  Only the pages currently in
+    flight are held in memory.
 
     Parameters:
     -----------
-    raw_results: list
-        raw results returned from FDA for reaction searched
+    search_query: string
+        value of the FDA 'search' parameter
+
+    max_reports: integer
+        maximum number of reports to retrieve
+
+    sort: string
+        value of the FDA 'sort' parameter, e.g. 'receivedate:asc';
+        default is the FDA's order
 
     Returns:
     --------
-    results_list: list
-        List of tuples containing the FDA Report ID,
-        the drug associated with the reaction reported
-        and reaction name of user's search.
-
+    page: tuple
+        (raw reports, total number of reports available)
+        for each page, yielded in order
     '''
-    results_list = []
-    for i in range(len(raw_data)):
-        try: # # if there is no age listed, set age = None
-            age = raw_data[i]['patient']['patientonsetage']
-        except:
-            age = None
+    base_url = FDA_EVENT_URL + "?api_key=" + get_credential('FDA_API_KEY') +\
+        "&search=" + search_query
+    if sort:
+        base_url += "&sort=" + sort
+
+    # First page tells us how many reports exist for the search
+    first_limit = min(FDA_PAGE_SIZE, max_reports)
+    reports, total, next_url = fetch_report_page(base_url + f"&limit={first_limit}")
+    if not reports:
+        return
+    yield (reports, total)
+
+    budget = min(total, max_reports)
+    skip_end = min(budget, FDA_MAX_SKIP + FDA_PAGE_SIZE)
+    offsets = iter(range(len(reports), skip_end, FDA_PAGE_SIZE))
+    retrieved = len(reports)
+
+    # Keep at most FDA_PAGE_WORKERS pages in flight so memory stays bounded
+    with ThreadPoolExecutor(max_workers=FDA_PAGE_WORKERS) as pool:
+        pending = deque()
+        for offset in offsets:
+            limit = min(FDA_PAGE_SIZE, skip_end - offset)
+            pending.append(pool.submit(fetch_report_page,
+                base_url + f"&skip={offset}&limit={limit}"))
+            if len(pending) == FDA_PAGE_WORKERS:
+                break
 
-        try: # if no age listed, set gender = 0 (unknown)
-            gender = raw_data[i]['patient']['patientsex']
-        except:
-            gender = 0
+        while pending:
+            reports, total, next_url = pending.popleft().result()
+            if not reports:
+                break
+            retrieved += len(reports)
+            yield (reports, total)
 
-        for x in range(len(raw_data[i]['patient']['drug'])):
-            found_drug = raw_data[i]['patient']['drug'][x]['medicinalproduct'].replace('  ','')
-            report_id = raw_data[i]['safetyreportid']
-            results_list.append((report_id, found_drug.upper(), user_reaction, age, gender))
+            offset = next(offsets, None)
+            if offset is not None:
+                limit = min(FDA_PAGE_SIZE, skip_end - offset)
+                pending.append(pool.submit(fetch_report_page,
+                    base_url + f"&skip={offset}&limit={limit}"))
 
-    return results_list
+        for future in pending:
+            future.cancel()
 
+    # Beyond the skip window, follow the search_after cursor serially
+    while retrieved < budget and next_url:
+        reports, total, next_url = fetch_report_page(next_url)
+        if not reports:
+            break
+        reports = reports[:budget - retrieved]
+        retrieved += len(reports)
+        yield (reports, total)
 
-def total_reaction_by_drug(drug_name):
+
+def paginated_search(user_search, search_query, search_type, max_reports, first_page=None):
     '''
-    Returns a summarized list of reactions reported to the FDA
-    for the drug entered by the user.
-    Will return data from cache, if found.  Otherwise,
-    will use FDA API to retrieve the information.
+    Retrieves up to max_reports reports for a search, page by page,
+    and writes each page to the DB as soon as it arrives so that
+    the full set of raw reports is never held in memory; only the
+    rows (as columns, see ReportBatch) are kept.
+    Paginated results are not stored in the cache.
 
     Parameters:
     -----------
-    drug_name: string
-        name of drug entered by user
-
-    Returns:
-    --------
-    None (writes results to table in DB)
-    '''
-    drug_name = drug_name.upper()
-    json_dict = {}
-    json_dict = check_summary_cache(drug_name)
+    user_search: string
+        name of the drug or reaction entered by the user
 
-    if json_dict:
-        tot_reactions = json_dict['results']
-        summary_list = []
-        for i in range(len(tot_reactions)):
-            reaction = tot_reactions[i]['term']
-            count = tot_reactions[i]['count']
-            summary_list.append((drug_name, reaction, count))
-
-    elif json_dict is None:
-        summary_url_base = "https://api.fda.gov/drug/event.json?api_key="
-        api_key = secret_drugs.FDA_API_KEY
-        descrip = '&count=patient.reaction.reactionmeddrapt.exact&search=patient.drug.medicinalproduct.exact:'
+    search_query: string
+        value of the FDA 'search' parameter
 
-        # Getting data from FDA API Call
-        # Call returns the top 100 reactions reported to the FDA
-        try:
-            output = requests.get(summary_url_base + api_key + descrip + drug_name)
-            json_dict = json.loads(output.text)
+    search_type: string
+        will identify if the search was by 'reaction' or 'drug'.
 
-            tot_reactions = json_dict['results']
-            add_to_summary_cache(drug_name, json_dict)
+    max_reports: integer
+        maximum number of reports to retrieve
 
-        # Building a dictionary to list reporting reactions and number of occurrences
-            summary_list = []
-            for i in range(len(tot_reactions)):
-                reaction = tot_reactions[i]['term']
-                count = tot_reactions[i]['count']
-                summary_list.append((drug_name, reaction, count))
+    first_page: function
+        called with the FDA's total number of reports for the
+        search once the first page has arrived
 
-        except:  # output will return failure if drug not found
-            print('Drug not found in FDA database. Please try another search.')
+    Returns:
+    --------
+    report_batch: ReportBatch
+        the rows written to the DB, or None if the search
+        returned no reports
+    '''
+    batches = []
+    rows_written = 0
+    reports_read = 0
+    received = None
+    start = time.perf_counter()
+    try:
+        for page, total in fetch_report_pages(search_query, max_reports):
+            start = add_stage_time('fetch', start)
+            if rows_written == 0:
+                record_search_total(search_type, user_search, total)
+                if first_page:
+                    first_page(total)
+            report_batch = extract_columns(page, user_search, search_type)
+            write_to_DB(user_search, report_batch, search_type)
+            start = add_stage_time('write', start)
+            batches.append(report_batch)
+            rows_written += len(report_batch)
+            reports_read += len(page)
+            received = max(received or '', latest_receivedate(page) or '') or None
+    except CredentialError:
+        raise
+    except Exception as error: # keep the pages already written if a later page fails
+        if rows_written == 0:
+            if isinstance(error, FdaRateLimitError):
+                raise
             return None
+        print(f"Retrieval stopped early; {rows_written} results saved for {user_search}.")
 
-    if summary_list: # if drug found, save to DB
-        write_Reaction_DB(summary_list)
+    if rows_written == 0:
+        return None
+
+    # The latest receivedate is only known if every report was read
+    record_search_total(search_type, user_search, total,
+        received if reports_read >= total else None)
 
+    return ReportBatch.concat(batches)
 
-def total_drugs_by_reaction(reaction):
+
+def refresh_search(user_search, search_type, max_reports=None):
     '''
-    Returns a summarized list of drugs by count for the
-    reaction entered by the user.
-    Will return data from cache, if found.  Otherwise,
-    will use FDA API to retrieve the information.
+    Brings a stored search up to date.  Only reports the FDA
+    received after the latest receivedate seen for the search are
+    requested, oldest first; they are added to the DB and merged
+    into the cached search, and the count summary for the search
+    is replaced.  If max_reports cuts the new reports short, the
+    saved receivedate only moves up to the last day read in full.
+    Without a saved receivedate, the search is retrieved again,
+    newest first, and the latest receivedate it holds is saved.
+    A day with more reports than max_reports is read in full, so
+    every refresh moves the saved receivedate forward.
 
     Parameters:
     -----------
-    reaction_name: string
-        name of reaction entered by user
+    user_search: string
+        name of the drug or reaction
+
+    search_type: string
+        'drug' or 'reaction'
+
+    max_reports: integer
+        maximum number of new reports to retrieve; default is
+        REPORT_BUDGET
 
     Returns:
     --------
-    None (writes results to table in DB)
+    result: dictionary
+        term, type, status ('ok', 'up to date', or 'not found' when
+        the FDA has no reports at all), new reports retrieved,
+        rows written, latest receivedate and seconds
     '''
-    reaction = reaction.upper()
-    json_dict = {}
-    json_dict = check_summary_cache(reaction)
+    start = time.perf_counter()
+    if max_reports is None:
+        max_reports = REPORT_BUDGET
 
-    # if search already cached, pull from cache
-    if json_dict:
-        tot_drugs = json_dict['results']
-        summary_list = []
-        for i in range(len(tot_drugs)):
-            drug_name = tot_drugs[i]['term']
-            count = tot_drugs[i]['count']
-            summary_list.append((drug_name, reaction, count))
+    # Same names and searches as find_by_drug/find_by_reaction
+    if search_type == 'drug':
+        user_search = user_search.upper()
+        search_query = user_search
+    else:
+        user_search = user_search.capitalize()
+        search_query = "patient.reaction.reactionmeddrapt:" + user_search
+    name_query = search_query
+
+    stored = db_query("SELECT Total, Received FROM Search_Totals WHERE Kind = ? AND Name = ?",
+        (search_type, user_search.upper()))
+    stored_total, received = stored[0] if stored else (0, None)
+    delta = bool(received) # only reports after received are requested
+    if delta:
+        # receivedate is inclusive on both ends
+        since = datetime.strptime(received, '%Y%m%d') + timedelta(days=1)
+        today = time.strftime('%Y%m%d', time.gmtime())
+        search_query = (f"({search_query})+AND+receivedate:"
+            f"[{since.strftime('%Y%m%d')}+TO+{today}]")
+
+    cached = check_cache(user_search, any_dataset=True)
+    new_reports = []
+    new_count = 0
+    rows_written = 0
+    received_days = Counter() # reports read per receivedate
+    read_ids = set()
+    sort = 'receivedate:asc' if delta else 'receivedate:desc'
+
+    def read_pages(pages):
+        # Writes the pages' reports not read before; returns the FDA total
+        nonlocal new_count, rows_written
+        pages_total = 0
+        for page, total in pages:
+            pages_total = total
+            page = [report for report in page if report['safetyreportid'] not in read_ids]
+            read_ids.update(report['safetyreportid'] for report in page)
+            report_batch = extract_columns(page, user_search, search_type)
+            write_to_DB(user_search, report_batch, search_type)
+            rows_written += len(report_batch)
+            received_days.update(report['receivedate'] for report in page
+                if report.get('receivedate'))
+            new_count += len(page)
+            if cached:
+                new_reports.extend(page)
+        return pages_total
+
+    new_total = read_pages(fetch_report_pages(search_query, max_reports, sort))
+
+    latest = max(received_days) if received_days else None
+    if new_count < new_total and len(received_days) == 1:
+        # max_reports ended within the first day read; read the rest of
+        # that day, or the next refresh would stop within it again
+        read_pages(fetch_report_pages(f"({name_query})+AND+receivedate:"
+            f"[{latest}+TO+{latest}]", sys.maxsize, sort))
+        last_full_day = latest
+    elif delta and latest:
+        # Oldest first, so every day before the last one read is complete;
+        # the last day is requested again by the next refresh
+        last_full_day = (datetime.strptime(latest, '%Y%m%d')
+            - timedelta(days=1)).strftime('%Y%m%d')
+    else:
+        # Newest first, so the latest day read is complete
+        last_full_day = latest
+
+    if not delta:
+        search_total = new_total
+        received = last_full_day
+    elif new_count >= new_total:
+        search_total = stored_total + new_total
+        received = latest or received
+    else:
+        if last_full_day and last_full_day > received:
+            received = last_full_day
+        search_total = stored_total + sum(reports for day, reports in received_days.items()
+            if day <= received)
 
-    # if first time searching, pull data from FDA
-    elif json_dict is None:
-        summary_url_base = "https://api.fda.gov/drug/event.json?api_key="
-        api_key = secret_drugs.FDA_API_KEY
-        #descrip = '&count=patient.drug.medicinalproduct.exact&search=patient.reaction.reactionmeddrapt.exact:'
-        # Exact was causing issues when searching for 'bruising'
-        # as opposed to 'injection site bruising', so removed
-        descrip = '&count=patient.drug.medicinalproduct.exact&search=patient.reaction.reactionmeddrapt:'
+    if not new_count and not stored_total:
+        status = 'not found'
+    else:
+        status = 'ok' if new_count else 'up to date'
+        record_search_total(search_type, user_search, search_total, received)
+
+        # Merged entry is current for this dataset, even with nothing new
+        if cached:
+            known = {report['safetyreportid'] for report in cached['results']}
+            cached['results'].extend(report for report in new_reports
+                if report['safetyreportid'] not in known)
+            cached['meta'] = {'last_updated': dataset_version()}
+            add_to_cache(user_search, cached)
+
+        # Replace the count summary (the FDA's, or counted locally)
+        if search_type == 'drug':
+            total_reaction_by_drug(user_search)
+        else:
+            total_drugs_by_reaction(user_search)
 
-        # Getting data from FDA API Call
-        # Call returns the top 100 instances reported to the FDA
-        try:
-            output = requests.get(summary_url_base + api_key + descrip + reaction)
-            json_dict = json.loads(output.text)
+    return {'term': user_search, 'type': search_type, 'status': status,
+        'new_reports': new_count, 'rows': rows_written, 'received': received,
+        'seconds': round(time.perf_counter() - start, 3)}
 
-            tot_drugs = json_dict['results']
-            add_to_summary_cache(reaction, json_dict)
 
-        # Building a dictionary to list reporting reactions and number of occurrences
-            summary_list = []
-            for i in range(len(tot_drugs)):
-                drug_name = tot_drugs[i]['term']
-                count = tot_drugs[i]['count']
-                summary_list.append((drug_name, reaction, count))
+def python_value(value):
+    '''
+    Converts a value read from a NumPy array to a Python value:
+    NumPy scalars (e.g. numpy.int64) to int, float, etc.  Values
+    from object arrays (e.g. report ids such as 'US-123') are
+    Python objects already and are returned as they are.
 
-        except:
-            # Will likely not reach this, but is a fail-safe.
-            # Was getting here when searching for 'bruising'
-            print(f"\n\n*** {reaction.upper()} has no count summary. Selections 1 and 2 below will return NULL results. ***")
-            return None
+    Parameters:
+    -----------
+    value: any
+        element of a NumPy array
+
+    Returns:
+    --------
+    value: any
+        the same value as a Python object
+    '''
+    return value.item() if isinstance(value, numpy.generic) else value
+
+
+class ReportBatch:
+    '''
+    Rows of report_id, drug, reaction, age, gender stored as
+    columns: NumPy arrays for the numbers, and integer codes into
+    lists of unique names (an intern table) for the drugs and
+    reactions, so a row takes about 25 bytes instead of a tuple
+    of Python objects.
+
+    A batch can be sliced (the slice shares the columns, nothing
+    is copied), indexed and iterated like a list of row tuples;
+    batches are joined with ReportBatch.concat.
+
+    Attributes:
+    -----------
+    report_id: numpy array
+        FDA Report IDs (int64; object if some are not numeric)
+
+    age: numpy array
+        ages (float64), nan if no age listed
+
+    gender: numpy array
+        genders (int8), 0 if unknown
+
+    drug, reaction: numpy arrays
+        codes (int32) into drug_names and reaction_names
+
+    drug_names, reaction_names: list
+        names for the codes
+    '''
+    def __init__(self, report_id, age, gender, drug, reaction,
+            drug_names, reaction_names):
+        self.report_id = report_id
+        self.age = age
+        self.gender = gender
+        self.drug = drug
+        self.reaction = reaction
+        self.drug_names = drug_names
+        self.reaction_names = reaction_names
+
+    def __len__(self):
+        return len(self.report_id)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ReportBatch(self.report_id[index], self.age[index],
+                self.gender[index], self.drug[index], self.reaction[index],
+                self.drug_names, self.reaction_names)
+
+        age = self.age[index]
+        return (python_value(self.report_id[index]), self.drug_names[self.drug[index]],
+            self.reaction_names[self.reaction[index]],
+            None if numpy.isnan(age) else age.item(), self.gender[index].item())
+
+    def __iter__(self):
+        return self.rows()
+
+    def __repr__(self):
+        return f"<ReportBatch of {len(self)} rows, {self.nbytes} bytes>"
+
+    @classmethod
+    def concat(cls, batches):
+        '''
+        Joins batches into one, merging their intern tables.
+
+        Parameters:
+        -----------
+        batches: list
+            ReportBatch objects, at least one
+
+        Returns:
+        --------
+        report_batch: ReportBatch
+            the rows of every batch, in order
+        '''
+        if len(batches) == 1:
+            return batches[0]
+
+        drug_names = {}
+        reaction_names = {}
+        drug_codes = []
+        reaction_codes = []
+        for batch in batches:
+            # old code -> code in the joined intern table
+            drug_map = numpy.array([drug_names.setdefault(name, len(drug_names))
+                for name in batch.drug_names] or [0], dtype=numpy.int32)
+            reaction_map = numpy.array([reaction_names.setdefault(name, len(reaction_names))
+                for name in batch.reaction_names] or [0], dtype=numpy.int32)
+            drug_codes.append(drug_map[batch.drug])
+            reaction_codes.append(reaction_map[batch.reaction])
+
+        return cls(numpy.concatenate([batch.report_id for batch in batches]),
+            numpy.concatenate([batch.age for batch in batches]),
+            numpy.concatenate([batch.gender for batch in batches]),
+            numpy.concatenate(drug_codes), numpy.concatenate(reaction_codes),
+            list(drug_names), list(reaction_names))
+
+    @property
+    def nbytes(self):
+        '''Bytes used by the columns (not counting the intern tables).'''
+        return (self.report_id.nbytes + self.age.nbytes + self.gender.nbytes +
+            self.drug.nbytes + self.reaction.nbytes)
+
+    def rows(self, drug_values=None, reaction_values=None):
+        '''
+        Generator yielding each row as a tuple, converting the
+        columns REPORT_BATCH_CHUNK rows at a time, so it can be
+        handed to executemany without building a list of rows.
+
+        Parameters:
+        -----------
+        drug_values, reaction_values: list
+            values yielded for each drug/reaction code; default
+            is the names (e.g. pass DB ids instead)
+
+        Returns:
+        --------
+        row: tuple
+            (report id, drug, reaction, age, gender), age is None
+            if no age listed
+        '''
+        if drug_values is None:
+            drug_values = self.drug_names
+        if reaction_values is None:
+            reaction_values = self.reaction_names
+        drug_values = numpy.array(drug_values or [None], dtype=object)
+        reaction_values = numpy.array(reaction_values or [None], dtype=object)
+
+        for start in range(0, len(self), REPORT_BATCH_CHUNK):
+            chunk = slice(start, start + REPORT_BATCH_CHUNK)
+            ages = self.age[chunk].astype(object)
+            ages[numpy.isnan(self.age[chunk])] = None
+            yield from zip(self.report_id[chunk].tolist(),
+                drug_values[self.drug[chunk]].tolist(),
+                reaction_values[self.reaction[chunk]].tolist(),
+                ages.tolist(), self.gender[chunk].tolist())
+
+
+def extract_columns(raw_data, search_name, search_type):
+    '''Takes the raw results from the FDA API and flattens them,
+    in one pass, into columns with one entry per row of
+    report_id, drug, reaction, age, gender.
+    Drugs and reactions are stored as integer codes into
+    lists of unique names.
+
+    For a 'drug' search there is a row per reaction reported with
+    the searched drug; for a 'reaction' search a row per drug
+    reported with the searched reaction; for 'bulk' (reports not
+    from a search) a row per drug/reaction pair in each report.
+
+    Parameters:
+    -----------
+    raw_data: list
+        raw results returned from FDA
+
+    search_name: string
+        drug or reaction searched (None for 'bulk')
+
+    search_type: string
+        'drug', 'reaction' or 'bulk'
+
+    Returns:
+    --------
+    report_batch: ReportBatch
+        the rows, as columns
+    '''
+    report_ids = []
+    ages = []
+    genders = []
+    row_counts = []   # rows per report
+    drug_codes = []
+    reaction_codes = []
+    drug_names = {}   # name -> code, in code order
+    reaction_names = {}
+
+    if search_type == 'drug':
+        drug_names[search_name.upper()] = 0
+    elif search_type == 'reaction':
+        reaction_names[search_name] = 0
+
+    for report in raw_data:
+        patient = report['patient']
+
+        if search_type != 'drug':
+            report_drugs = [drug_names.setdefault(
+                drug['medicinalproduct'].replace('  ','').upper(), len(drug_names))
+                for drug in patient.get('drug', [])]
+        if search_type != 'reaction':
+            report_reactions = [reaction_names.setdefault(
+                reaction['reactionmeddrapt'], len(reaction_names))
+                for reaction in patient.get('reaction', [])]
+
+        if search_type == 'drug':
+            reaction_codes.extend(report_reactions)
+            row_counts.append(len(report_reactions))
+        elif search_type == 'reaction':
+            drug_codes.extend(report_drugs)
+            row_counts.append(len(report_drugs))
+        else:
+            for reaction_code in report_reactions:
+                drug_codes.extend(report_drugs)
+                reaction_codes.extend([reaction_code] * len(report_drugs))
+            row_counts.append(len(report_reactions) * len(report_drugs))
+
+        report_ids.append(report['safetyreportid'])
+        ages.append(patient.get('patientonsetage'))
+        genders.append(patient.get('patientsex') or 0)
+
+    # Per-report values are repeated for each of the report's rows
+    row_counts = numpy.array(row_counts, dtype=numpy.int64)
+    rows = int(row_counts.sum())
+
+    try:
+        report_ids = numpy.array(report_ids, dtype=numpy.int64)
+    except ValueError: # keep non-numeric report ids as they are
+        report_ids = numpy.array(report_ids, dtype=object)
+
+    try:
+        ages = numpy.array([numpy.nan if age is None else age for age in ages],
+            dtype=numpy.float64)
+    except ValueError: # an age that is not a number
+        ages = numpy.array([to_age(age) for age in ages], dtype=numpy.float64)
+
+    if search_type == 'drug':
+        drug_codes = numpy.zeros(rows, dtype=numpy.int32)
+    else:
+        drug_codes = numpy.array(drug_codes, dtype=numpy.int32)
+    if search_type == 'reaction':
+        reaction_codes = numpy.zeros(rows, dtype=numpy.int32)
+    else:
+        reaction_codes = numpy.array(reaction_codes, dtype=numpy.int32)
+
+    report_batch = ReportBatch(numpy.repeat(report_ids, row_counts),
+        numpy.repeat(ages, row_counts),
+        numpy.repeat(numpy.array(genders, dtype=numpy.int8), row_counts),
+        drug_codes, reaction_codes, list(drug_names), list(reaction_names))
+
+    return report_batch
+
+
+def to_age(age):
+    '''
+    Converts an age listed in a report to a number.
+
+    Parameters:
+    -----------
+    age: string
+        age as returned from FDA (may be None)
+
+    Returns:
+    --------
+    age: float
+        the age, or nan if missing or not a number
+    '''
+    try:
+        return float(age)
+    except (TypeError, ValueError):
+        return numpy.nan
+
+
+def results_loop_drug(raw_data, drug_name):
+    '''Takes the raw results from the FDA API
+    and creates a list of desired values:
+    report_id, drug, reaction, age, gender
+
+    Parameters:
+    -----------
+    raw_results: list
+        raw results returned from FDA for drug searched
+
+    Returns:
+    --------
+    results_list: list
+        List of tuples containing the FDA Report ID,
+        drug name of user's search,
+        and the associated reaction reported.
+
+    '''
+    return list(extract_columns(raw_data, drug_name, 'drug'))
+
+def results_loop_reactions(raw_data, user_reaction):
+    '''Takes the raw results from the FDA API
+    and creates a list of desired values:
+    report_id, drug, reaction, age, gender
+
+    Parameters:
+    -----------
+    raw_results: list
+        raw results returned from FDA for reaction searched
+
+    Returns:
+    --------
+    results_list: list
+        List of tuples containing the FDA Report ID,
+        the drug associated with the reaction reported
+        and reaction name of user's search.
+
+    '''
+    return list(extract_columns(raw_data, user_reaction, 'reaction'))
+
+
+def total_reaction_by_drug(drug_name, summary=None):
+    '''
+    Returns a summarized list of reactions reported to the FDA
+    for the drug entered by the user.
+    Will return data from cache, if found.  Otherwise,
+    will use FDA API to retrieve the information.
+
+    Parameters:
+    -----------
+    drug_name: string
+        name of drug entered by user
+
+    summary: Future
+        summary fetch already started for the drug (see
+        start_summary_fetch); fetched here if None
+
+    Returns:
+    --------
+    None (writes results to table in DB)
+    '''
+    drug_name = drug_name.upper()
+
+    # Count locally when the DB holds (nearly) all of the drug's reports
+    if local_coverage('drug', drug_name) >= LOCAL_COUNTS_MIN_COVERAGE:
+        summary_list = local_reaction_counts(drug_name)
+        if summary_list:
+            write_Reaction_DB(summary_list)
+            return None
+
+    try:
+        summary_list = wait_for_summary(summary) if summary \
+            else fetch_summary(drug_name, 'drug')
+    except Exception as error:  # output will return failure if drug not found
+        # Fall back to counting the stored reports (e.g. when offline)
+        summary_list = local_reaction_counts(drug_name)
+        if not summary_list:
+            if isinstance(error, FdaRateLimitError):
+                raise
+            print('Drug not found in FDA database. Please try another search.')
+            return None
+
+    if summary_list: # if drug found, save to DB
+        write_Reaction_DB(summary_list)
+
+
+def total_drugs_by_reaction(reaction, summary=None):
+    '''
+    Returns a summarized list of drugs by count for the
+    reaction entered by the user.
+    Will return data from cache, if found.  Otherwise,
+    will use FDA API to retrieve the information.
+
+    Parameters:
+    -----------
+    reaction_name: string
+        name of reaction entered by user
+
+    summary: Future
+        summary fetch already started for the reaction (see
+        start_summary_fetch); fetched here if None
+
+    Returns:
+    --------
+    None (writes results to table in DB)
+    '''
+    reaction = reaction.upper()
+
+    # Count locally when the DB holds (nearly) all of the reaction's reports
+    if local_coverage('reaction', reaction) >= LOCAL_COUNTS_MIN_COVERAGE:
+        summary_list = local_drug_counts(reaction)
+        if summary_list:
+            write_Drug_DB(summary_list)
+            return None
+
+    try:
+        summary_list = wait_for_summary(summary) if summary \
+            else fetch_summary(reaction, 'reaction')
+    except Exception as error:
+        # Will likely not reach this, but is a fail-safe.
+        # Was getting here when searching for 'bruising'
+        # Fall back to counting the stored reports (e.g. when offline)
+        summary_list = local_drug_counts(reaction)
+        if not summary_list:
+            if isinstance(error, FdaRateLimitError):
+                raise
+            print(f"\n\n*** {reaction.upper()} has no count summary. Selections 1 and 2 below will return NULL results. ***")
+            return None
+
+    if summary_list:
+        write_Drug_DB(summary_list)
+
+
+def fetch_summary(user_search, search_type):
+    '''
+    Returns the FDA count summary for a search: the top 100
+    reactions reported for a drug, or the top 100 drugs reported
+    for a reaction.  Will return data from cache, if found.
+    Otherwise, will use FDA API to retrieve the information.
+
+    Parameters:
+    -----------
+    user_search: string
+        name of the drug or reaction, upper case
+
+    search_type: string
+        'drug' or 'reaction'
+
+    Returns:
+    --------
+    summary_list: list
+        (drug, reaction, count) tuples, highest count first.
+        Raises an exception if the FDA has no summary for the search.
+    '''
+    json_dict = check_summary_cache(user_search)
+
+    # if search already cached, pull from cache
+    if json_dict:
+        tot_terms = json_dict['results']
+
+    # if first time searching, pull data from FDA
+    else:
+        summary_url_base = FDA_EVENT_URL + "?api_key="
+        api_key = get_credential('FDA_API_KEY')
+        if search_type == 'drug':
+            descrip = '&count=patient.reaction.reactionmeddrapt.exact&search=patient.drug.medicinalproduct.exact:'
+        else:
+            #descrip = '&count=patient.drug.medicinalproduct.exact&search=patient.reaction.reactionmeddrapt.exact:'
+            # Exact was causing issues when searching for 'bruising'
+            # as opposed to 'injection site bruising', so removed
+            descrip = '&count=patient.drug.medicinalproduct.exact&search=patient.reaction.reactionmeddrapt:'
+
+        # Getting data from FDA API Call
+        # Call returns the top 100 instances reported to the FDA
+        output = fda_get(summary_url_base + api_key + descrip + user_search)
+        json_dict = json.loads(output.text)
+
+        tot_terms = json_dict['results'] # output will return failure if not found
+        add_to_summary_cache(user_search, json_dict)
+
+    # Building a list of reported terms and number of occurrences
+    if search_type == 'drug':
+        return [(user_search, term['term'], term['count']) for term in tot_terms]
+    return [(term['term'], user_search, term['count']) for term in tot_terms]
+
+
+def get_summary_pool():
+    '''
+    Returns the thread pool that fetches count summaries,
+    creating it on first use.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    summary_pool: ThreadPoolExecutor
+        the shared pool
+    '''
+    global summary_pool
+
+    with summary_pool_lock:
+        if summary_pool is None:
+            summary_pool = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS,
+                thread_name_prefix='summary')
+
+    return summary_pool
+
+
+def start_summary_fetch(user_search, search_type, max_reports, total=None):
+    '''
+    Starts fetching the count summary of a search (see
+    fetch_summary) in the summary pool, so that it overlaps the
+    retrieval and DB write of the search's reports.  Nothing is
+    fetched if, once max_reports reports are stored, the counts
+    will be taken from the DB instead (LOCAL_COUNTS_MIN_COVERAGE),
+    or if the number of reports the FDA holds is not known yet.
+    The time it takes is recorded as the 'summary' stage of this
+    thread's search.
+
+    Parameters:
+    -----------
+    user_search: string
+        name of the drug or reaction
+
+    search_type: string
+        'drug' or 'reaction'
+
+    max_reports: integer
+        number of reports the search retrieves
+
+    total: integer
+        number of reports the FDA holds for the search; default
+        is the total saved by an earlier search
+
+    Returns:
+    --------
+    summary: Future
+        result of fetch_summary; pass it to total_reaction_by_drug
+        or total_drugs_by_reaction.  None if not started.
+    '''
+    if total is None:
+        stored = db_query("SELECT Total FROM Search_Totals WHERE Kind = ? AND Name = ?",
+            (search_type, user_search.upper()))
+        total = stored[0][0] if stored else None
+    if not total:
+        return None
+
+    stored_reports = max(local_report_count(search_type, user_search), min(total, max_reports))
+    if stored_reports / total >= LOCAL_COUNTS_MIN_COVERAGE:
+        return None
+
+    timings = getattr(search_timings_local, 'timings', None)
+
+    def fetch():
+        start = time.perf_counter()
+        try:
+            return fetch_summary(user_search.upper(), search_type)
+        finally:
+            if timings is not None:
+                timings['summary'] += time.perf_counter() - start
+
+    return get_summary_pool().submit(fetch)
+
+
+def wait_for_summary(summary):
+    '''
+    Returns the result of a summary fetch started with
+    start_summary_fetch, recording the time spent waiting for it
+    as the 'summary_wait' stage.
+
+    Parameters:
+    -----------
+    summary: Future
+        the summary fetch
+
+    Returns:
+    --------
+    summary_list: list
+        (drug, reaction, count) tuples (see fetch_summary)
+    '''
+    start = time.perf_counter()
+    try:
+        return summary.result()
+    finally:
+        add_stage_time('summary_wait', start)
+
+
+def record_search_total(search_type, user_search, total, received=None):
+    '''
+    Saves the number of reports the FDA holds for a search, used
+    to decide whether the stored reports cover the search, and
+    the latest receivedate among the reports retrieved (kept if
+    it is later than the one saved before).
+
+    Parameters:
+    -----------
+    search_type: string
+        'drug' or 'reaction'
+
+    user_search: string
+        name of the drug or reaction entered by the user
+
+    total: integer
+        number of reports reported by the FDA (meta.results.total)
+
+    received: string
+        latest receivedate retrieved, YYYYMMDD (see latest_receivedate)
+
+    Returns:
+    --------
+    None
+    '''
+    db_execute('''INSERT INTO Search_Totals (Kind, Name, Total, Received)
+        VALUES(?,?,?,?) ON CONFLICT (Kind, Name) DO UPDATE SET Total = excluded.Total,
+        Received = CASE WHEN excluded.Received > COALESCE(Received, \'\')
+            THEN excluded.Received ELSE Received END''',
+        (search_type, user_search.upper(), total, received))
+
+
+def complete_receivedate(raw_data, total):
+    '''
+    Returns the latest receivedate among the reports of a search
+    if they are all of its reports; otherwise the FDA may hold later
+    ones, so None is returned (see refresh_search).
+
+    Parameters:
+    -----------
+    raw_data: list
+        raw results returned from FDA
+
+    total: integer
+        number of reports the FDA holds for the search
+
+    Returns:
+    --------
+    received: string
+        YYYYMMDD, or None
+    '''
+    if len(raw_data) < total:
+        return None
+
+    return latest_receivedate(raw_data)
+
+
+def latest_receivedate(raw_data):
+    '''
+    Returns the latest FDA receivedate among raw reports.
+
+    Parameters:
+    -----------
+    raw_data: list
+        raw results returned from FDA
+
+    Returns:
+    --------
+    received: string
+        YYYYMMDD, or None if no report has a receivedate
+    '''
+    return max((report.get('receivedate') or '' for report in raw_data), default='') or None
+
+
+def local_coverage(search_type, user_search):
+    '''
+    Returns the share of the FDA's reports for a drug or reaction
+    that are stored in the DB.  For names never searched through the
+    API, a bulk ingest of the whole dataset (ingest --complete) is
+    taken as full coverage; any smaller ingest as none.
+
+    Parameters:
+    -----------
+    search_type: string
+        'drug' or 'reaction'
+
+    user_search: string
+        name of the drug or reaction
+
+    Returns:
+    --------
+    coverage: float
+        between 0.0 (nothing stored) and 1.0 (all reports stored)
+    '''
+    local_reports = local_report_count(search_type, user_search)
+    if local_reports == 0:
+        return 0.0
+
+    total = db_query("SELECT Total FROM Search_Totals WHERE Kind = ? AND Name = ?",
+        (search_type, user_search.upper()))
+    if total and total[0][0]:
+        return min(local_reports / total[0][0], 1.0)
+
+    if db_query("SELECT 1 FROM Ingest_Complete LIMIT 1"):
+        return 1.0
+
+    return 0.0
+
+
+def local_report_count(search_type, user_search):
+    '''
+    Returns the number of reports stored in the DB for a drug
+    or reaction.
+
+    Parameters:
+    -----------
+    search_type: string
+        'drug' or 'reaction'
+
+    user_search: string
+        name of the drug or reaction
+
+    Returns:
+    --------
+    local_reports: integer
+        number of distinct reports stored
+    '''
+    if search_type == 'drug':
+        local = db_query("SELECT SUM(Reports) FROM Drug_Names WHERE Drugs = ?",
+            (user_search.upper(),))
+    else:
+        local = db_query('''SELECT SUM(Reports) FROM Reaction_Names
+            WHERE Reactions = ? COLLATE NOCASE''', (user_search,))
+
+    return local[0][0] or 0
+
+
+def local_reaction_counts(drug_name):
+    '''
+    Counts the reports of each reaction for a drug from the stored
+    reports (kept up to date in Pair_Counts as reports are written).
+
+    Parameters:
+    -----------
+    drug_name: string
+        name of the drug
+
+    Returns:
+    --------
+    summary_list: list
+        up to LOCAL_COUNTS_LIMIT (drug, reaction, count) tuples,
+        most reported first, in the same form as the FDA count results
+    '''
+    query = """
+        SELECT UPPER(r.Reactions), SUM(p.Reports)
+        FROM Pair_Counts p
+        JOIN Reaction_Names r ON r.ReactionID = p.ReactionID
+        WHERE p.DrugID = (SELECT DrugID FROM Drug_Names WHERE Drugs = ?)
+        GROUP BY UPPER(r.Reactions)
+        ORDER BY 2 DESC
+        LIMIT ?
+        """
+    result = db_query(query, (drug_name.upper(), LOCAL_COUNTS_LIMIT))
+
+    return [(drug_name.upper(), reaction, count) for reaction, count in result]
+
+
+def local_drug_counts(reaction):
+    '''
+    Counts the reports of each drug for a reaction from the stored
+    reports (kept up to date in Pair_Counts as reports are written).
+
+    Parameters:
+    -----------
+    reaction: string
+        name of the reaction
+
+    Returns:
+    --------
+    summary_list: list
+        up to LOCAL_COUNTS_LIMIT (drug, reaction, count) tuples,
+        most reported first, in the same form as the FDA count results
+    '''
+    query = """
+        SELECT d.Drugs, SUM(p.Reports)
+        FROM Pair_Counts p
+        JOIN Drug_Names d ON d.DrugID = p.DrugID
+        WHERE p.ReactionID IN (SELECT ReactionID FROM Reaction_Names
+            WHERE Reactions = ? COLLATE NOCASE)
+        GROUP BY d.Drugs
+        ORDER BY 2 DESC
+        LIMIT ?
+        """
+    result = db_query(query, (reaction, LOCAL_COUNTS_LIMIT))
+
+    return [(drug_name, reaction.upper(), count) for drug_name, count in result]
+
+
+def age_histogram(kind, name_ids):
+    '''
+    Returns the age histogram kept for a drug or reaction: the
+    number of report rows at each whole year of age up to 100
+    (the ages the box plot shows).
+
+    Parameters:
+    -----------
+    kind: string
+        'drug' or 'reaction'
+
+    name_ids: list
+        DrugIDs or ReactionIDs of the drug or reaction
+
+    Returns:
+    --------
+    histogram: list
+        (age, rows) tuples, youngest first
+    '''
+    table, id_column = ('Drug_Ages', 'DrugID') if kind == 'drug' \
+        else ('Reaction_Ages', 'ReactionID')
+    query = f"""
+        SELECT Age, SUM(Rows)
+        FROM {table}
+        WHERE {id_column} IN ({','.join('?' * len(name_ids))})
+        GROUP BY Age
+        ORDER BY Age
+        """
+
+    return db_query(query, tuple(name_ids))
+
+
+def age_box_stats(histogram):
+    '''
+    Computes box plot statistics from an age histogram: quartiles
+    (interpolated like plotly's own box plots), min/max and the
+    whisker ends (furthest ages within 1.5 IQR of the box).
+
+    Parameters:
+    -----------
+    histogram: list
+        (age, rows) tuples, youngest first (see age_histogram)
+
+    Returns:
+    --------
+    stats: dictionary
+        'count', 'min', 'q1', 'median', 'q3', 'max', 'lowerfence'
+        and 'upperfence'; empty if there are no ages
+    '''
+    if not histogram:
+        return {}
+
+    ages = numpy.array([row[0] for row in histogram], dtype=numpy.float64)
+    cumulative = numpy.cumsum([row[1] for row in histogram])
+    count = int(cumulative[-1])
+
+    def quantile(q):
+        # plotly.js's 'linear' quartile method: interpolate between the
+        # sorted ages either side of position q * count - 0.5 (0-based),
+        # clamped to the youngest and oldest age
+        position = min(max(q * count - 0.5, 0), count - 1)
+        low = ages[numpy.searchsorted(cumulative, int(position), side='right')]
+        high = ages[numpy.searchsorted(cumulative, int(numpy.ceil(position)), side='right')]
+        return float(low + (high - low) * (position - int(position)))
+
+    q1, median, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+    iqr = q3 - q1
+
+    return {'count': count, 'min': float(ages[0]), 'q1': q1, 'median': median,
+        'q3': q3, 'max': float(ages[-1]),
+        'lowerfence': float(ages[ages >= q1 - 1.5 * iqr][0]),
+        'upperfence': float(ages[ages <= q3 + 1.5 * iqr][-1])}
+
+
+def demographics(key, kind):
+    '''
+    Returns the demographic summary of the stored reports for a
+    drug or reaction: report count, rows by gender, age box plot
+    statistics and sample report ids.  The name is matched without
+    regard to case.  Ages and report counts come from the kept
+    aggregates; rows by gender and sample ids come from one pass
+    over the name's index entries.  Summaries are memoized until
+    the name's reports change (its Version in Drug_Names or
+    Reaction_Names).
+
+    Parameters:
+    -----------
+    key: string
+        name of the drug or reaction
+
+    kind: string
+        'drug' or 'reaction'
+
+    Returns:
+    --------
+    summary: dictionary
+        'name', 'kind', 'reports' (distinct report ids), 'rows',
+        'genders' (gender name -> rows), 'ages' (see age_box_stats)
+        and 'sample_ids' (lowest DEMOGRAPHICS_SAMPLE_IDS report ids)
+    '''
+    key = key.strip()
+    if kind == 'drug':
+        names_query = """
+            SELECT DrugID, Version, Reports FROM Drug_Names
+            WHERE Drugs = ? COLLATE NOCASE
+            """
+        id_column = 'DrugID'
+    else:
+        names_query = """
+            SELECT ReactionID, Version, Reports FROM Reaction_Names
+            WHERE Reactions = ? COLLATE NOCASE
+            """
+        id_column = 'ReactionID'
+
+    names = db_query(names_query, (key,))
+    versions = tuple((row[0], row[1]) for row in names)
+    memo_key = (kind, key.lower())
+
+    with demographics_lock:
+        memo = demographics_cache.get(memo_key)
+        if memo and memo[0] == versions:
+            demographics_cache.move_to_end(memo_key)
+            return memo[1]
+
+    name_ids = [row[0] for row in names]
+    placeholders = ','.join('?' * len(name_ids))
+
+    genders = {}
+    sample_ids = []
+    if name_ids:
+        # The only pass over the name's rows, found through the index
+        query = f"""
+            SELECT Gender, COUNT(*)
+            FROM Report_Facts
+            WHERE {id_column} IN ({placeholders})
+            GROUP BY Gender
+            """
+        for gender, rows in db_query(query, tuple(name_ids)):
+            name = GENDER_NAMES.get(gender, 'Unknown')
+            genders[name] = genders.get(name, 0) + rows
+
+        query = f"""
+            SELECT DISTINCT ReportID
+            FROM Report_Facts
+            WHERE {id_column} IN ({placeholders})
+            ORDER BY ReportID
+            LIMIT ?
+            """
+        # reads only the first entries of the ReportID-ordered index
+        sample_ids = [row[0] for row in
+            db_query(query, tuple(name_ids) + (DEMOGRAPHICS_SAMPLE_IDS,))]
+
+    summary = {'name': key, 'kind': kind,
+        'reports': sum(row[2] for row in names),
+        'rows': sum(genders.values()),
+        'genders': {name: genders[name] for name in GENDER_NAMES.values() if name in genders},
+        'ages': age_box_stats(age_histogram(kind, name_ids)) if name_ids else {},
+        'sample_ids': sample_ids}
+
+    with demographics_lock:
+        demographics_cache[memo_key] = (versions, summary)
+        demographics_cache.move_to_end(memo_key)
+        while len(demographics_cache) > DEMOGRAPHICS_CACHE_ENTRIES:
+            demographics_cache.popitem(last=False)
+
+    return summary
+
+
+def create_database():
+    '''
+    Creates the database and tables that will be used to store
+    the results from the user's search(es).  If the tables/database
+    already exists, there will be no update.
+    There are five tables:
+    (1) Drugs - table of all drugs searched by user
+    (2) Reactions - table of all reactions searched by user
+    (3) Report_Summary - table of drugs and associated reactions
+        in addition to the FDA's report id for the drug/reaction combo
+        listing Report ID, Age, and Gender
+    (4) Reactions_per_Drug - table of drugs that list the number of times
+        a reaction has been reported for a specified drug
+    (5) Drug_per_Reaction - table that lists the number of times a Drug
+        has been reported for a specified Reaction
+    Older databases are then upgraded by migrate_database, which
+    (among others) replaces the Report_Summary table with a view over
+    integer-keyed tables (see SCHEMA_MIGRATIONS).
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    None
+    '''
+
+    # Shared connection to database
+    conn = get_db()
+    with db_lock:
+        # Create DB cursor
+        cur = conn.cursor()
+
+        ### CREATION OF THREE TABLES IN DB (IF NOT EXIST) ###
+        # Create the Report Summary table if does not already exist
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS "Report_Summary" (
+    	"ReportID"	INTEGER NOT NULL,
+    	"Drugs"	TEXT NOT NULL,
+    	"Reactions"	TEXT NOT NULL,
+        "Age" INTEGER,
+        "Gender" INTEGER,
+        UNIQUE (ReportID, Drugs, Reactions, Age, Gender) ON CONFLICT IGNORE
+    )
+        '''
+        )
+
+        # Create the Drugs List table if does not already exist
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS "Drugs" (
+    	"Drugs"	TEXT NOT NULL UNIQUE,
+    	PRIMARY KEY("Drugs")
+        )
+        '''
+        )
+
+        # Create the Reaction List table if does not already exist
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS "Reactions" (
+    	"Reactions"	TEXT NOT NULL UNIQUE,
+    	PRIMARY KEY("Reactions")
+        )
+        '''
+        )
+
+        # Create the Reaction Summary table if does not already exist
+        # List count of reactions reported for a specified drug
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS "Reactions_per_Drug" (
+    	"Drugs"	TEXT NOT NULL,
+    	"Reactions"	TEXT NOT NULL,
+    	"Reaction_Count"	INTEGER NOT NULL
+        )
+        '''
+        )
+
+        # Create the Drug Summary table if does not already exist
+        # List count of Drugs reported for a specified Reaction
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS "Drug_per_Reaction" (
+    	"Reactions"	TEXT NOT NULL,
+    	"Drugs"	TEXT NOT NULL,
+    	"Drug_Count"	INTEGER NOT NULL
+        )
+        '''
+        )
+
+        conn.commit()
+
+    migrate_database()
+
+
+def migrate_database():
+    '''
+    Brings an existing database up to the current schema by running
+    the migrations in SCHEMA_MIGRATIONS it has not run yet.  The
+    schema version is kept in SQLite's user_version.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    None
+    '''
+    conn = get_db()
+    with db_lock:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        # sqlite3 only opens transactions before INSERT/UPDATE/DELETE, so
+        # CREATE/ALTER would commit one by one; open them explicitly instead
+        isolation_level = conn.isolation_level
+        conn.isolation_level = None
+        try:
+            for new_version, statements in enumerate(SCHEMA_MIGRATIONS[version:], version + 1):
+                conn.execute("BEGIN")
+                try: # each migration is applied completely or not at all
+                    for statement in statements:
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version={new_version}")
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+        finally:
+            conn.isolation_level = isolation_level
+
+
+def check_query_plans(conn=None):
+    '''
+    Runs EXPLAIN QUERY PLAN on the queries behind the charts and
+    sample report list and returns any that scan a whole table
+    instead of using an index.
+
+    Parameters:
+    -----------
+    conn: sqlite3.Connection
+        connection to the DB to check; default is the calling
+        thread's read-only connection
+
+    Returns:
+    --------
+    full_scans: list
+        list of (query, plan detail) tuples for each full table scan;
+        empty if every query uses an index
+    '''
+    chart_queries = [
+        "SELECT Reactions, Reaction_Count FROM Reactions_per_Drug WHERE Drugs = ? LIMIT 10",
+        "SELECT Drugs, Drug_Count FROM Drug_per_Reaction WHERE Reactions = ? LIMIT 10",
+        # demographics
+        "SELECT DrugID, Version, Reports FROM Drug_Names WHERE Drugs = ? COLLATE NOCASE",
+        "SELECT ReactionID, Version, Reports FROM Reaction_Names "
+            "WHERE Reactions = ? COLLATE NOCASE",
+        "SELECT Age, SUM(Rows) FROM Drug_Ages WHERE DrugID IN (?) GROUP BY Age ORDER BY Age",
+        "SELECT Age, SUM(Rows) FROM Reaction_Ages WHERE ReactionID IN (?) "
+            "GROUP BY Age ORDER BY Age",
+        "SELECT Gender, COUNT(*) FROM Report_Facts WHERE DrugID IN (?) GROUP BY Gender",
+        "SELECT Gender, COUNT(*) FROM Report_Facts WHERE ReactionID IN (?) GROUP BY Gender",
+        "SELECT DISTINCT ReportID FROM Report_Facts WHERE DrugID IN (?) "
+            "ORDER BY ReportID LIMIT ?",
+        "SELECT DISTINCT ReportID FROM Report_Facts WHERE ReactionID IN (?) "
+            "ORDER BY ReportID LIMIT ?"
+    ]
+
+    if conn is None:
+        conn = get_read_db()
+
+    full_scans = []
+    for query in chart_queries:
+        for row in conn.execute("EXPLAIN QUERY PLAN " + query, ('',) * query.count('?')):
+            detail = row[-1]
+            if detail.startswith("SCAN") and "INDEX" not in detail:
+                full_scans.append((query, detail))
+
+    return full_scans
+
+
+### DATA ACCESS LAYER ###
+# All access to FDA_DRUGS.db goes through the functions below.  Writes
+# share one long-lived connection; chart queries use read-only connections
+# (one per thread).  Each connection keeps a cache of prepared statements,
+# so repeated queries are not re-compiled.
+
+def get_db():
+    '''
+    Returns the shared connection used for all writes to the DB,
+    opening it on first use.  The connection uses WAL journaling
+    (readers are not blocked by a write), synchronous set to NORMAL
+    (safe with WAL) and a larger page cache.  Callers must hold
+    db_lock while using it.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    db_conn: sqlite3.Connection
+        connection to the DB
+    '''
+    global db_conn
+
+    with db_lock:
+        if db_conn is None:
+            conn = sqlite3.connect(DB_PATH, check_same_thread=False,
+                cached_statements=DB_STATEMENT_CACHE)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            # Staging table for report rows, see report_statements
+            conn.execute('''CREATE TEMP TABLE IF NOT EXISTS "New_Facts" (
+                "ReportID"      INTEGER NOT NULL,
+                "DrugID"        INTEGER NOT NULL,
+                "ReactionID"    INTEGER NOT NULL,
+                "Age"           INTEGER,
+                "Gender"        INTEGER,
+                PRIMARY KEY ("DrugID", "ReportID", "ReactionID")
+            ) WITHOUT ROWID''')
+            conn.execute('''CREATE INDEX IF NOT EXISTS temp."New_Facts_by_Reaction"
+                ON "New_Facts" ("ReactionID", "ReportID")''')
+            db_conn = conn
+
+    return db_conn
+
+
+def get_read_db():
+    '''
+    Returns the read-only connection to the DB for the calling
+    thread, opening it on first use.  Threads that only live for
+    a short while (e.g. service requests) close it with
+    close_read_db.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    conn: sqlite3.Connection
+        read-only connection to the DB
+    '''
+    conn = getattr(db_readers_local, 'conn', None)
+    if conn is None:
+        get_db() # make sure the DB file exists and is in WAL mode
+        conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True,
+            check_same_thread=False, cached_statements=DB_STATEMENT_CACHE)
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_KB}")
+        db_readers_local.conn = conn
+        with db_lock:
+            db_readers.append(conn)
+
+    return conn
+
+
+def db_query(query, params=()):
+    '''
+    Runs a read query on the calling thread's read-only connection.
+
+    Parameters:
+    -----------
+    query: string
+        SQL query, with ? placeholders for the parameters
+
+    params: tuple
+        values bound to the placeholders
+
+    Returns:
+    --------
+    result: list
+        rows returned by the query
+    '''
+    return get_read_db().execute(query, params).fetchall()
+
+
+def close_read_db(error=None):
+    '''
+    Closes the calling thread's read-only connection, if it has
+    one.  Runs after every query service request.
+
+    Parameters:
+    -----------
+    error: Exception
+        passed by Flask when the request failed; not used
+
+    Returns:
+    --------
+    None
+    '''
+    conn = getattr(db_readers_local, 'conn', None)
+    if conn is None:
+        return None
+
+    db_readers_local.conn = None
+    with db_lock:
+        db_readers.remove(conn)
+    conn.close()
+
+
+def db_execute(query, params=()):
+    '''
+    Runs a single statement on the shared write connection
+    and commits it.
+
+    Parameters:
+    -----------
+    query: string
+        SQL statement, with ? placeholders for the parameters
+
+    params: tuple
+        values bound to the placeholders
+
+    Returns:
+    --------
+    None
+    '''
+    conn = get_db()
+    with db_lock:
+        with conn:
+            conn.execute(query, params)
+        db_write_stats['writes'] += 1
+
+
+def close_db():
+    '''
+    Closes the write connection and every read-only connection.
+    Registered to run when the program exits.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    None
+    '''
+    global db_conn
+
+    with db_lock:
+        for conn in db_readers:
+            conn.close()
+        db_readers.clear()
+        if db_conn is not None:
+            db_conn.close()
+            db_conn = None
+    db_readers_local.__dict__.clear()
+
+
+def bulk_write(statements):
+    '''
+    Writes rows to the DB with executemany, all statements inside
+    one transaction, and records the write rate in db_write_stats.
+
+    Parameters:
+    -----------
+    statements: list
+        list of (query, rows) tuples; rows can be any iterable
+        of parameter tuples, or None for a query run once
+        (not counted as rows written)
+
+    Returns:
+    --------
+    rows_per_sec: float
+        number of rows written per second
+    '''
+    start = time.perf_counter()
+    rows = 0
+
+    conn = get_db()
+    with db_lock:
+        with conn: # one transaction; rolled back if any statement fails
+            cur = conn.cursor()
+            for query, params in statements:
+                if params is None:
+                    cur.execute(query)
+                    continue
+                cur.executemany(query, params)
+                rows += max(cur.rowcount, 0)
+        db_write_stats['writes'] += 1 # expires cached service responses
+
+    elapsed = time.perf_counter() - start
+    rows_per_sec = rows / elapsed if elapsed else 0.0
+    db_write_stats['rows'] += rows
+    db_write_stats['seconds'] += elapsed
+    logger.info("wrote %d rows in %.3fs (%.0f rows/sec)", rows, elapsed, rows_per_sec)
+
+    return rows_per_sec
+
+
+def print_write_stats():
+    '''
+    Prints the number of rows written to the DB in this session
+    and the write rate (see db_write_stats).
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    None
+    '''
+    if db_write_stats['rows']:
+        print(f"Wrote {db_write_stats['rows']} rows to the DB in "
+            f"{db_write_stats['seconds']:.1f}s "
+            f"({db_write_stats['rows'] / db_write_stats['seconds']:.0f} rows/sec).")
+
+
+def write_Reaction_DB(summary_list):
+    '''
+    Writes to the database the results returned for the
+    number of Reactions reported for a particular Drug
+
+    Parameters:
+    -----------
+    summary_list: list
+        The list of results returned with the count of reactions
+        for a specified drug.
+
+    Returns:
+    --------
+    None
+    '''
+
+    # Replaces the drug's earlier counts (delete, then insert in count order)
+    # Binding variables to prevent SQL injection (& account for special characters)
+    bulk_write([("DELETE FROM Reactions_per_Drug WHERE Drugs = ?",
+            [(drug,) for drug in {row[0] for row in summary_list}]),
+        ("INSERT OR IGNORE INTO Reactions_per_Drug VALUES(?,?,?)", summary_list)])
+
+
+def write_Drug_DB(summary_list):
+    '''
+    Writes to the database the results returned for the
+    number of times a Drug was reported for a particular Reaction
+
+    Parameters:
+    -----------
+    summary_list: list
+        The list of results returned with the report count of a Drug
+        reported for a specified Reaction.
+
+    Returns:
+    --------
+    None
+    '''
+
+    # Replaces the reaction's earlier counts (delete, then insert in count order)
+    # Binding variables to prevent SQL injection (& account for special characters)
+    bulk_write([("DELETE FROM Drug_per_Reaction WHERE Reactions = ?",
+            [(reaction,) for reaction in {row[1] for row in summary_list}]),
+        ("INSERT OR IGNORE INTO Drug_per_Reaction VALUES(?,?,?)",
+            ((reaction, drug, count) for drug, reaction, count in summary_list))])
+
+
+def write_to_DB(user_search, search_results, search_type):
+    '''
+    Writes to the database the results that were returned
+    based on the user's search.  List of results containing
+    also the Report ID will be written to the Drugs_Reaction table.
+    If the user searched for a reaction, then that reaction name
+    will be added to the Reaction table.  If the user searched for a
+    drug, then that drug will be added to the Drug table.
+
+    Parameters:
+    -----------
+    user_search: string
+        name of the drug or reaction entered by the user
+
+    search_results: dictionary or list
+        results returned from the FDA based on the drug name
+        or reaction entered by the user (a ReportBatch,
+        or a list of tuples)
+
+    search_type: string
+        will identify if the search was by 'reaction' or 'drug'.
+
+    Returns:
+    --------
+    None
+    '''
+
+    # Writing data to the Drug or Reaction table and Report Summary table
+    # Binding variables to prevent SQL injection (& account for special characters)
+    if search_type == 'drug':
+        search_table = "INSERT OR IGNORE INTO Drugs VALUES(?)"
+    elif search_type == 'reaction':
+        search_table = "INSERT OR IGNORE INTO Reactions VALUES(?)"
+    else:
+        return None
+
+    bulk_write([(search_table, [(user_search,)])] + report_statements(search_results))
+
+
+def report_statements(search_results):
+    '''
+    Builds the statements that store results in Report_Summary.
+    Report_Summary is a view; rows are stored in Report_Facts with
+    the drug and reaction names replaced by their integer ids.
+    Rows are first staged in the New_Facts temporary table so the
+    aggregates (see REPORT_AGGREGATE_UPDATES) can be updated for
+    the new rows with a few set-based statements.
+
+    Parameters:
+    -----------
+    search_results: ReportBatch or list
+        the rows, or a list of
+        (report id, drug, reaction, age, gender) tuples
+
+    Returns:
+    --------
+    statements: list
+        (query, rows) tuples for bulk_write
+    '''
+    if isinstance(search_results, ReportBatch):
+        facts = batch_facts(search_results)
+    else:
+        drug_ids = name_ids('Drug_Names', 'Drugs', {row[1] for row in search_results})
+        reaction_ids = name_ids('Reaction_Names', 'Reactions', {row[2] for row in search_results})
+        facts = ((report_id, drug_ids[drug], reaction_ids[reaction], age, gender)
+            for report_id, drug, reaction, age, gender in search_results)
+
+    statements = [("DELETE FROM temp.New_Facts", None),
+        ("INSERT OR IGNORE INTO temp.New_Facts VALUES(?,?,?,?,?)", facts)]
+    statements.extend((query, None) for query in REPORT_AGGREGATE_UPDATES)
+    statements.append(("INSERT INTO Report_Facts SELECT * FROM temp.New_Facts", None))
+
+    return statements
+
+
+def batch_facts(report_batch):
+    '''
+    Builds Report_Facts rows from a ReportBatch, mapping the drug
+    and reaction codes to DB ids.  Rows are produced as they are
+    consumed (see ReportBatch.rows).
+
+    Parameters:
+    -----------
+    report_batch: ReportBatch
+        the rows to store
+
+    Returns:
+    --------
+    facts: iterator
+        (report id, drug id, reaction id, age, gender) tuples
+    '''
+    drug_ids = name_ids('Drug_Names', 'Drugs', set(report_batch.drug_names))
+    reaction_ids = name_ids('Reaction_Names', 'Reactions', set(report_batch.reaction_names))
+
+    return report_batch.rows([drug_ids[name] for name in report_batch.drug_names],
+        [reaction_ids[name] for name in report_batch.reaction_names])
+
+
+def name_ids(table, column, names):
+    '''
+    Returns the integer ids of drug or reaction names, adding
+    names that are not yet in the table.  Ids are remembered in
+    name_id_cache so known names need no DB lookup.
+
+    Parameters:
+    -----------
+    table: string
+        'Drug_Names' or 'Reaction_Names'
+
+    column: string
+        name column of the table ('Drugs' or 'Reactions')
+
+    names: set
+        names to look up
+
+    Returns:
+    --------
+    ids: dictionary
+        id for each name
+    '''
+    known = name_id_cache.setdefault(table, {})
+    missing = [name for name in names if name not in known]
+
+    if missing:
+        conn = get_db()
+        id_column = table.replace('_Names', 'ID')
+        with db_lock:
+            with conn:
+                conn.executemany(f'INSERT OR IGNORE INTO "{table}" ("{column}") VALUES(?)',
+                    ((name,) for name in missing))
+                for name in missing:
+                    known[name] = conn.execute(f'''SELECT "{id_column}" FROM "{table}"
+                        WHERE "{column}" = ?''', (name,)).fetchone()[0]
+
+    return {name: known[name] for name in names}
+
+
+### BATCH SEARCH ###
+
+def batch_search(term, search_type, max_reports=None):
+    '''
+    Runs one search of a batch (see run_batch), including the
+    summary counts, and times it.
+
+    Parameters:
+    -----------
+    term: string
+        name of the drug or reaction to search
+
+    search_type: string
+        'drug' or 'reaction'
+
+    max_reports: integer
+        number of reports to retrieve; default is REPORT_BUDGET
+
+    Returns:
+    --------
+    result: dictionary
+        term, type, status ('ok', 'not found' or 'error: ...'),
+        rows (rows written to the DB), seconds and the seconds
+        per stage of the search (see begin_search_timings)
+    '''
+    start = time.perf_counter()
+    rows = 0
+    try:
+        # Same normalization as the interactive search
+        if search_type == 'drug':
+            found = find_by_drug(term.upper(), max_reports)
+        else:
+            found = find_by_reaction(term.capitalize(), max_reports)
+
+        if found is None:
+            status = 'not found'
+        else:
+            status = 'ok'
+            rows = len(found)
+    except FdaRateLimitError as error:
+        status = f"rate limited: {error}"
+    except Exception as error:
+        status = f"error: {error}"
+
+    result = {'term': term, 'type': search_type, 'status': status, 'rows': rows,
+        'seconds': round(time.perf_counter() - start, 3)}
+    result.update(get_search_timings() or dict.fromkeys(SEARCH_STAGES, 0.0))
+    return result
+
+
+def read_terms(terms_path):
+    '''
+    Reads the drugs or reactions listed in a file, one per line,
+    skipping blank lines and lines starting with '#'.
+
+    Parameters:
+    -----------
+    terms_path: string
+        file listing the drugs or reactions
+
+    Returns:
+    --------
+    terms: list
+        the drugs or reactions, in file order
+    '''
+    with open(terms_path) as f:
+        terms = [line.strip() for line in f
+            if line.strip() and not line.startswith('#')]
+
+    return terms
+
+
+def run_batch(terms_path, search_type, output_path, workers=BATCH_WORKERS,
+        max_reports=None):
+    '''
+    Searches every drug or reaction listed in a file (one per line;
+    blank lines and lines starting with '#' are skipped) using a pool
+    of worker threads.  FDA requests from all workers share the rate
+    limit (see acquire_fda_token).  A result line per term is written
+    to output_path as each search finishes: CSV if the file name ends
+    in .csv, otherwise JSON lines.
+
+    Parameters:
+    -----------
+    terms_path: string
+        file listing the drugs or reactions to search
+
+    search_type: string
+        'drug' or 'reaction'
+
+    output_path: string
+        file the results are written to
+
+    workers: integer
+        number of searches run at the same time
+
+    max_reports: integer
+        number of reports to retrieve per search; default is REPORT_BUDGET
+
+    Returns:
+    --------
+    None
+    '''
+    terms = read_terms(terms_path)
+
+    fields = ['term', 'type', 'status', 'rows', 'seconds'] + SEARCH_STAGES
+    start = time.perf_counter()
+    done = 0
+
+    with open(output_path, 'w', newline='') as out, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+        if output_path.endswith('.csv'):
+            writer = csv.DictWriter(out, fieldnames=fields)
+            writer.writeheader()
+            write_result = writer.writerow
+        else:
+            write_result = lambda result: out.write(json.dumps(result) + '\n')
+
+        searches = [pool.submit(batch_search, term, search_type, max_reports)
+            for term in terms]
+        for search in as_completed(searches):
+            write_result(search.result())
+            out.flush()
+            done += 1
+
+    elapsed = time.perf_counter() - start
+    print(f"Searched {done} {search_type}s in {elapsed:.1f}s "
+        f"({done / elapsed if elapsed else 0:.2f} per second). Results in {output_path}")
+
+
+def run_refresh(names, search_type, workers=REFRESH_WORKERS, max_reports=None):
+    '''
+    Refreshes stored searches with refresh_search using a pool of
+    worker threads, printing one line per search as it finishes.
+
+    Parameters:
+    -----------
+    names: list
+        drugs or reactions to refresh; None refreshes every stored
+        search of search_type
+
+    search_type: string
+        'drug' or 'reaction'
+
+    workers: integer
+        number of searches refreshed at the same time
+
+    max_reports: integer
+        maximum number of new reports per search; default is REPORT_BUDGET
+
+    Returns:
+    --------
+    results: list
+        refresh_search result per name, in the order finished
+    '''
+    if names is None:
+        names = [row[0] for row in db_query(
+            "SELECT Name FROM Search_Totals WHERE Kind = ? ORDER BY Name", (search_type,))]
+
+    def refresh(name):
+        try:
+            return refresh_search(name, search_type, max_reports)
+        except FdaRateLimitError as error:
+            status = f"rate limited: {error}"
+        except Exception as error:
+            status = f"error: {error}"
+        return {'term': name, 'type': search_type, 'status': status,
+            'new_reports': 0, 'rows': 0, 'received': None, 'seconds': 0}
+
+    results = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for refreshed in as_completed([pool.submit(refresh, name) for name in names]):
+            result = refreshed.result()
+            results.append(result)
+            print(f"{result['term']}: {result['status']}, {result['new_reports']} new reports "
+                f"(received through {result['received'] or '-'}) in {result['seconds']}s")
+
+    return results
+
+
+### BULK INGEST ###
+# Loads the openFDA drug/event bulk download files
+# (https://open.fda.gov/apis/drug/event/download/) from local disk.
+
+def iter_json_results(stream):
+    '''
+    Generator yielding the reports of an openFDA JSON file one at a
+    time, reading the file in chunks so it is never loaded whole.
+    The file holds one object: {"meta": {...}, "results": [...]}
+
+    Parameters:
+    -----------
+    stream: file object
+        text stream of the JSON file
+
+    Returns:
+    --------
+    report: dictionary
+        each raw report in the "results" list, yielded in order
+
+    Raises:
+    -------
+    BulkFileError
+        if there is no "results" list, or the file ends before
+        the list does (e.g. a truncated download)
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+
+    # Skip ahead to the opening bracket of the "results" list
+    # (meta also has a "results" key, but its value is an object)
+    while True:
+        found = RESULTS_LIST_START.search(buffer)
+        if found:
+            pos = found.end()
+            break
+        chunk = stream.read(INGEST_CHUNK_SIZE)
+        if not chunk:
+            raise BulkFileError('no "results" list found')
+        buffer = buffer[-64:] + chunk # keep enough to match across chunks
+
+    while True:
+        # Skip separators between reports
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        try:
+            report, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as error: # report continues in the next chunk
+            chunk = stream.read(INGEST_CHUNK_SIZE)
+            if not chunk:
+                if pos == len(buffer):
+                    raise BulkFileError('file ends before the "results" list does') from None
+                raise BulkFileError(f"unreadable report: {error.msg} "
+                    f"({len(buffer) - pos} characters left unread)") from None
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        if not isinstance(report, dict):
+            raise BulkFileError(f"expected a report, found {type(report).__name__}")
+        yield report
+        pos = end
+
+
+def iter_bulk_reports(path):
+    '''
+    Generator yielding the reports in an openFDA bulk file, either
+    the downloaded .json.zip archive or an extracted .json file.
+
+    Parameters:
+    -----------
+    path: string
+        path of the bulk file
+
+    Returns:
+    --------
+    report: dictionary
+        each raw report in the file, yielded in order
+    '''
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.endswith('.json'):
+                    with archive.open(member) as raw:
+                        yield from iter_json_results(io.TextIOWrapper(raw, encoding='utf-8'))
+    else:
+        with open(path, encoding='utf-8') as f:
+            yield from iter_json_results(f)
+
+
+def bulk_report_usable(report):
+    '''
+    Checks that a bulk file report has the fields extract_columns
+    needs: a report id, a patient, and a name for every drug and
+    reaction listed.
+
+    Parameters:
+    -----------
+    report: dictionary
+        raw report
+
+    Returns:
+    --------
+    usable: boolean
+        True if the report can be loaded
+    '''
+    patient = report.get('patient')
+    if not report.get('safetyreportid') or not isinstance(patient, dict):
+        return False
+
+    return all(isinstance(drug, dict) and drug.get('medicinalproduct')
+            for drug in patient.get('drug', [])) and \
+        all(isinstance(reaction, dict) and reaction.get('reactionmeddrapt')
+            for reaction in patient.get('reaction', []))
+
+
+def ingest_bulk_file(path):
+    '''
+    Loads every report in an openFDA bulk file into Report_Summary,
+    INGEST_BATCH_REPORTS reports at a time, with a row for every
+    drug/reaction pair in each report.  After each batch the
+    number of reports loaded is saved in Ingest_Checkpoints (in the
+    same transaction), so an interrupted ingest resumes where it
+    stopped and a finished file is skipped.  Reports missing fields
+    (see bulk_report_usable) are skipped and counted.
+
+    Parameters:
+    -----------
+    path: string
+        path of the bulk file (.json.zip or .json)
+
+    Returns:
+    --------
+    reports: integer
+        number of reports in the file
+
+    Raises:
+    -------
+    BulkFileError
+        if the file is truncated or malformed (see iter_json_results);
+        the batches loaded before are kept
+    '''
+    file_key = os.path.abspath(path)
+    checkpoint = db_query('''SELECT Reports, Done FROM Ingest_Checkpoints
+        WHERE File = ?''', (file_key,))
+    done_reports, finished = checkpoint[0] if checkpoint else (0, 0)
+    if finished:
+        print(f"{path}: already ingested ({done_reports} reports).")
+        return done_reports
+
+    if done_reports:
+        print(f"{path}: resuming after {done_reports} reports.")
+
+    save_checkpoint = '''INSERT OR REPLACE INTO Ingest_Checkpoints
+        VALUES(?,?,?)'''
+    start = time.perf_counter()
+    reports = 0
+    skipped = 0
+    batch = []
+
+    for report in iter_bulk_reports(path):
+        reports += 1
+        if reports <= done_reports: # loaded before the interruption
+            continue
+        if not bulk_report_usable(report):
+            skipped += 1
+            continue
+        batch.append(report)
+
+        if len(batch) == INGEST_BATCH_REPORTS:
+            rows_per_sec = bulk_write(report_statements(extract_columns(batch, None, 'bulk')) +
+                [(save_checkpoint, [(file_key, reports, 0)])])
+            batch = []
+            rate = (reports - done_reports) / (time.perf_counter() - start)
+            print(f"{path}: {reports} reports ({rate:.0f} reports/sec, "
+                f"DB writes {rows_per_sec:.0f} rows/sec)")
+
+    bulk_write(report_statements(extract_columns(batch, None, 'bulk')) +
+        [(save_checkpoint, [(file_key, reports, 1)])])
+    print(f"{path}: finished, {reports} reports" +
+        (f" ({skipped} skipped: missing report id, patient, drug or reaction names)."
+            if skipped else "."))
+
+    return reports
+
+
+def ingest(paths, complete=False):
+    '''
+    Loads openFDA bulk files into the DB.  Directories are searched
+    for .zip and .json files.
+
+    Parameters:
+    -----------
+    paths: list
+        paths of bulk files or directories holding them
+
+    complete: boolean
+        the files are the whole FAERS dataset; once all are loaded
+        (and no numbered part is missing, see missing_bulk_parts)
+        this is recorded in Ingest_Complete
+
+    Returns:
+    --------
+    failed: list
+        files that could not be read in full (see BulkFileError)
+    '''
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                if name.endswith(('.zip', '.json'))))
+        else:
+            files.append(path)
+
+    failed = []
+    for path in files:
+        try:
+            ingest_bulk_file(path)
+        except BulkFileError as error:
+            print(f"{path}: stopped, {error}.  Reports up to the last batch are loaded; "
+                "run the ingest again with a good copy of the file to load the rest.")
+            failed.append(path)
+
+    if complete:
+        missing = missing_bulk_parts(files)
+        if missing or failed:
+            print("Not recorded as the complete dataset; " + (f"missing {len(missing)} "
+                f"file(s), e.g. {missing[0]}." if missing else
+                f"{len(failed)} file(s) could not be read in full."))
+            return failed
+        bulk_write([("DELETE FROM Ingest_Complete", None),
+            ("INSERT INTO Ingest_Complete VALUES(?,?)",
+                [(len(files), time.strftime('%Y-%m-%d %H:%M:%S'))])])
+        print(f"Recorded {len(files)} files as the complete dataset; searches "
+            "not made through the API will be counted locally.")
+
+    return failed
+
+
+def missing_bulk_parts(files):
+    '''
+    Returns the parts missing from numbered bulk files, which
+    openFDA names e.g. drug-event-0003-of-0029.json.zip.
+
+    Parameters:
+    -----------
+    files: list
+        paths of the bulk files
+
+    Returns:
+    --------
+    missing: list
+        names of the missing files (each in the directory of
+        the other parts of its set)
+    '''
+    part_sets = {}
+    for path in files:
+        match = BULK_PART_NAME.search(os.path.basename(path))
+        if match:
+            key = (os.path.dirname(os.path.abspath(path)), match.group(1),
+                match.group(3), match.group(4))
+            part_sets.setdefault(key, set()).add(int(match.group(2)))
+
+    missing = []
+    for (directory, prefix, count, suffix), parts in sorted(part_sets.items()):
+        for part in range(1, int(count) + 1):
+            if part not in parts:
+                missing.append(os.path.join(directory,
+                    f"{prefix}{part:0{len(count)}d}-of-{count}{suffix}"))
+
+    return missing
+
+
+### CHART OUTPUT ###
+
+def show_figure(chart, title, data, build_figure):
+    '''
+    Shows a chart in the browser or, when CHART_OUTPUT is 'html'
+    or 'json', writes it to CHART_DIR.  Written charts are named by
+    a hash of the chart type, title and the DB rows behind it, so
+    a repeat view of unchanged data finds the file instead of
+    building and rendering the figure again.
+
+    Parameters:
+    -----------
+    chart: string
+        chart type, e.g. 'bar_chart'
+
+    title: string
+        chart title
+
+    data: list
+        DB rows the chart is built from
+
+    build_figure: function
+        called with no arguments to build the plotly figure
+
+    Returns:
+    --------
+    path: string
+        file holding the chart, or None if it was shown in the browser
+    '''
+    if CHART_OUTPUT == 'show':
+        build_figure().show()
+        return None
+
+    key = hashlib.sha1(json.dumps([chart, title, data, CHART_PLOTLYJS],
+        default=str).encode()).hexdigest()[:20]
+    slug = re.sub(r'[^a-z0-9]+', '_', title.lower()).strip('_')[:60]
+    path = os.path.join(CHART_DIR, f"{chart}-{slug}-{key}.{CHART_OUTPUT}")
+
+    if os.path.exists(path):
+        chart_stats['cached'] += 1
+    else:
+        fig = build_figure()
+        os.makedirs(CHART_DIR, exist_ok=True)
+        # Written under a temporary name so other processes never see a partial file
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        if CHART_OUTPUT == 'html':
+            fig.write_html(temp_path,
+                include_plotlyjs=True if CHART_PLOTLYJS == 'inline' else CHART_PLOTLYJS)
+        else:
+            fig.write_json(temp_path)
+        os.replace(temp_path, path)
+        chart_stats['rendered'] += 1
+
+    if not chart_quiet:
+        print(f"Chart saved to {path}")
+
+    return path
+
+
+def render_charts(name, search_type, output, chart_dir):
+    '''
+    Writes every chart (bar, line, gender and age) for one drug or
+    reaction already stored in the DB.  Run in a worker process by
+    run_render.
+
+    Parameters:
+    -----------
+    name: string
+        name of the drug or reaction
+
+    search_type: string
+        'drug' or 'reaction'
+
+    output: string
+        'html' or 'json'
+
+    chart_dir: string
+        directory the charts are written to
+
+    Returns:
+    --------
+    result: dictionary
+        term, type, status ('ok' or 'no data'), number of charts
+        rendered and found cached, and seconds
+    '''
+    global CHART_OUTPUT, CHART_DIR, chart_quiet
+    CHART_OUTPUT, CHART_DIR, chart_quiet = output, chart_dir, True
+
+    start = time.perf_counter()
+    before = dict(chart_stats)
+    status = 'ok'
+
+    # Same names as the interactive search passes to the charts
+    if search_type == 'drug':
+        charts = {'drug_name': name.upper()}
+    else:
+        charts = {'reaction_name': name.capitalize()}
+
+    if not demographics(name, search_type)['rows'] and not top_counts(search_type, name, 1):
+        status = 'no data'
+    else:
+        for chart in (bar_chart, line_chart, gender_stats, bar_plot):
+            chart(**charts)
+
+    return {'term': name, 'type': search_type, 'status': status,
+        'rendered': chart_stats['rendered'] - before['rendered'],
+        'cached': chart_stats['cached'] - before['cached'],
+        'seconds': round(time.perf_counter() - start, 3)}
+
+
+def run_render(terms, search_type, output='html', chart_dir=CHART_DIR,
+        workers=RENDER_WORKERS):
+    '''
+    Writes every chart for many drugs or reactions, one worker
+    process per term at a time.  Only data already in the DB is
+    charted (run a search or the batch command first).
+
+    Parameters:
+    -----------
+    terms: list
+        names of the drugs or reactions
+
+    search_type: string
+        'drug' or 'reaction'
+
+    output: string
+        'html' or 'json'
+
+    chart_dir: string
+        directory the charts are written to
+
+    workers: integer
+        number of worker processes
+
+    Returns:
+    --------
+    None
+    '''
+    start = time.perf_counter()
+    rendered = cached = 0
+
+    # 'spawn' so workers open their own DB connections
+    with ProcessPoolExecutor(max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')) as pool:
+        renders = [pool.submit(render_charts, term, search_type, output, chart_dir)
+            for term in terms]
+        for render in as_completed(renders):
+            result = render.result()
+            rendered += result['rendered']
+            cached += result['cached']
+            print(f"{result['term']}: {result['status']}, {result['rendered']} rendered, "
+                f"{result['cached']} cached ({result['seconds']}s)")
+
+    print(f"Wrote {rendered} charts ({cached} already up to date) for {len(terms)} "
+        f"{search_type}s to {chart_dir} in {time.perf_counter() - start:.1f}s")
+
+
+def bar_chart(drug_name=None, reaction_name=None):
+    ''' Read information from the database to build a bar chart
+    which will display the top ten results for either top Reactions reported
+    or top Drugs per Reaction based on user request.
+
+    Parameters:
+    -----------
+    drug_name: string
+        name of the drug entered by the user
+        If search was for a reaction, default is None
+
+    reaction_name: string
+        name of the reaction entered by the user
+        If search was for a drug, default is None
+
+    Returns:
+    --------
+    None
+    '''
+
+    xvals = []
+    yvals = []
+
+    # retrieve top ten results of reactions per drug
+    if drug_name: # if 'drug' search
+        result = prefetched('top', 'drug', drug_name, lambda: top_rows('drug', drug_name))
+
+        # build bar chart from retrieved DB data (plotly)
+        for i in range(len(result)):
+            xvals.append(result[i][0])
+            yvals.append(result[i][1])
+
+        title = f"Top 10 Reactions for {drug_name}"
+        show_figure('bar_chart', title, result, lambda: go.Figure(
+            data=go.Bar(x=xvals, y=yvals),
+            layout=go.Layout(title=title, title_font_size=30)))
+
+    # retrieve top ten drugs related to reaction
+    if reaction_name: # if 'reaction' search
+        reaction_name = reaction_name.upper()
+        result = prefetched('top', 'reaction', reaction_name,
+            lambda: top_rows('reaction', reaction_name))
+
+        # build bar chart from retrieved DB data (plotly)
+        for i in range(len(result)):
+            xvals.append(result[i][0])
+            yvals.append(result[i][1])
+
+        title = f"Top 10 Reported Drugs for {reaction_name}"
+        show_figure('bar_chart', title, result, lambda: go.Figure(
+            data=go.Bar(x=xvals, y=yvals),
+            layout=go.Layout(title=title, title_font_size=30)))
+
+
+
+def line_chart(drug_name=None, reaction_name=None):
+    ''' Read information from the database to build a line chart
+    which will display the top ten results for either top Reactions reported
+    or top Drugs per Reaction based on user request.
+
+    Parameters:
+    -----------
+    drug_name: string
+        name of the drug entered by the user
+        If search was for a reaction, default is None
+
+    reaction_name: string
+        name of the reaction entered by the user
+        If search was for a drug, default is None
+
+    Returns:
+    --------
+    None
+    '''
+
+    xvals = []
+    yvals = []
+
+    # retrieve top ten results of reactions per drug
+    # if user initiated a search to find the most reported reactions for a drug
+    if drug_name:
+        result = prefetched('top', 'drug', drug_name, lambda: top_rows('drug', drug_name))
+
+        # build bar chart from retrieved DB data (plotly)
+        for i in range(len(result)):
+            xvals.append(result[i][0])
+            yvals.append(result[i][1])
+
+        title = f"Top 10 Reactions for {drug_name}"
+        show_figure('line_chart', title, result, lambda: go.Figure(
+            data=go.Scatter(x=xvals, y=yvals),
+            layout=go.Layout(title=title, title_font_size=30)))
+
+    # retrieve top ten most commonly reported drug for a reaction
+    # if user initiated a search to find most reported drugs for a reaction
+    if reaction_name:
+        reaction_name = reaction_name.upper()
+        result = prefetched('top', 'reaction', reaction_name,
+            lambda: top_rows('reaction', reaction_name))
 
-    if summary_list:
-        write_Drug_DB(summary_list)
+        # build (scatter)line chart from retrieved DB data (plotly)
+        for i in range(len(result)):
+            xvals.append(result[i][0])
+            yvals.append(result[i][1])
 
+        title = f"Top 10 Reported Drugs for {reaction_name}"
+        show_figure('line_chart', title, result, lambda: go.Figure(
+            data=go.Scatter(x=xvals, y=yvals),
+            layout=go.Layout(title=title, title_font_size=30)))
 
-def create_database():
-    '''
-    Creates the database and tables that will be used to store
-    the results from the user's search(es).  If the tables/database
-    already exists, there will be no update.
-    There are five tables:
-    (1) Drugs - table of all drugs searched by user
-    (2) Reactions - table of all reactions searched by user
-    (3) Report_Summary - table of drugs and associated reactions
-        in addition to the FDA's report id for the drug/reaction combo
-        listing Report ID, Age, and Gender
-    (4) Reactions_per_Drug - table of drugs that list the number of times
-        a reaction has been reported for a specified drug
-    (5) Drug_per_Reaction - table that lists the number of times a Drug
-        has been reported for a specified Reaction
+
+def bar_plot(drug_name=None, reaction_name=None):
+    ''' Read information from the database to build a bar plot
+    which will display the min, median, and max age listed in
+    reports for a particular 'drug' or 'reaction'.
 
     Parameters:
     -----------
-    None
+    drug_name: string
+        name of the drug entered by the user
+        If search was for a reaction, default is None
+
+    reaction_name: string
+        name of the reaction entered by the user
+        If search was for a drug, default is None
 
     Returns:
     --------
     None
     '''
 
-    # Connect to database
-    conn = sqlite3.connect('FDA_DRUGS.db')
+    # Box plots are drawn from the stored age histograms, so the
+    # cost does not grow with the number of reports
+    if drug_name:
+        stats = search_demographics(drug_name, 'drug')['ages']
+        title = f"Age Distribution for {drug_name.upper()}"
+        show_figure('bar_plot', title, stats, lambda: age_box_figure(stats, title))
+
+    if reaction_name:
+        stats = search_demographics(reaction_name, 'reaction')['ages']
+        title = f"Age Distribution for {reaction_name.upper()}"
+        show_figure('bar_plot', title, stats, lambda: age_box_figure(stats, title))
 
-    # Create DB cursor
-    cur = conn.cursor()
 
-    ### CREATION OF THREE TABLES IN DB (IF NOT EXIST) ###
-    # Create the Report Summary table if does not already exist
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS "Report_Summary" (
-	"ReportID"	INTEGER NOT NULL,
-	"Drugs"	TEXT NOT NULL,
-	"Reactions"	TEXT NOT NULL,
-    "Age" INTEGER,
-    "Gender" INTEGER,
-    UNIQUE (ReportID, Drugs, Reactions, Age, Gender) ON CONFLICT IGNORE
-)
+def age_box_figure(stats, title):
     '''
-    )
+    Builds the age box plot from precomputed statistics instead
+    of every age.  Outlying ages are not drawn as points.
 
-    # Create the Drugs List table if does not already exist
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS "Drugs" (
-	"Drugs"	TEXT NOT NULL UNIQUE,
-	PRIMARY KEY("Drugs")
-    )
+    Parameters:
+    -----------
+    stats: dictionary
+        age statistics (see age_box_stats)
+
+    title: string
+        chart title
+
+    Returns:
+    --------
+    fig: plotly Figure
     '''
-    )
+    layout = go.Layout(title=title, yaxis_title="Age")
+    if not stats:
+        return go.Figure(layout=layout)
 
-    # Create the Reaction List table if does not already exist
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS "Reactions" (
-	"Reactions"	TEXT NOT NULL UNIQUE,
-	PRIMARY KEY("Reactions")
-    )
+    box_data = go.Box(name="Age", q1=[stats['q1']], median=[stats['median']],
+        q3=[stats['q3']], lowerfence=[stats['lowerfence']],
+        upperfence=[stats['upperfence']])
+
+    return go.Figure(data=box_data, layout=layout)
+
+
+def sample_reportids(drug_name=None, reaction_name=None):
+    ''' Will present a list of report ids as samples which the user can choose
+    to request on his or her own through the Freedom of Information Act (FOIA).
+
+    Parameters:
+    -----------
+    drug_name: string
+        name of the drug entered by the user
+        If search was for a reaction, default is None
+
+    reaction_name: string
+        name of the reaction entered by the user
+        If search was for a drug, default is None
+
+    Returns:
+    --------
+    None
     '''
-    )
 
-    # Create the Reaction Summary table if does not already exist
-    # List count of reactions reported for a specified drug
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS "Reactions_per_Drug" (
-	"Drugs"	TEXT NOT NULL,
-	"Reactions"	TEXT NOT NULL,
-	"Reaction_Count"	INTEGER NOT NULL
-    )
+    if drug_name:
+        result = [(report_id,) for report_id in
+            search_demographics(drug_name, 'drug')['sample_ids'][:10]]
+
+        print(f"\nSample List of Reports for {drug_name}.  Can be retrieved through FOIA request.")
+        print("-" * 79)
+        for i in range(len(result)):
+            print(f"{i + 1}. {result[i][0]}")
+
+    if reaction_name:
+        result = [(report_id,) for report_id in
+            search_demographics(reaction_name, 'reaction')['sample_ids'][:10]]
+
+        print(f"\nSample List of Reports for {reaction_name}.  Can be retrieved through FOIA request.")
+        print("-" * 79)
+        for i in range(len(result)):
+            print(f"{i + 1}. {result[i][0]}")
+
+
+    return result
+
+
+def gender_stats(drug_name=None, reaction_name=None):
+    ''' Will present a pie chart displaying the gender distribution
+    related the results returned for a Drug or Reaction.
+
+    Parameters:
+    -----------
+    drug_name: string
+        name of the drug entered by the user
+        If search was for a reaction, default is None
+
+    reaction_name: string
+        name of the reaction entered by the user
+        If search was for a drug, default is None
+
+    Returns:
+    --------
+    None
     '''
-    )
+    gender = []
+    gender_count = []
+    gender_result = []
+
+    if drug_name: # if 'drug' search
+        # Gender Names and counts for pie chart
+        gender_result = list(search_demographics(drug_name, 'drug')['genders'].items())
+        result = gender_result
+
+        for i in range(len(gender_result)):
+            gender.append(gender_result[i][0])
+            gender_count.append(gender_result[i][1])
+        title = f"Gender Distribution for Reports related to {drug_name}"
+        show_figure('gender_stats', title, gender_result,
+            lambda: px.pie(values=gender_count, names=gender, title=title))
+
+    if reaction_name: # if 'reaction' search
+        # Gender Names and counts for pie chart
+        gender_result = list(search_demographics(reaction_name, 'reaction')['genders'].items())
+        result = gender_result
+
+        for i in range(len(gender_result)):
+            gender.append(gender_result[i][0])
+            gender_count.append(gender_result[i][1])
+        title = f"Gender Distribution for Reports related to {reaction_name.upper()}"
+        show_figure('gender_stats', title, gender_result,
+            lambda: px.pie(values=gender_count, names=gender, title=title))
+
+
+    return result
+
+def open_cache_store(db_path):
+    '''
+    Opens the on-disk cache store.  Each cache is a key/value
+    table in a SQLite file, so adding an entry writes only that
+    entry instead of rewriting the whole cache.  Caches left over
+    from the previous JSON files are imported once.
+
+    Parameters:
+    -----------
+    db_path: string
+        path of the SQLite cache file
 
-    # Create the Drug Summary table if does not already exist
-    # List count of Drugs reported for a specified Reaction
-    cur.execute('''
-    CREATE TABLE IF NOT EXISTS "Drug_per_Reaction" (
-	"Reactions"	TEXT NOT NULL,
-	"Drugs"	TEXT NOT NULL,
-	"Drug_Count"	INTEGER NOT NULL
+    Returns:
+    --------
+    conn: sqlite3.Connection
+        connection to the cache store
+    '''
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL") # writes are crash-safe and readers never block
+    # Entries are read straight from a memory map of the file instead of
+    # being copied through SQLite's page cache
+    conn.execute(f"PRAGMA mmap_size={CACHE_MMAP_SIZE}")
+
+    for table, json_path in CACHE_TABLES.items():
+        conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS "{table}" (
+            "Key"   TEXT NOT NULL PRIMARY KEY,
+            "Value" TEXT NOT NULL
+        )
+        '''
+        )
+
+        # Bookkeeping columns for the eviction policy (added to older stores too)
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+        if 'Size' not in columns:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "Size" INTEGER NOT NULL DEFAULT 0')
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "Created" REAL NOT NULL DEFAULT 0')
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "Accessed" REAL NOT NULL DEFAULT 0')
+            conn.execute(f'UPDATE "{table}" SET Size = length(Value), Created = ?, Accessed = ?',
+                (time.time(), time.time()))
+        if 'Format' not in columns:
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "Format" INTEGER NOT NULL DEFAULT {CACHE_FORMAT_RAW}')
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "Codec" TEXT NOT NULL DEFAULT \'none\'')
+        if 'Dataset' not in columns: # FDA meta.last_updated of the entry ('' if unknown)
+            conn.execute(f'ALTER TABLE "{table}" ADD COLUMN "Dataset" TEXT NOT NULL DEFAULT \'\'')
+        conn.execute(f'''
+        CREATE INDEX IF NOT EXISTS "{table}_lru" ON "{table}" ("Accessed", "Size")
+        '''
+        )
+
+        import_json_cache(conn, table, json_path)
+
+    # FDA requests sent per (UTC) day, see acquire_fda_token
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS "fda_quota" (
+        "Day"       TEXT NOT NULL PRIMARY KEY,
+        "Requests"  INTEGER NOT NULL
     )
     '''
     )
 
-def write_Reaction_DB(summary_list):
+    conn.commit()
+
+    return conn
+
+
+def import_json_cache(conn, table, json_path):
     '''
-    Writes to the database the results returned for the
-    number of Reactions reported for a particular Drug
+    Imports a cache file written by earlier versions of this program
+    (a single JSON dictionary) into the cache store, then renames the
+    file so the import only happens once.
 
     Parameters:
     -----------
-    summary_list: list
-        The list of results returned with the count of reactions
-        for a specified drug.
+    conn: sqlite3.Connection
+        connection to the cache store
+
+    table: string
+        cache table to import into
+
+    json_path: string
+        path of the old JSON cache file
 
     Returns:
     --------
     None
     '''
+    if not os.path.isfile(json_path):
+        return None
 
-    # Re-connect to database
-    conn = sqlite3.connect('FDA_DRUGS.db')
-
-    # Re-create DB cursor
-    cur = conn.cursor()
-
-    # Binding variables to prevent SQL injection (& account for special characters)
-    for i in range(len(summary_list)):
-        cur.execute("INSERT OR IGNORE INTO Reactions_per_Drug VALUES(?,?,?)",\
-            (summary_list[i][0], summary_list[i][1], summary_list[i][2]))
+    with open(json_path) as f:
+        old_cache = json.load(f)
 
-    conn.commit() # commit updates to DB
+    now = time.time()
+    with conn: # single transaction, so a crash leaves the JSON file to retry
+        for key, value in old_cache.items():
+            fmt = CACHE_FORMAT_RAW
+            if table == 'drugs_cache' and 'results' in value:
+                value = {'results': project_reports(value['results'])}
+                fmt = CACHE_FORMAT_PROJECTED
+            encoded, codec = encode_cache_value(value)
+            conn.execute(f'''INSERT OR IGNORE INTO "{table}"
+                (Key, Value, Size, Created, Accessed, Format, Codec)
+                VALUES(?,?,?,?,?,?,?)''',
+                (key, encoded, len(encoded), now, now, fmt, codec))
+        enforce_cache_limits(conn, table)
 
-    conn.close() # close connection to DB
+    os.replace(json_path, json_path + ".imported")
 
 
-def write_Drug_DB(summary_list):
+def encode_cache_value(value):
     '''
-    Writes to the database the results returned for the
-    number of times a Drug was reported for a particular Reaction
+    Serializes a cache entry as compact JSON, compressed with
+    the codec selected by CACHE_CODEC.
 
     Parameters:
     -----------
-    summary_list: list
-        The list of results returned with the report count of a Drug
-        reported for a specified Reaction.
+    value: dictionary
+        contents of the cache entry
 
     Returns:
     --------
-    None
+    encoded: tuple
+        (encoded entry, name of the codec used)
     '''
+    encoded = json.dumps(value, separators=(',', ':'))
 
-    # Re-connect to database
-    conn = sqlite3.connect('FDA_DRUGS.db')
+    if CACHE_CODEC == 'zlib':
+        return (zlib.compress(encoded.encode('utf-8'), 6), 'zlib')
+    elif CACHE_CODEC == 'lzma':
+        return (lzma.compress(encoded.encode('utf-8')), 'lzma')
 
-    # Re-create DB cursor
-    cur = conn.cursor()
+    return (encoded, 'none')
 
-    # Binding variables to prevent SQL injection (& account for special characters)
-    for i in range(len(summary_list)):
-        cur.execute("INSERT OR IGNORE INTO Drug_per_Reaction VALUES(?,?,?)",\
-            (summary_list[i][1], summary_list[i][0], summary_list[i][2]))
 
-    conn.commit() # commit updates to DB
+def decode_cache_value(encoded, codec):
+    '''
+    Reverses encode_cache_value.
+
+    Parameters:
+    -----------
+    encoded: string or bytes
+        entry as stored in the cache table
 
-    conn.close() # close connection to DB
+    codec: string
+        codec the entry was stored with ('none', 'zlib' or 'lzma')
 
+    Returns:
+    --------
+    value: dictionary
+        contents of the cache entry
+    '''
+    if codec == 'zlib':
+        encoded = zlib.decompress(encoded)
+    elif codec == 'lzma':
+        encoded = lzma.decompress(encoded)
 
+    return json.loads(encoded)
 
 
-def write_to_DB(user_search, search_results, search_type):
+def project_reports(raw_data):
     '''
-    Writes to the database the results that were returned
-    based on the user's search.  List of results containing
-    also the Report ID will be written to the Drugs_Reaction table.
-    If the user searched for a reaction, then that reaction name
-    will be added to the Reaction table.  If the user searched for a
-    drug, then that drug will be added to the Drug table.
+    Reduces raw FDA reports to the fields used by results_loop_drug
+    and results_loop_reactions, one compact list per report:
+    [report_id, age, gender, [reactions], [drugs]]
+    Age and gender are None when the report does not list them.
 
     Parameters:
     -----------
-    user_search: string
-        name of the drug or reaction entered by the user
+    raw_data: list
+        raw results returned from FDA
 
-    search_results: list
-        results returned from the FDA based on the drug name
-        or reaction entered by the user
+    Returns:
+    --------
+    compact_list: list
+        list of compact reports
+    '''
+    compact_list = []
+    for report in raw_data:
+        patient = report['patient']
+        compact_list.append([
+            report['safetyreportid'],
+            patient.get('patientonsetage'),
+            patient.get('patientsex'),
+            [reaction['reactionmeddrapt'] for reaction in patient.get('reaction', [])],
+            [drug['medicinalproduct'] for drug in patient.get('drug', [])]
+        ])
 
-    search_type: string
-        will identify if the search was by 'reaction' or 'drug'.
+    return compact_list
+
+
+def expand_reports(compact_list):
+    '''
+    Rebuilds reports in the nested layout of the FDA API from the
+    compact reports made by project_reports, containing only the
+    projected fields.
+
+    Parameters:
+    -----------
+    compact_list: list
+        list of compact reports
 
     Returns:
     --------
-    None
+    raw_data: list
+        reports in the FDA API layout
     '''
+    raw_data = []
+    for report_id, age, gender, reactions, found_drugs in compact_list:
+        patient = {
+            'reaction': [{'reactionmeddrapt': reaction} for reaction in reactions],
+            'drug': [{'medicinalproduct': drug} for drug in found_drugs]
+        }
+        if age is not None:
+            patient['patientonsetage'] = age
+        if gender is not None:
+            patient['patientsex'] = gender
+        raw_data.append({'safetyreportid': report_id, 'patient': patient})
 
-    # Re-connect to database
-    conn = sqlite3.connect('FDA_DRUGS.db')
+    return raw_data
 
-    # Re-create DB cursor
-    cur = conn.cursor()
 
-    # Writing data to the Drug or Reaction table and Report Summary table
-    # Binding variables to prevent SQL injection (& account for special characters)
-    if search_type == 'drug':
-        cur.execute("INSERT OR IGNORE INTO Drugs VALUES(?)", (user_search,))
-        # cur.execute(f"INSERT OR IGNORE INTO Drugs VALUES ('{user_search}')")
-        for i in range(len(search_results)):
-            cur.execute("INSERT OR IGNORE INTO Report_Summary VALUES(?,?,?,?,?)",\
-                (search_results[i][0], search_results[i][1],\
-                    search_results[i][2], search_results[i][3],\
-                        search_results[i][4]))
-        conn.commit() # commit updates to DB
-    elif search_type == 'reaction':
-        cur.execute("INSERT OR IGNORE INTO Reactions VALUES(?)", (user_search,))
-        # cur.execute(f"INSERT OR IGNORE INTO Reactions VALUES ('{user_search}')")
-        for i in range(len(search_results)):
-            cur.execute("INSERT OR IGNORE INTO Report_Summary VALUES(?,?,?,?,?)",\
-                (search_results[i][0], search_results[i][1],\
-                    search_results[i][2], search_results[i][3],\
-                        search_results[i][4]))
-        conn.commit() # commit updates to DB
+def get_cache_store():
+    '''
+    Returns the connection to the cache store, opening it the first
+    time a cache is used.  Nothing is read from the cache at startup;
+    entries are looked up through the table's key index and decoded
+    only when requested.
 
-    conn.close() # close connection to DB
+    Parameters:
+    -----------
+    None
 
+    Returns:
+    --------
+    cache_conn: sqlite3.Connection
+        connection to the cache store
+    '''
+    global cache_conn
+
+    with cache_lock:
+        if cache_conn is None:
+            conn = open_cache_store(cache_path)
+            # Kept current by cache_put/cache_get/enforce_cache_limits from here on
+            for table in CACHE_TABLES:
+                cache_sizes[table] = list(conn.execute(
+                    f'SELECT COUNT(*), COALESCE(SUM(Size), 0) FROM "{table}"').fetchone())
+            cache_conn = conn
+
+    return cache_conn
 
-def bar_chart(drug_name=None, reaction_name=None):
-    ''' Read information from the database to build a bar chart
-    which will display the top ten results for either top Reactions reported
-    or top Drugs per Reaction based on user request.
+
+def cache_get(table, key, any_dataset=False):
+    '''
+    Reads one entry from a cache table.  Entries older than
+    CACHE_TTL are removed instead of returned, and entries from an
+    FDA dataset older than the current one (see dataset_version,
+    only checked when the key is found) are treated as missing.
+    Entries from an unknown dataset (cached before versions were
+    recorded) are stamped with the current one.  Reading an entry
+    marks it as recently used for LRU eviction.
 
     Parameters:
     -----------
-    drug_name: string
-        name of the drug entered by the user
-        If search was for a reaction, default is None
+    table: string
+        cache table to read from
 
-    reaction_name: string
-        name of the reaction entered by the user
-        If search was for a drug, default is None
+    key: string
+        key from key,value pair in cache
+
+    any_dataset: boolean
+        return the entry even if it is from an older dataset
 
     Returns:
     --------
-    None
+    entry: tuple
+        (format of the entry, content of key),
+        or None if not found
     '''
+    conn = get_cache_store()
+    now = time.time()
+    with cache_lock:
+        row = conn.execute(f'''SELECT Value, Created, Format, Codec, Dataset, Size
+            FROM "{table}" WHERE Key = ?''', (key,)).fetchone()
+
+        if row is None:
+            cache_stats[table]['misses'] += 1
+            return None
 
-    xvals = []
-    yvals = []
+        if CACHE_TTL and now - row[1] > CACHE_TTL: # stale entry
+            with conn:
+                conn.execute(f'DELETE FROM "{table}" WHERE Key = ?', (key,))
+            cache_sizes[table][0] -= 1
+            cache_sizes[table][1] -= row[5]
+            cache_stats[table]['expired'] += 1
+            cache_stats[table]['misses'] += 1
+            return None
 
-    # retrieve top ten results of reactions per drug
-    if drug_name: # if 'drug' search
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT Reactions, Reaction_Count
-            FROM Reactions_per_Drug
-            WHERE Drugs = ?
-            LIMIT 10
-            """
-        result = cur.execute(query, (drug_name,)).fetchall()
+    # May ask the FDA, so not while holding cache_lock
+    current_dataset = dataset_version() if not any_dataset else None
+    dataset = row[4]
+    with cache_lock:
+        if current_dataset and dataset and dataset != current_dataset: # FAERS updated since
+            cache_stats[table]['outdated'] += 1
+            cache_stats[table]['misses'] += 1
+            return None
 
-        # build bar chart from retrieved DB data (plotly)
-        for i in range(len(result)):
-            xvals.append(result[i][0])
-            yvals.append(result[i][1])
+        with conn:
+            conn.execute(f'UPDATE "{table}" SET Accessed = ? WHERE Key = ?',
+                (now, key))
+            if current_dataset and not dataset:
+                conn.execute(f'UPDATE "{table}" SET Dataset = ? WHERE Key = ? AND Dataset = ?',
+                    (current_dataset, key, ''))
+        cache_stats[table]['hits'] += 1
 
-        bar_data =go.Bar(x=xvals, y=yvals)
-        basic_layout = go.Layout(title=f"Top 10 Reactions for {drug_name}",
-            title_font_size=30)
-        fig = go.Figure(data=bar_data, layout=basic_layout)
-        fig.show()
+    return (row[2], decode_cache_value(row[0], row[3]))
 
-    # retrieve top ten drugs related to reaction
-    if reaction_name: # if 'reaction' search
-        reaction_name = reaction_name.upper()
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT Drugs, Drug_Count
-            FROM Drug_per_Reaction
-            WHERE Reactions = ?
-            LIMIT 10
-            """
-        result = cur.execute(query, (reaction_name,)).fetchall()
 
-        # build bar chart from retrieved DB data (plotly)
-        for i in range(len(result)):
-            xvals.append(result[i][0])
-            yvals.append(result[i][1])
+def cache_put(table, key, value, fmt=None, dataset=None):
+    '''
+    Writes one entry to a cache table, replacing any
+    existing entry for the key, then evicts the least
+    recently used entries if the table is over its limits.
+
+    Parameters:
+    -----------
+    table: string
+        cache table to write to
 
-        bar_data =go.Bar(x=xvals, y=yvals)
-        basic_layout = go.Layout(title=f"Top 10 Reported Drugs for {reaction_name}",
-            title_font_size=30)
-        fig = go.Figure(data=bar_data, layout=basic_layout)
-        fig.show()
+    key: string
+        key from key,value pair in cache
 
-    con.close() # close connection to DB
+    value: dictionary
+        contents of key
 
+    fmt: integer
+        format of the entry (CACHE_FORMAT_RAW or
+        CACHE_FORMAT_PROJECTED); default is CACHE_FORMAT_RAW
 
-def line_chart(drug_name=None, reaction_name=None):
-    ''' Read information from the database to build a line chart
-    which will display the top ten results for either top Reactions reported
-    or top Drugs per Reaction based on user request.
+    dataset: string
+        FDA dataset version (meta.last_updated) the value came from
+
+    Returns:
+    --------
+    None
+    '''
+    if fmt is None:
+        fmt = CACHE_FORMAT_RAW
+    encoded, codec = encode_cache_value(value)
+    now = time.time()
+
+    conn = get_cache_store()
+    with cache_lock:
+        with conn:
+            replaced = conn.execute(f'SELECT Size FROM "{table}" WHERE Key = ?',
+                (key,)).fetchone()
+            conn.execute(f'''INSERT OR REPLACE INTO "{table}"
+                (Key, Value, Size, Created, Accessed, Format, Codec, Dataset)
+                VALUES(?,?,?,?,?,?,?,?)''',
+                (key, encoded, len(encoded), now, now, fmt, codec, dataset or ''))
+            cache_sizes[table][0] += replaced is None
+            cache_sizes[table][1] += len(encoded) - (replaced[0] if replaced else 0)
+            enforce_cache_limits(conn, table)
+
+
+def dataset_version():
+    '''
+    Returns the version (meta.last_updated) of the FDA drug/event
+    dataset.  It is learned from every FDA response cached and, at
+    most once per DATASET_PROBE_INTERVAL, probed with a one-report
+    request (sent without the API key).
 
     Parameters:
     -----------
-    drug_name: string
-        name of the drug entered by the user
-        If search was for a reaction, default is None
-
-    reaction_name: string
-        name of the reaction entered by the user
-        If search was for a drug, default is None
+    None
 
     Returns:
     --------
-    None
+    version: string
+        e.g. '2024-01-30', or None if not known (e.g. offline)
     '''
+    with dataset_lock:
+        now = time.time()
+        if dataset_state['checked'] is None \
+                or now - dataset_state['checked'] > DATASET_PROBE_INTERVAL:
+            dataset_state['checked'] = now
+            try:
+                response = fda_get(FDA_EVENT_URL + "?limit=1")
+                note_dataset_version(json.loads(response.text)['meta']['last_updated'])
+            except Exception as error: # keep using the cache as it is
+                logger.info("could not check the FDA dataset version: %s", error)
 
-    xvals = []
-    yvals = []
-
-    # retrieve top ten results of reactions per drug
-    # if user initiated a search to find the most reported reactions for a drug
-    if drug_name:
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT Reactions, Reaction_Count
-            FROM Reactions_per_Drug
-            WHERE Drugs = ?
-            LIMIT 10
-            """
-        result = cur.execute(query, (drug_name,)).fetchall()
+        return dataset_state['version']
 
-        # build bar chart from retrieved DB data (plotly)
-        for i in range(len(result)):
-            xvals.append(result[i][0])
-            yvals.append(result[i][1])
 
-        bar_data =go.Scatter(x=xvals, y=yvals)
-        basic_layout = go.Layout(title=f"Top 10 Reactions for {drug_name}",
-            title_font_size=30)
-        fig = go.Figure(data=bar_data, layout=basic_layout)
-        fig.show()
+def note_dataset_version(version):
+    '''
+    Records a dataset version seen in an FDA response, if it is
+    newer than the one known.
 
-    # retrieve top ten most commonly reported drug for a reaction
-    # if user initiated a search to find most reported drugs for a reaction
-    if reaction_name:
-        reaction_name = reaction_name.upper()
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT Drugs, Drug_Count
-            FROM Drug_per_Reaction
-            WHERE Reactions = ?
-            LIMIT 10
-            """
-        result = cur.execute(query, (reaction_name,)).fetchall()
+    Parameters:
+    -----------
+    version: string
+        meta.last_updated of the response
 
-        # build (scatter)line chart from retrieved DB data (plotly)
-        for i in range(len(result)):
-            xvals.append(result[i][0])
-            yvals.append(result[i][1])
+    Returns:
+    --------
+    version: string
+        the version, unchanged
+    '''
+    with dataset_lock:
+        if version and version > (dataset_state['version'] or ''):
+            dataset_state['version'] = version
 
-        bar_data =go.Scatter(x=xvals, y=yvals)
-        basic_layout = go.Layout(title=f"Top 10 Reported Drugs for {reaction_name}",
-            title_font_size=30)
-        fig = go.Figure(data=bar_data, layout=basic_layout)
-        fig.show()
+    return version
 
-    con.close() # close connection to DB
 
-def bar_plot(drug_name=None, reaction_name=None):
-    ''' Read information from the database to build a bar plot
-    which will display the min, median, and max age listed in
-    reports for a particular 'drug' or 'reaction'.
+def load_fda_quota(day):
+    '''
+    Returns the number of FDA requests recorded for a day,
+    by this and earlier runs.
 
     Parameters:
     -----------
-    drug_name: string
-        name of the drug entered by the user
-        If search was for a reaction, default is None
-
-    reaction_name: string
-        name of the reaction entered by the user
-        If search was for a drug, default is None
+    day: string
+        UTC date, YYYY-MM-DD
 
     Returns:
     --------
-    None
+    requests: integer
     '''
+    conn = get_cache_store()
+    with cache_lock:
+        row = conn.execute('SELECT Requests FROM fda_quota WHERE Day = ?', (day,)).fetchone()
 
-    # retrieve top ten results of reactions per drug
-    if drug_name:
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT Age
-            FROM Report_Summary
-            WHERE Drugs = ?
-            AND Age <= 100
-            """
-        result = cur.execute(query, (drug_name.upper(),)).fetchall()
+    return row[0] if row else 0
 
-        # Build box plot from query using plotly and pandas
-        df = DataFrame(result,columns=['Age'])
-        fig = px.box(df, y="Age", title=f"Age Distribution for {drug_name.upper()}")
-        fig.show()
 
-    if reaction_name:
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT Age
-            FROM Report_Summary
-            WHERE Reactions = ?
-            AND Age <= 100
-            """
-        result = cur.execute(query, (reaction_name.capitalize(),)).fetchall()
+def save_fda_quota():
+    '''
+    Adds the FDA requests counted since the last save to the day's
+    total in the cache store.  Totals are added to rather than
+    replaced, so runs at the same time are all counted.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    None
+    '''
+    if not fda_quota['unsaved']:
+        return None
 
-        # Build box plot from query using plotly and pandas
-        df = DataFrame(result,columns=['Age'])
-        fig = px.box(df, y="Age", title=f"Age Distribution for {reaction_name.upper()}")
-        fig.show()
+    conn = get_cache_store()
+    with cache_lock:
+        with conn:
+            conn.execute('''INSERT INTO fda_quota VALUES(?, ?) ON CONFLICT (Day)
+                DO UPDATE SET Requests = Requests + excluded.Requests''',
+                (fda_quota['day'], fda_quota['unsaved']))
+    fda_quota['unsaved'] = 0
 
-    con.close() # close connection to DB
 
-def sample_reportids(drug_name=None, reaction_name=None):
-    ''' Will present a list of report ids as samples which the user can choose
-    to request on his or her own through the Freedom of Information Act (FOIA).
+def enforce_cache_limits(conn, table):
+    '''
+    Evicts least recently used entries from a cache table until it
+    holds at most CACHE_MAX_ENTRIES entries and CACHE_MAX_BYTES bytes.
+    The table's size is taken from cache_sizes rather than counted.
+    Must be called inside the caller's transaction, holding cache_lock.
 
     Parameters:
     -----------
-    drug_name: string
-        name of the drug entered by the user
-        If search was for a reaction, default is None
+    conn: sqlite3.Connection
+        connection to the cache store
 
-    reaction_name: string
-        name of the reaction entered by the user
-        If search was for a drug, default is None
+    table: string
+        cache table to trim
 
     Returns:
     --------
     None
     '''
+    entries, total_bytes = cache_sizes[table]
 
-    if drug_name:
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT ReportID
-            FROM Report_Summary
-            WHERE Drugs = ?
-            GROUP BY ReportID
-            LIMIT 10
-            """
-        result = cur.execute(query, (drug_name,)).fetchall()
+    if entries <= CACHE_MAX_ENTRIES and total_bytes <= CACHE_MAX_BYTES:
+        return None
 
-        print(f"\nSample List of Reports for {drug_name}.  Can be retrieved through FOIA request.")
-        print("-" * 79)
-        for i in range(len(result)):
-            print(f"{i + 1}. {result[i][0]}")
+    evicted = []
+    for key, size in conn.execute(f'SELECT Key, Size FROM "{table}" ORDER BY Accessed'):
+        if entries <= CACHE_MAX_ENTRIES and total_bytes <= CACHE_MAX_BYTES:
+            break
+        evicted.append((key,))
+        entries -= 1
+        total_bytes -= size
 
-    if reaction_name:
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT ReportID
-            FROM Report_Summary
-            WHERE Reactions = ?
-            GROUP BY ReportID
-            LIMIT 10
-            """
-        result = cur.execute(query, (reaction_name.capitalize(),)).fetchall()
+    conn.executemany(f'DELETE FROM "{table}" WHERE Key = ?', evicted)
+    cache_sizes[table] = [entries, total_bytes]
+    cache_stats[table]['evictions'] += len(evicted)
 
-        print(f"\nSample List of Reports for {reaction_name}.  Can be retrieved through FOIA request.")
-        print("-" * 79)
-        for i in range(len(result)):
-            print(f"{i + 1}. {result[i][0]}")
 
-    con.close() # close connection to DB
+def get_cache_stats():
+    '''
+    Reports the hit/miss/eviction counters for this session and
+    the current size of each cache table.
 
-    return result
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    stats: dictionary
+        per cache table: hits, misses, evictions, expired,
+        outdated, entries and bytes
+    '''
+    get_cache_store()
+    stats = {}
+    with cache_lock:
+        for table in CACHE_TABLES:
+            entries, total_bytes = cache_sizes[table]
+            stats[table] = dict(cache_stats[table], entries=entries, bytes=total_bytes)
 
+    return stats
 
-def gender_stats(drug_name=None, reaction_name=None):
-    ''' Will present a pie chart displaying the gender distribution
-    related the results returned for a Drug or Reaction.
+
+def print_cache_stats():
+    '''
+    Prints the cache counters for this session and the size of
+    each cache table (see get_cache_stats).
 
     Parameters:
     -----------
-    drug_name: string
-        name of the drug entered by the user
-        If search was for a reaction, default is None
-
-    reaction_name: string
-        name of the reaction entered by the user
-        If search was for a drug, default is None
+    None
 
     Returns:
     --------
     None
     '''
-    gender = []
-    gender_count = []
-    gender_result = []
-
-    if drug_name: # if 'drug' search
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT Gender, COUNT(*) AS 'num'
-            FROM Report_Summary
-            WHERE Drugs = ?
-            GROUP BY Gender
-            """
-        result = cur.execute(query, (drug_name,)).fetchall()
-
-        # Changing numeric values to Gender Names for pie chart
-        for p in range(len(result)):
-            if result[p][0] == 0:
-                gender_result.append(('Unknown',result[p][1]))
-            elif result[p][0] == 1:
-                gender_result.append(('Male',result[p][1]))
-            elif result[p][0] == 2:
-                gender_result.append(('Female',result[p][1]))
+    for table, stats in get_cache_stats().items():
+        lookups = stats['hits'] + stats['misses']
+        hit_rate = f"{stats['hits'] / lookups:.0%}" if lookups else '-'
+        print(f"{table}: {stats['entries']} entries, {stats['bytes'] / 1024 / 1024:.1f} MB; "
+            f"{stats['hits']} hits, {stats['misses']} misses (hit rate {hit_rate}), "
+            f"{stats['expired']} expired, {stats['outdated']} outdated, "
+            f"{stats['evictions']} evicted")
 
-        for i in range(len(gender_result)):
-            gender.append(gender_result[i][0])
-            gender_count.append(gender_result[i][1])
-        fig = px.pie(values=gender_count, names=gender,\
-            title=f"Gender Distribution for Reports related to {drug_name}")
-        fig.show()
 
-    if reaction_name: # if 'reaction' search
-        reaction_name = reaction_name.capitalize()
-        con = sqlite3.connect("FDA_DRUGS.db")
-        cur = con.cursor()
-        query = """
-            SELECT Gender, COUNT(*) AS 'num'
-            FROM Report_Summary
-            WHERE Reactions = ?
-            GROUP BY Gender
-            """
-        result = cur.execute(query, (reaction_name,)).fetchall()
+def compact_cache():
+    '''
+    Reclaims the space left by replaced and evicted cache entries
+    (see the compact-cache command).  SQLite rebuilds the file
+    inside a transaction, so an interrupted compaction leaves the
+    cache unchanged.
 
-        # Changing numeric values to Gender Names for pie chart
-        for p in range(len(result)):
-            if result[p][0] == 0:
-                gender_result.append(('Unknown',result[p][1]))
-            elif result[p][0] == 1:
-                gender_result.append(('Male',result[p][1]))
-            elif result[p][0] == 2:
-                gender_result.append(('Female',result[p][1]))
+    Parameters:
+    -----------
+    None
 
-        for i in range(len(gender_result)):
-            gender.append(gender_result[i][0])
-            gender_count.append(gender_result[i][1])
-        fig = px.pie(values=gender_count, names=gender,\
-            title=f"Gender Distribution for Reports related to {reaction_name.upper()}")
-        fig.show()
+    Returns:
+    --------
+    reclaimed: integer
+        bytes by which the cache file shrank
+    '''
+    conn = get_cache_store()
+    with cache_lock:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        pages_before = conn.execute("PRAGMA page_count").fetchone()[0]
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        pages_after = conn.execute("PRAGMA page_count").fetchone()[0]
 
-    con.close() # close connection to DB
+    return (pages_before - pages_after) * page_size
 
-    return result
 
-def check_cache(key):
+def check_cache(key, any_dataset=False):
     '''
     Checks the cache to see if the data has already been run
     and stored in cache.  Returns value if found.
+    Entries cached as full FDA responses by earlier versions
+    are converted to compact reports the first time they are read.
 
     Parameters:
     -----------
     key: string
         key from key,value pair in cache
 
+    any_dataset: boolean
+        return the entry even if it is from an older dataset
+
     Returns:
     --------
-    value: string
-        content of key in dict, if found
+    value: dictionary
+        reports for key in the FDA API layout (projected
+        fields only), if found
     '''
-    if key in json_cache:
-        return json_cache[key]
-    else:
+    entry = cache_get('drugs_cache', key, any_dataset)
+    if entry is None:
         return None
 
+    fmt, value = entry
+    if fmt == CACHE_FORMAT_RAW: # migrate old entry
+        dataset = value.get('meta', {}).get('last_updated')
+        value = {'results': project_reports(value['results'])}
+        cache_put('drugs_cache', key, value, CACHE_FORMAT_PROJECTED, dataset)
+
+    return {'results': expand_reports(value['results'])}
+
 
 def add_to_cache(key, value):
     '''
-    Adds key, value pair to json_cache file
+    Adds key, value pair to the drugs cache.  Only the fields
+    used by this program are kept (see project_reports).
 
     Parameters:
     -----------
     key: string
         key from key,value pair in cache
 
-    value: string
-        contents of key
+    value: dictionary
+        response returned from FDA
 
     Returns:
     --------
     None
     '''
-    # creating key,value pair for cache file
-    json_cache[key] = value
-
-    # writing new key,value pair to cache file
-    with open("drugs_cache.json", "w") as cache:
-        json.dump(json_cache, cache, indent=2)
+    compact = {'results': project_reports(value['results'])}
+    dataset = note_dataset_version(value.get('meta', {}).get('last_updated'))
+    cache_put('drugs_cache', key, compact, CACHE_FORMAT_PROJECTED, dataset)
 
 
 def check_summary_cache(key):
@@ -1051,33 +4436,30 @@ def check_summary_cache(key):
     value: string
         content of key in dict, if found
     '''
-    if key in json_summary_cache:
-        return json_summary_cache[key]
-    else:
+    entry = cache_get('summary_cache', key)
+    if entry is None:
         return None
 
+    return entry[1]
+
 def add_to_summary_cache(key, value):
     '''
-    Adds key, value pair to json_cache file
+    Adds key, value pair to the summary cache
 
     Parameters:
     -----------
     key: string
         key from key,value pair in cache
 
-    value: string
-        contents of key
+    value: dictionary
+        response returned from FDA
 
     Returns:
     --------
     None
     '''
-    # creating key,value pair for cache file
-    json_summary_cache[key] = value
-
-    # writing new key,value pair to cache file
-    with open("summary_cache.json", "w") as summary_cache:
-        json.dump(json_summary_cache, summary_cache, indent=2)
+    dataset = note_dataset_version(value.get('meta', {}).get('last_updated'))
+    cache_put('summary_cache', key, value, dataset=dataset)
 
 
 def create_table(fda_results, search_type, user_search):
@@ -1125,21 +4507,92 @@ def create_table(fda_results, search_type, user_search):
 
 # See References at end of program for Reddit
 # OATH2 research
-app = Flask(__name__)
+app = None # created on first use by get_app
+service_app = None # created on first use by get_service_app
 log = logging.getLogger('werkzeug')
 log.setLevel(logging.ERROR)
 log.disabled = True
 oauth_state=''
 oauth_code=''
 
-@app.route('/')
+def get_app():
+    '''
+    Returns the Flask app serving the Reddit OAuth callback,
+    creating it (and importing Flask) on first use.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    app: flask.Flask
+    '''
+    global app
+
+    if app is None:
+        quiet_server_banner()
+        app = flask.Flask(__name__)
+        app.add_url_rule('/', view_func=get_auth_parameters)
+
+    return app
+
+
+def get_service_app():
+    '''
+    Returns the Flask app serving the query service (see serve),
+    creating it on first use.  It is separate from the OAuth
+    callback app, whose '/' route stops the server.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    service_app: flask.Flask
+    '''
+    global service_app
+
+    if service_app is None:
+        quiet_server_banner()
+        service_app = flask.Flask('drugs_service')
+        # Searching writes to the DB, so it is not done on GET
+        service_app.add_url_rule('/api/<kind>/<name>', view_func=api_search,
+            methods=['POST'])
+        service_app.add_url_rule('/api/<kind>/<name>', view_func=api_stored)
+        service_app.add_url_rule('/api/<kind>/<name>/<view>', view_func=api_view)
+        service_app.add_url_rule('/api/cache-stats', view_func=api_cache_stats)
+        # Each request runs on a new thread; don't leave its connection open
+        service_app.teardown_appcontext(close_read_db)
+
+    return service_app
+
+
+def quiet_server_banner():
+    '''
+    Replaces click's output functions, used by Flask for the
+    server start-up banner, with echo/secho below.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    None
+    '''
+    import click
+    click.echo = echo
+    click.secho = secho
+
 def get_auth_parameters():
     global oauth_state
     global oauth_code
-    oauth_state = request.args.get('state')
-    oauth_code = request.args.get('code')
+    oauth_state = flask.request.args.get('state')
+    oauth_code = flask.request.args.get('code')
 
-    func = request.environ.get('werkzeug.server.shutdown')
+    func = flask.request.environ.get('werkzeug.server.shutdown')
     func()
     return '<script>window.onload=window.close()</script>'
 
@@ -1149,10 +4602,10 @@ def make_authorization_url():
 	from uuid import uuid4
 	state = str(uuid4())
 	save_created_state(state)
-	params = {"client_id": CLIENT_ID,
+	params = {"client_id": get_credential('REDDIT_CLIENT_ID'),
 			  "response_type": "code",
 			  "state": state,
-			  "redirect_uri": REDIRECT_URI,
+			  "redirect_uri": get_credential('REDIRECT_URI'),
 			  "duration": "permanent",
 			  "scope": "identity,edit,flair,history,modconfig,modflair,modlog,\
                 modposts,modwiki,mysubreddits,privatemessages,read,report,\
@@ -1179,9 +4632,6 @@ def secho(text, file=None, nl=None, err=None, color=None, **styles):
 def echo(text, file=None, nl=None, err=None, color=None, **styles):
    pass
 
-click.echo = echo
-click.secho = secho
-
 def init_tokens_for_Reddit():
     '''Initial creation of tokens for access to
     the Reddit application
@@ -1203,15 +4653,16 @@ def init_tokens_for_Reddit():
     # information found on stackoverflow
     #input("test")
     webbrowser.open(make_authorization_url())
-    app.run(port=8080)
+    get_app().run(port=8080)
     #print(oauth_state)
     #print(oauth_code)
 
-    client_auth = requests.auth.HTTPBasicAuth(CLIENT_ID, CLIENT_SECRET)
+    client_auth = requests.auth.HTTPBasicAuth(get_credential('REDDIT_CLIENT_ID'),
+        get_credential('REDDIT_CLIENT_SECRET'))
     post_data = {"grant_type": "authorization_code", "code": oauth_code,\
-        "redirect_uri": REDIRECT_URI}
+        "redirect_uri": get_credential('REDIRECT_URI')}
     headers = {"User-Agent": "ChangeMeClient/0.1 by bluewolfhi1817"}
-    response = requests.post("https://ssl.reddit.com/api/v1/access_token",\
+    response = http_post("https://ssl.reddit.com/api/v1/access_token",\
         auth=client_auth, data=post_data, headers=headers)
     output = response.json()
 
@@ -1220,35 +4671,92 @@ def init_tokens_for_Reddit():
     tokens = (access_token, refresh_token)
     #print(output)
 
-    return tokens
+    return tokens
+
+def token_refresh(refresh_token):
+    '''Refreshing the Reddit token after it expires.
+
+    Parameters:
+    -----------
+    refresh_token: string
+        token provided by Reddit OATH to refresh the
+        access token
+
+    Returns:
+    --------
+    access_token: string
+        the new access token to be used for Reddit access
+    '''
+    # Instructions from Reddit github
+    client_auth = requests.auth.HTTPBasicAuth(get_credential('REDDIT_CLIENT_ID'),
+        get_credential('REDDIT_CLIENT_SECRET'))
+    post_data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
+    headers = {"User-Agent": f"ChangeMeClient/0.1 by {get_credential('REDDIT_USERNAME')}"}
+    response = http_post("https://www.reddit.com/api/v1/access_token",\
+        auth=client_auth, data=post_data, headers=headers)
+    output = response.json()
+    access_token = output['access_token']
+    # print(output)
+
+    return access_token
+
+def get_Reddit_token(refresh_token):
+    '''
+    Returns a Reddit access token, refreshing it (see
+    token_refresh) only when the last one is older than
+    REDDIT_TOKEN_LIFETIME.
+
+    Parameters:
+    -----------
+    refresh_token: string
+        token provided by Reddit OATH to refresh the
+        access token
+
+    Returns:
+    --------
+    access_token: string
+        the access token to be used for Reddit access
+    '''
+    with reddit_token_lock:
+        if reddit_token['refresh_token'] != refresh_token \
+                or time.monotonic() >= reddit_token['expires']:
+            reddit_token['access_token'] = token_refresh(refresh_token)
+            reddit_token['refresh_token'] = refresh_token
+            reddit_token['expires'] = time.monotonic() + REDDIT_TOKEN_LIFETIME
+
+        return reddit_token['access_token']
 
-def token_refresh(refresh_token):
-    '''Refreshing the Reddit token after it expires.
+
+def search_Reddit(access_token, drug_name):
+    '''
+    Searches Reddit for link posts from the past month about a drug
+    and its reactions.
 
     Parameters:
     -----------
-    refresh_token: string
-        token provided by Reddit OATH to refresh the
-        access token
+    access_token: string
+        access token required to retrieve information from
+        the Reddit application
+
+    drug_name: string
+        the name of the drug which the user searched
 
     Returns:
     --------
-    access_token: string
-        the new access token to be used for Reddit access
+    output: dictionary
+        Reddit search response
     '''
-    # Instructions from Reddit github
-    client_auth = requests.auth.HTTPBasicAuth(CLIENT_ID, CLIENT_SECRET)
-    post_data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
-    headers = {"User-Agent": f"ChangeMeClient/0.1 by {REDDIT_USERNAME}"}
-    response = requests.post("https://www.reddit.com/api/v1/access_token",\
-        auth=client_auth, data=post_data, headers=headers)
-    output = response.json()
-    access_token = output['access_token']
-    # print(output)
+    headers = {"Authorization": f"bearer {access_token}",\
+        "User-Agent": f"ChangeMeClient/0.1 by {get_credential('REDDIT_USERNAME')}"}
+
+    url_search = "https://oauth.reddit.com/search.json?limit=100&t=month&type=link&q="
+    url_end = "+AND+reaction"
+
+    response = http_get(url_search + drug_name + url_end, headers=headers)
+    return response.json()
 
-    return access_token
 
-def for_Reddit_retrieve(access_token, drug_name):
+def for_Reddit_retrieve(access_token, drug_name, output=None):
     '''Refreshing the Reddit token after it expires.
 
     Parameters:
@@ -1261,6 +4769,10 @@ def for_Reddit_retrieve(access_token, drug_name):
         the name of the drug which the user searched and is
         attempting to find more information on Reddit
 
+    output: dictionary
+        Reddit search response already retrieved (see
+        search_Reddit); searched here if None
+
     Returns:
     --------
     URL_list: list
@@ -1270,16 +4782,9 @@ def for_Reddit_retrieve(access_token, drug_name):
     url_list = []
     title_list = []
 
-    headers = {"Authorization": f"bearer {access_token}",\
-        "User-Agent": f"ChangeMeClient/0.1 by {REDDIT_USERNAME}"}
-
-    url_search = "https://oauth.reddit.com/search.json?limit=100&t=month&type=link&q="
-    url_end = "+AND+reaction"
-
     try: # if there are comments found for the 'drug' for Reddit search
-        response = requests.get(url_search + drug_name + url_end,\
-            headers=headers)
-        output = response.json()
+        if output is None:
+            output = search_Reddit(access_token, drug_name)
 
         # Loop through to find the first 10 for display (keep in Dict for now)
         # Check to see if there are records
@@ -1392,8 +4897,10 @@ def for_Reddit_interactive(drug_name, refresh_token):
     --------
     None
     '''
-    access_token = token_refresh(refresh_token)
-    response_Dict = for_Reddit_retrieve(access_token, drug_name)
+    # Threads searched in the background after the drug search, if any
+    output = prefetched('reddit', 'drug', drug_name,
+        lambda: search_Reddit(get_Reddit_token(refresh_token), drug_name))
+    response_Dict = for_Reddit_retrieve(None, drug_name, output)
 
     if response_Dict: # if comments were found for Reddit search
         print_for_Reddit(response_Dict, drug_name)
@@ -1466,28 +4973,721 @@ def select_interactive(search_type):
 
     return search_select
 
-#### END OF FUNCTIONS ###
 
-# Initializing setup of cache
-json_cache = {}
-path = 'drugs_cache.json'
+### PREFETCH ###
+# While the user reads the menu after a search, the data behind each
+# selection is computed in background threads; the chart and Reddit
+# functions wait for it (or compute it themselves if it was not started).
+
+def start_prefetch(name, kind, refresh_token=None):
+    '''
+    Starts computing the presentation data of a completed search
+    in the background: the top ten list, the demographic summary,
+    the chart modules and, for a drug with Reddit access, the
+    Reddit token and thread search.  Work left from the previous
+    search is cancelled if it has not started.
+
+    Parameters:
+    -----------
+    name: string
+        name of the drug or reaction searched
+
+    kind: string
+        'drug' or 'reaction'
+
+    refresh_token: string
+        Reddit refresh token; None without Reddit access
+
+    Returns:
+    --------
+    None
+    '''
+    global prefetch_pool
+
+    parts = {
+        'top': lambda: top_rows(kind, name),
+        'demographics': lambda: demographics(name, kind),
+        'charts': warm_chart_modules
+    }
+    if kind == 'drug' and refresh_token:
+        parts['reddit'] = lambda: search_Reddit(get_Reddit_token(refresh_token), name)
+
+    with prefetch_lock:
+        if prefetch_pool is None:
+            prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS,
+                thread_name_prefix='prefetch')
+        for future in prefetch_state['parts'].values():
+            future.cancel()
+        prefetch_state['search'] = (kind, name.upper())
+        prefetch_state['parts'] = {part: prefetch_pool.submit(compute)
+            for part, compute in parts.items()}
+
+
+def prefetched(part, kind, name, compute):
+    '''
+    Returns a part of the presentation data prefetched for a
+    search (see start_prefetch), waiting for it if it is still
+    being computed.  Otherwise, or if the prefetch failed, the
+    part is computed now.
+
+    Parameters:
+    -----------
+    part: string
+        'top', 'demographics' or 'reddit'
+
+    kind: string
+        'drug' or 'reaction'
+
+    name: string
+        name of the drug or reaction
+
+    compute: function
+        computes the part without the prefetch
+
+    Returns:
+    --------
+    value:
+        the part (as returned by compute)
+    '''
+    with prefetch_lock:
+        future = None
+        if prefetch_state['search'] == (kind, name.upper()):
+            future = prefetch_state['parts'].get(part)
+
+    if future is not None and not future.cancelled():
+        try:
+            return future.result()
+        except Exception as error:
+            logger.info("prefetch of %s for %s failed: %s", part, name, error)
+
+    return compute()
+
+
+def search_demographics(name, kind):
+    '''
+    Returns the demographic summary of a search (see demographics),
+    prefetched if available.
+
+    Parameters:
+    -----------
+    name: string
+        name of the drug or reaction
+
+    kind: string
+        'drug' or 'reaction'
+
+    Returns:
+    --------
+    summary: dictionary
+        see demographics
+    '''
+    return prefetched('demographics', kind, name, lambda: demographics(name, kind))
+
+
+def warm_chart_modules():
+    '''
+    Imports the plotly modules used by the charts and builds
+    throwaway figures, so that the first chart shown does not
+    wait for them.
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    None
+    '''
+    go.Figure(data=go.Bar(x=[], y=[]))
+    px.pie(values=[1], names=['warm-up'])
+
+
+### QUERY SERVICE ###
+# JSON endpoints on their own Flask app (see get_service_app),
+# backed by the same searches and DB tables as the interactive menus:
+#   POST /api/<drug|reaction>/<name>        search (FDA/cache -> DB)
+#   /api/<drug|reaction>/<name>             what the DB holds for the name
+#   /api/<drug|reaction>/<name>/top         top reactions/drugs by count
+#   /api/<drug|reaction>/<name>/gender      reports by gender
+#   /api/<drug|reaction>/<name>/ages        age quantiles
+#   /api/<drug|reaction>/<name>/reports     sample report ids
+#   /api/cache-stats                        cache counters and sizes
+
+def top_counts(kind, name, limit=10):
+    '''
+    Returns the most reported reactions for a drug, or the most
+    reported drugs for a reaction, as stored by the last search.
+
+    Parameters:
+    -----------
+    kind: string
+        'drug' or 'reaction'
+
+    name: string
+        name of the drug or reaction
+
+    limit: integer
+        number of results
+
+    Returns:
+    --------
+    counts: list
+        list of {'name', 'count'} dictionaries, highest count first
+    '''
+    return [{'name': row[0], 'count': row[1]} for row in top_rows(kind, name, limit)]
+
+
+def top_rows(kind, name, limit=10):
+    '''
+    Reads the most reported reactions for a drug, or the most
+    reported drugs for a reaction, from the summary tables
+    (see top_counts).
+
+    Parameters:
+    -----------
+    kind: string
+        'drug' or 'reaction'
+
+    name: string
+        name of the drug or reaction
+
+    limit: integer
+        number of results
+
+    Returns:
+    --------
+    result: list
+        (name, count) rows, highest count first
+    '''
+    if kind == 'drug':
+        query = """
+            SELECT Reactions, Reaction_Count
+            FROM Reactions_per_Drug
+            WHERE Drugs = ?
+            LIMIT ?
+            """
+    else:
+        query = """
+            SELECT Drugs, Drug_Count
+            FROM Drug_per_Reaction
+            WHERE Reactions = ?
+            LIMIT ?
+            """
+    return db_query(query, (name.upper(), limit))
+
+
+def gender_split(kind, name):
+    '''
+    Returns the number of stored report rows by gender
+    for a drug or reaction (as shown by gender_stats).
+
+    Parameters:
+    -----------
+    kind: string
+        'drug' or 'reaction'
+
+    name: string
+        name of the drug or reaction
+
+    Returns:
+    --------
+    genders: dictionary
+        gender name -> count
+    '''
+    return demographics(name, kind)['genders']
+
+
+def age_quantiles(kind, name):
+    '''
+    Returns the min, quartiles and max of the ages stored for
+    a drug or reaction (the values behind bar_plot).
+
+    Parameters:
+    -----------
+    kind: string
+        'drug' or 'reaction'
+
+    name: string
+        name of the drug or reaction
+
+    Returns:
+    --------
+    ages: dictionary
+        'count', 'min', 'q1', 'median', 'q3' and 'max'
+        (None when no ages are stored)
+    '''
+    stats = demographics(name, kind)['ages']
+
+    return {key: stats.get(key, 0 if key == 'count' else None)
+        for key in ('count', 'min', 'q1', 'median', 'q3', 'max')}
+
+
+def report_ids(kind, name, limit=10):
+    '''
+    Returns sample report ids for a drug or reaction
+    (as listed by sample_reportids).
+
+    Parameters:
+    -----------
+    kind: string
+        'drug' or 'reaction'
+
+    name: string
+        name of the drug or reaction
+
+    limit: integer
+        number of report ids (at most DEMOGRAPHICS_SAMPLE_IDS)
+
+    Returns:
+    --------
+    ids: list
+        report ids
+    '''
+    return demographics(name, kind)['sample_ids'][:limit]
+
+
+def stored_search(kind, name):
+    '''
+    Returns what the DB holds for a drug or reaction, without
+    searching: the number of stored reports, and the number of
+    reports the FDA has and the latest receivedate retrieved if
+    it was searched (see record_search_total).
+
+    Parameters:
+    -----------
+    kind: string
+        'drug' or 'reaction'
+
+    name: string
+        name of the drug or reaction
+
+    Returns:
+    --------
+    stored: dictionary
+        kind -> name, 'reports', 'fda_total' and 'received'
+        (None if not searched); None if nothing is stored
+    '''
+    name = name.strip()
+    if kind == 'drug':
+        reports_query = "SELECT SUM(Reports) FROM Drug_Names WHERE Drugs = ? COLLATE NOCASE"
+    else:
+        reports_query = ("SELECT SUM(Reports) FROM Reaction_Names "
+            "WHERE Reactions = ? COLLATE NOCASE")
+    reports = db_query(reports_query, (name,))[0][0]
+    totals = db_query("SELECT Total, Received FROM Search_Totals WHERE Kind = ? AND Name = ?",
+        (kind, name.upper()))
+    if not reports and not totals:
+        return None
+
+    fda_total, received = totals[0] if totals else (None, None)
+    return {kind: name, 'reports': reports or 0, 'fda_total': fda_total, 'received': received}
+
+
+SERVICE_VIEWS = {'top': top_counts, 'gender': gender_split,
+    'ages': age_quantiles, 'reports': report_ids, 'demographics':
+    lambda kind, name: demographics(name, kind)}
+
+
+def json_response(payload, status=200):
+    '''
+    Builds a JSON response with an ETag; answers 304 Not Modified
+    when the client already holds the same body (If-None-Match).
+
+    Parameters:
+    -----------
+    payload: dictionary or string
+        data to return, or an already encoded JSON body
+
+    status: integer
+        HTTP status code
+
+    Returns:
+    --------
+    response: flask.Response
+    '''
+    body = payload if isinstance(payload, str) else json.dumps(payload, sort_keys=True)
+    etag = hashlib.sha1(body.encode()).hexdigest()
+
+    if status == 200 and etag in flask.request.if_none_match:
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(body, status=status, mimetype='application/json')
+    response.set_etag(etag)
+
+    return response
+
+
+def cached_view(key, build):
+    '''
+    Returns the JSON body for a request from the service cache,
+    building and caching it if it is missing or stale.  Entries
+    are stale once the DB has been written to since they were
+    built, or after SERVICE_CACHE_TTL seconds.
+
+    Parameters:
+    -----------
+    key: string
+        request path and query string
+
+    build: function
+        called with no arguments to produce the payload
+
+    Returns:
+    --------
+    body: string
+        JSON body
+    '''
+    now = time.time()
+    with service_cache_lock:
+        entry = service_cache.get(key)
+        if entry and entry[0] == db_write_stats['writes'] \
+                and now - entry[1] < SERVICE_CACHE_TTL:
+            service_cache.move_to_end(key)
+            return entry[2]
+
+    writes = db_write_stats['writes'] # before reading, so a racing write expires it
+    body = json.dumps(build(), sort_keys=True)
+
+    with service_cache_lock:
+        service_cache[key] = (writes, now, body)
+        service_cache.move_to_end(key)
+        while len(service_cache) > SERVICE_CACHE_ENTRIES:
+            service_cache.popitem(last=False)
+
+    return body
+
+
+def api_stored(kind, name):
+    if kind not in SERVICE_KINDS:
+        return json_response({'error': f"unknown search type '{kind}'"}, 404)
+
+    stored = stored_search(kind, name)
+    if stored is None:
+        return json_response({'error': f"nothing stored for {kind} '{name}'; "
+            f"POST /api/{kind}/{name} to search the FDA"}, 404)
+
+    return json_response(stored)
+
+
+def api_search(kind, name):
+    if kind not in SERVICE_KINDS:
+        return json_response({'error': f"unknown search type '{kind}'"}, 404)
+
+    result = batch_search(name, kind, flask.request.args.get('max_reports', type=int))
+    if result['status'] == 'not found':
+        return json_response(result, 404)
+    if result['status'].startswith('rate limited'):
+        return json_response(result, 429)
+    if result['status'] != 'ok':
+        return json_response(result, 502)
+
+    return json_response(result)
+
+
+def api_view(kind, name, view):
+    if kind not in SERVICE_KINDS or view not in SERVICE_VIEWS:
+        return json_response({'error': f"unknown view '{kind}/{view}'"}, 404)
+
+    args = {}
+    if view in ('top', 'reports'):
+        args['limit'] = min(flask.request.args.get('limit', 10, type=int), 1000)
+
+    body = cached_view(flask.request.full_path,
+        lambda: {kind: name, view: SERVICE_VIEWS[view](kind, name, **args)})
+
+    return json_response(body)
+
+
+def api_cache_stats():
+    return json_response(get_cache_stats())
+
+
+def serve(host='127.0.0.1', port=SERVICE_PORT):
+    '''
+    Runs the query service until interrupted.  Each request is
+    handled on its own thread, with a read-only DB connection that
+    is closed when the request ends.
+
+    Parameters:
+    -----------
+    host: string
+        address to listen on
+
+    port: integer
+        port to listen on
+
+    Returns:
+    --------
+    None
+    '''
+    print(f"Serving FAERS queries on http://{host}:{port}/api/ (FDA: {FDA_BASE_URL})")
+    get_service_app().run(host=host, port=port, threaded=True)
+
+
+# Stand-in for the FDA drug/event API, for load testing the service
+# without using the FDA quota: FDA_BASE_URL=http://127.0.0.1:8090
+def get_stub_app():
+    '''
+    Returns a Flask app answering FDA drug/event requests
+    with synthetic reports (see stub_drug_events).
+
+    Parameters:
+    -----------
+    None
+
+    Returns:
+    --------
+    fda_stub: flask.Flask
+    '''
+    fda_stub = flask.Flask('fda_stub')
+    fda_stub.add_url_rule('/drug/event.json', view_func=stub_drug_events)
+
+    return fda_stub
+
+def stub_drug_events():
+    request = flask.request
+    search = request.args.get('search', '')
+    count = request.args.get('count')
+
+    if count:
+        terms = STUB_REACTIONS if 'reaction' in count else STUB_DRUGS
+        return {'meta': {'last_updated': STUB_LAST_UPDATED},
+            'results': [{'term': term.upper(), 'count': (len(terms) - i) * 100}
+            for i, term in enumerate(terms)]}
+
+    skip = request.args.get('skip', 0, type=int)
+    limit = request.args.get('limit', 1, type=int)
+    first_id = zlib.crc32(search.encode()) % 100000 * 100000
+    # Every report was received on the dataset date
+    received = STUB_LAST_UPDATED.replace('-', '')
+    since = re.search(r'receivedate:\[(\d{8})', search)
+    available = 0 if since and since.group(1) > received else STUB_REPORTS
+
+    results = []
+    for i in range(skip, min(skip + limit, available)):
+        results.append({'safetyreportid': str(first_id + i), 'receivedate': received, 'patient': {
+            'patientonsetage': str(18 + i % 70),
+            'patientsex': str(i % 3),
+            'reaction': [{'reactionmeddrapt': STUB_REACTIONS[i % len(STUB_REACTIONS)]},
+                {'reactionmeddrapt': STUB_REACTIONS[(i * 3 + 1) % len(STUB_REACTIONS)]}],
+            'drug': [{'medicinalproduct': STUB_DRUGS[i % len(STUB_DRUGS)]},
+                {'medicinalproduct': STUB_DRUGS[(i * 5 + 2) % len(STUB_DRUGS)]}]}})
+
+    if not results:
+        return {'error': {'code': 'NOT_FOUND', 'message': 'No matches found!'}}, 404
+
+    return {'meta': {'last_updated': STUB_LAST_UPDATED,
+        'results': {'skip': skip, 'limit': limit, 'total': available}},
+        'results': results}
+
+
+def check_startup(budget_ms=STARTUP_BUDGET_MS, runs=STARTUP_RUNS):
+    '''
+    Measures the time from starting a new Python process to the
+    point where the interactive search shows its first prompt
+    (importing this module and opening the DB), and checks it
+    against a budget.  Also reports any slow module that was
+    imported on the way, and any chart query that scans a whole
+    table in a newly created DB (see check_query_plans).
+
+    Parameters:
+    -----------
+    budget_ms: integer
+        allowed milliseconds to the first prompt
 
-json_summary_cache = {}
-summary_path = 'summary_cache.json'
+    runs: integer
+        number of runs; the median is compared to the budget
 
-# if the cache file exist, read from that file
-if os.path.isfile(path):
-    with open('drugs_cache.json') as f:
-        json_cache = json.load(f)
+    Returns:
+    --------
+    within_budget: boolean
+        True if the median run and imported modules are within budget
+        and every chart query uses an index
+    '''
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    code = ("import sys, json; import drugs; drugs.create_database(); "
+        f"print(json.dumps(sorted({{name.split('.')[0] for name in sys.modules}} & "
+        f"set({STARTUP_HEAVY_MODULES!r}))))")
+    env = dict(os.environ, PYTHONPATH=module_dir + os.pathsep + os.environ.get('PYTHONPATH', ''))
+
+    timings = []
+    for i in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', code], env=env,
+            capture_output=True, text=True, check=True).stdout
+        timings.append((time.perf_counter() - start) * 1000)
+    heavy_modules = json.loads(output.splitlines()[-1])
+
+    # Query plans of a DB built from scratch (all migrations applied)
+    code = ("import json; import drugs; drugs.create_database(); "
+        "print(json.dumps(drugs.check_query_plans()))")
+    with tempfile.TemporaryDirectory() as db_dir:
+        output = subprocess.run([sys.executable, '-c', code], env=env, cwd=db_dir,
+            capture_output=True, text=True, check=True).stdout
+    full_scans = json.loads(output.splitlines()[-1])
+
+    median_ms = sorted(timings)[len(timings) // 2]
+    within_budget = median_ms <= budget_ms and not heavy_modules and not full_scans
+    print(f"Startup to first prompt: median {median_ms:.0f} ms over {runs} runs "
+        f"(min {min(timings):.0f} ms, budget {budget_ms} ms)")
+    if heavy_modules:
+        print(f"Imported at startup: {', '.join(heavy_modules)}")
+    for query, detail in full_scans:
+        print(f"Full table scan ({detail}): {query}")
+    print("OK" if within_budget else "OVER BUDGET")
+
+    return within_budget
+
+
+def run_command(args):
+    '''
+    Runs the program non-interactively, as selected by the
+    command line arguments, e.g.
+        python drugs.py ingest drug-event-0001-of-0029.json.zip
+
+    Parameters:
+    -----------
+    args: list
+        command line arguments (without the program name)
+
+    Returns:
+    --------
+    None
+    '''
+    parser = argparse.ArgumentParser(prog='drugs.py',
+        description='Search FAERS (FDA Adverse Event Reporting System) data.  '
+            'Run without arguments for the interactive search.')
+    parser.add_argument('--verbose', action='store_true',
+        help='log every DB write and the stage timings of every search')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = commands.add_parser('ingest',
+        help='load openFDA drug/event bulk download files into the DB')
+    ingest_parser.add_argument('paths', nargs='+',
+        help='.json.zip or .json files, or directories holding them')
+    ingest_parser.add_argument('--complete', action='store_true',
+        help='the files are the whole FAERS dataset; count searches locally')
+
+    batch_parser = commands.add_parser('batch',
+        help='search every drug or reaction listed in a file')
+    batch_parser.add_argument('terms', help='file with one drug or reaction per line')
+    batch_parser.add_argument('--type', choices=['drug', 'reaction'], default='drug',
+        help='what the file lists (default: drug)')
+    batch_parser.add_argument('--output', default='batch_results.jsonl',
+        help='results file, .csv or JSON lines (default: batch_results.jsonl)')
+    batch_parser.add_argument('--workers', type=int, default=BATCH_WORKERS,
+        help=f'searches run at the same time (default: {BATCH_WORKERS})')
+    batch_parser.add_argument('--max-reports', type=int, default=None,
+        help='reports retrieved per search (default: FDA_REPORT_BUDGET)')
+
+    refresh_parser = commands.add_parser('refresh',
+        help='add reports received since stored drugs or reactions were searched')
+    refresh_parser.add_argument('names', nargs='*', help='drugs or reactions')
+    refresh_parser.add_argument('--file', help='file with one drug or reaction per line')
+    refresh_parser.add_argument('--all', action='store_true',
+        help='refresh every stored search of --type')
+    refresh_parser.add_argument('--type', choices=['drug', 'reaction'], default='drug',
+        help='what the names are (default: drug)')
+    refresh_parser.add_argument('--workers', type=int, default=REFRESH_WORKERS,
+        help=f'searches refreshed at the same time (default: {REFRESH_WORKERS})')
+    refresh_parser.add_argument('--max-reports', type=int, default=None,
+        help='new reports retrieved per search at most (default: FDA_REPORT_BUDGET)')
+
+    serve_parser = commands.add_parser('serve',
+        help='run the JSON query service')
+    serve_parser.add_argument('--host', default='127.0.0.1',
+        help='address to listen on (default: 127.0.0.1)')
+    serve_parser.add_argument('--port', type=int, default=SERVICE_PORT,
+        help=f'port to listen on (default: {SERVICE_PORT})')
+
+    stub_parser = commands.add_parser('stub-fda',
+        help='serve synthetic FDA drug/event responses for load testing')
+    stub_parser.add_argument('--port', type=int, default=STUB_PORT,
+        help=f'port to listen on (default: {STUB_PORT})')
+
+    startup_parser = commands.add_parser('startup-check',
+        help='measure start-up time against a budget')
+    startup_parser.add_argument('--budget-ms', type=int, default=STARTUP_BUDGET_MS,
+        help=f'allowed milliseconds to the first prompt (default: {STARTUP_BUDGET_MS})')
+    startup_parser.add_argument('--runs', type=int, default=STARTUP_RUNS,
+        help=f'number of runs (default: {STARTUP_RUNS})')
+
+    commands.add_parser('compact-cache',
+        help='reclaim the space of replaced and evicted cache entries')
+
+    commands.add_parser('cache-stats',
+        help='show the number and size of cached responses')
+
+    render_parser = commands.add_parser('render',
+        help='write every chart for drugs or reactions already in the DB')
+    render_parser.add_argument('names', nargs='*', help='drugs or reactions')
+    render_parser.add_argument('--file', help='file with one drug or reaction per line')
+    render_parser.add_argument('--type', choices=['drug', 'reaction'], default='drug',
+        help='what the names are (default: drug)')
+    render_parser.add_argument('--format', choices=['html', 'json'], default='html',
+        help='chart file format (default: html)')
+    render_parser.add_argument('--dir', default=CHART_DIR,
+        help=f'directory the charts are written to (default: {CHART_DIR})')
+    render_parser.add_argument('--workers', type=int, default=RENDER_WORKERS,
+        help=f'worker processes (default: {RENDER_WORKERS})')
+
+    options = parser.parse_args(args)
+
+    if options.verbose:
+        logging.basicConfig(format='%(asctime)s %(message)s')
+        logger.setLevel(logging.INFO)
+
+    if options.command == 'ingest':
+        failed = ingest(options.paths, options.complete)
+        print_write_stats()
+        if failed:
+            sys.exit(1)
+    elif options.command == 'batch':
+        run_batch(options.terms, options.type, options.output,
+            options.workers, options.max_reports)
+        print_write_stats()
+        print_cache_stats()
+    elif options.command == 'refresh':
+        names = options.names + (read_terms(options.file) if options.file else [])
+        if not names and not options.all:
+            parser.error('refresh needs drug/reaction names, --file or --all')
+        run_refresh(None if options.all else names, options.type,
+            options.workers, options.max_reports)
+        print_write_stats()
+        print_cache_stats()
+    elif options.command == 'serve':
+        serve(options.host, options.port)
+    elif options.command == 'stub-fda':
+        get_stub_app().run(port=options.port, threaded=True)
+    elif options.command == 'compact-cache':
+        reclaimed = compact_cache()
+        print(f"Compacted {cache_path}; reclaimed {reclaimed / 1024 / 1024:.1f} MB.")
+    elif options.command == 'cache-stats':
+        print_cache_stats()
+    elif options.command == 'render':
+        names = options.names + (read_terms(options.file) if options.file else [])
+        if not names:
+            parser.error('render needs drug/reaction names or --file')
+        run_render(names, options.type, options.format, options.dir, options.workers)
+    elif options.command == 'startup-check':
+        if not check_startup(options.budget_ms, options.runs):
+            sys.exit(1)
 
-if os.path.isfile(summary_path):
-    with open('summary_cache.json') as sum_f:
-        json_summary_cache = json.load(sum_f)
+#### END OF FUNCTIONS ###
+
+atexit.register(close_db)
+atexit.register(save_fda_quota)
 
 
 if __name__ == "__main__":
     # First thing will be to create the DB to store results
     create_database()
+
+    # Non-interactive commands (see run_command)
+    if len(sys.argv) > 1:
+        run_command(sys.argv[1:])
+        exit()
+
     print('\n')
 
     print('DISCLAIMER: This program will allow the user to retrieve a ' \
@@ -1501,9 +5701,14 @@ if __name__ == "__main__":
     try:
         allow_for_Reddit = input("\nWould you like to conduct a Reddit search in this program? ('y' or 'n' or 'exit'): ")
         if allow_for_Reddit.lower() == 'y':
-            tokens = init_tokens_for_Reddit()
-            access_token = tokens[0]
-            refresh_token = tokens[1]
+            try:
+                tokens = init_tokens_for_Reddit()
+                access_token = tokens[0]
+                refresh_token = tokens[1]
+            except CredentialError as error:
+                print(f"\n{error}  Continuing without Reddit.")
+                access_token = None
+                refresh_token = None
         elif allow_for_Reddit.lower() == 'n':
             access_token = None
             refresh_token = None
@@ -1537,6 +5742,7 @@ if __name__ == "__main__":
                         else:
                             drug_name = drug_name.upper()
                             drug_result = find_by_drug(drug_name)
+                    start_prefetch(drug_name, 'drug', refresh_token)
                     while True:
                         search_select = select_interactive(search_type)
                         if search_select:
@@ -1563,6 +5769,7 @@ if __name__ == "__main__":
                         else:
                             reaction_name = reaction_name.capitalize()
                             reaction_result = find_by_reaction(reaction_name)
+                    start_prefetch(reaction_name, 'reaction')
                     while True:
                         search_select = select_interactive(search_type)
                         if search_select:
@@ -1577,6 +5784,8 @@ if __name__ == "__main__":
                 print("Invalid input.  Please try again.")
         except KeyError:
             print("Invalid entry. Please try again.")
+        except (CredentialError, FdaRateLimitError) as error:
+            print(f"\n{error}")
 
 
 ########## TESTING CODE BELOW ##########
@@ -0,0 +1,34 @@
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import drugs
+
+
+@pytest.fixture
+def fda_db(tmp_path, monkeypatch):
+    '''
+    Runs a test in an empty directory with a new DB and cache store,
+    and a stand-in secret_drugs.py; no request reaches the FDA
+    unless the test sends one.
+    '''
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(drugs, 'credentials', types.SimpleNamespace(FDA_API_KEY='test'))
+    monkeypatch.setattr(drugs, 'cache_conn', None)
+    monkeypatch.setattr(drugs, 'cache_sizes', {})
+    monkeypatch.setattr(drugs, 'name_id_cache', {})
+    monkeypatch.setattr(drugs, 'dataset_state', {'version': None, 'checked': None})
+    drugs.demographics_cache.clear()
+    drugs.service_cache.clear()
+    drugs.close_db()
+    drugs.create_database()
+
+    yield tmp_path
+
+    drugs.close_db()
+    if drugs.cache_conn is not None:
+        drugs.cache_conn.close()
@@ -0,0 +1,47 @@
+import os
+from collections import Counter
+
+import pytest
+
+import drugs
+
+
+def histogram(ages):
+    return sorted(Counter(ages).items())
+
+
+@pytest.mark.parametrize('ages, quartiles', [
+    # plotly.js 'linear' method: position q * n - 0.5, clamped to the ends
+    ([1, 2, 3, 4], (1.5, 2.5, 3.5)),
+    ([1, 2, 3, 4, 5], (1.75, 3, 4.25)),
+    ([20, 20, 20, 40], (20, 20, 30)),
+    ([30], (30, 30, 30)),
+    ([30, 60], (30, 45, 60)),
+])
+def test_quartiles_match_plotly(ages, quartiles):
+    stats = drugs.age_box_stats(histogram(ages))
+
+    assert (stats['q1'], stats['median'], stats['q3']) == pytest.approx(quartiles)
+    assert (stats['count'], stats['min'], stats['max']) == (len(ages), min(ages), max(ages))
+
+
+def test_whiskers_stop_within_one_and_a_half_iqr():
+    stats = drugs.age_box_stats(histogram([10, 11, 12, 13, 14, 15, 16, 17, 90]))
+
+    # q1 = 11.75, q3 = 16.25, so the upper whisker may reach 23
+    assert (stats['q1'], stats['q3']) == pytest.approx((11.75, 16.25))
+    assert (stats['lowerfence'], stats['upperfence'], stats['max']) == (10, 17, 90)
+
+
+def test_no_ages():
+    assert drugs.age_box_stats([]) == {}
+
+
+def test_ages_kept_as_reports_are_written(fda_db):
+    drugs.ingest([os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures',
+        'drug-event-0001-of-0002.json.zip')])
+
+    ages = drugs.demographics('ibuprofen', 'drug')['ages']
+
+    # report 1002 (age 45) and 1004 (age 30)
+    assert (ages['count'], ages['min'], ages['median'], ages['max']) == (2, 30, 37.5, 45)
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+import drugs
+
+
+@pytest.fixture
+def probes(fda_db, monkeypatch):
+    '''
+    FDA API whose dataset version is 2026-01-01; returns the list
+    of requests made.
+    '''
+    requests_made = []
+
+    class Response:
+        text = json.dumps({'meta': {'last_updated': '2026-01-01'}, 'results': []})
+
+    def fda_get(url):
+        requests_made.append(url)
+        return Response()
+
+    monkeypatch.setattr(drugs, 'fda_get', fda_get)
+    return requests_made
+
+
+def stored_dataset(key):
+    return drugs.get_cache_store().execute(
+        'SELECT Dataset FROM "drugs_cache" WHERE Key = ?', (key,)).fetchone()[0]
+
+
+def test_miss_does_not_probe_dataset(probes):
+    assert drugs.cache_get('drugs_cache', 'ASPIRIN') is None
+    assert probes == []
+
+
+def test_hit_probes_dataset_once(probes):
+    drugs.cache_put('drugs_cache', 'ASPIRIN', {'results': []}, dataset='2026-01-01')
+    drugs.cache_put('drugs_cache', 'IBUPROFEN', {'results': []}, dataset='2026-01-01')
+
+    assert drugs.cache_get('drugs_cache', 'ASPIRIN') is not None
+    assert drugs.cache_get('drugs_cache', 'IBUPROFEN') is not None
+    assert len(probes) == 1
+
+
+def test_entry_from_older_dataset_is_outdated(probes):
+    drugs.cache_put('drugs_cache', 'ASPIRIN', {'results': []}, dataset='2025-06-01')
+
+    assert drugs.cache_get('drugs_cache', 'ASPIRIN') is None
+    assert drugs.cache_get('drugs_cache', 'ASPIRIN', any_dataset=True) is not None
+
+
+def test_entry_from_unknown_dataset_is_stamped(probes):
+    drugs.cache_put('drugs_cache', 'ASPIRIN', {'results': []}, dataset='')
+
+    assert drugs.cache_get('drugs_cache', 'ASPIRIN') is not None
+    assert stored_dataset('ASPIRIN') == '2026-01-01'
+
+
+def test_unknown_dataset_kept_while_offline(fda_db, monkeypatch):
+    def fda_get(url):
+        raise drugs.requests.ConnectionError('offline')
+
+    monkeypatch.setattr(drugs, 'fda_get', fda_get)
+    drugs.cache_put('drugs_cache', 'ASPIRIN', {'results': []}, dataset='')
+
+    assert drugs.cache_get('drugs_cache', 'ASPIRIN') is not None
+    assert stored_dataset('ASPIRIN') == ''
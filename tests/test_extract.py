@@ -0,0 +1,106 @@
+import drugs
+
+
+def fda_report(report_id, drugs_listed, reactions, age=None, gender=None):
+    patient = {'drug': [{'medicinalproduct': drug} for drug in drugs_listed],
+        'reaction': [{'reactionmeddrapt': reaction} for reaction in reactions]}
+    if age is not None:
+        patient['patientonsetage'] = age
+    if gender is not None:
+        patient['patientsex'] = gender
+    return {'safetyreportid': report_id, 'patient': patient}
+
+
+def test_indexing_returns_python_values():
+    batch = drugs.extract_columns([fda_report('10003', ['ASPIRIN'], ['Nausea'], '42', '2')],
+        'ASPIRIN', 'drug')
+
+    row = batch[0]
+
+    assert row == (10003, 'ASPIRIN', 'Nausea', 42.0, 2)
+    assert [type(value) for value in row] == [int, str, str, float, int]
+
+
+def test_indexing_text_report_ids():
+    raw = [fda_report('US-123', ['ASPIRIN'], ['Nausea', 'Headache']),
+        fda_report('10003', ['ASPIRIN'], ['Rash'])]
+    batch = drugs.extract_columns(raw, 'ASPIRIN', 'drug')
+
+    assert batch[0] == ('US-123', 'ASPIRIN', 'Nausea', None, 0)
+    assert batch[-1] == ('10003', 'ASPIRIN', 'Rash', None, 0)
+    assert [batch[i] for i in range(len(batch))] == list(batch)
+
+
+def test_concat_merges_intern_tables():
+    first = drugs.extract_columns([fda_report('1', ['ASPIRIN', 'IBUPROFEN'], ['Nausea'])],
+        None, 'bulk')
+    second = drugs.extract_columns([fda_report('US-2', ['IBUPROFEN'], ['Rash', 'Nausea'], '30')],
+        None, 'bulk')
+
+    joined = drugs.ReportBatch.concat([first, second])
+
+    assert list(joined) == list(first) + list(second)
+    assert joined.drug_names == ['ASPIRIN', 'IBUPROFEN']
+    assert joined.reaction_names == ['Nausea', 'Rash']
+
+
+def loop_rows(raw_data, search_name, search_type):
+    # Rows as built by the per-report loops that extract_columns replaced,
+    # converted the way the DB stores them (INTEGER columns): numeric ids,
+    # ages and genders as numbers, an age that is not a number as None
+    rows = []
+    for report in raw_data:
+        patient = report['patient']
+        age = patient.get('patientonsetage')
+        try:
+            age = float(age)
+        except (TypeError, ValueError):
+            age = None
+        gender = int(patient.get('patientsex') or 0)
+        report_id = report['safetyreportid']
+        report_id = int(report_id) if report_id.isdigit() else report_id
+        if search_type == 'drug':
+            for reaction in patient['reaction']:
+                rows.append((report_id, search_name.upper(), reaction['reactionmeddrapt'],
+                    age, gender))
+        else:
+            for drug in patient['drug']:
+                rows.append((report_id, drug['medicinalproduct'].replace('  ', '').upper(),
+                    search_name, age, gender))
+    return rows
+
+
+def sample_reports(count):
+    names = ['ASPIRIN', 'ibuprofen', 'METFORMIN  HCL', 'Lisinopril']
+    reactions = ['Nausea', 'Headache', 'Rash', 'Dizziness', 'Fatigue']
+    return [fda_report(str(5000 + i), names[i % 4:] + names[:i % 2],
+        reactions[:1 + i % 5], age=[None, '42', '7.5', 'unknown'][i % 4],
+        gender=[None, '1', '2', '0'][i % 3])
+        for i in range(count)]
+
+
+def test_drug_rows_match_report_loop():
+    raw = sample_reports(60)
+
+    assert drugs.results_loop_drug(raw, 'aspirin') == loop_rows(raw, 'aspirin', 'drug')
+    assert list(drugs.extract_columns(raw, 'aspirin', 'drug')) == \
+        drugs.results_loop_drug(raw, 'aspirin')
+
+
+def test_reaction_rows_match_report_loop():
+    raw = sample_reports(60)
+
+    assert drugs.results_loop_reactions(raw, 'Nausea') == loop_rows(raw, 'Nausea', 'reaction')
+
+
+def test_columns_are_typed():
+    batch = drugs.extract_columns(sample_reports(8), 'ASPIRIN', 'drug')
+
+    assert batch.report_id.dtype == drugs.numpy.int64
+    assert batch.age.dtype == drugs.numpy.float64
+    assert batch.gender.dtype == drugs.numpy.int8
+    assert batch.drug_names == ['ASPIRIN']
+
+
+def test_empty_page():
+    assert list(drugs.extract_columns([], 'ASPIRIN', 'drug')) == []
@@ -0,0 +1,100 @@
+import os
+
+import pytest
+
+import drugs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PART_1 = os.path.join(FIXTURES, 'drug-event-0001-of-0002.json.zip')
+PART_2 = os.path.join(FIXTURES, 'drug-event-0002-of-0002.json.zip')
+
+
+def stored_reports():
+    return sorted(row[0] for row in drugs.db_query(
+        "SELECT DISTINCT ReportID FROM Report_Facts"))
+
+
+def ingest_complete():
+    return drugs.db_query("SELECT Files FROM Ingest_Complete")
+
+
+def test_ingest_skips_reports_missing_fields(fda_db, capsys):
+    assert drugs.ingest([PART_1]) == []
+
+    assert stored_reports() == [1001, 1002, 1004, 1006]
+    assert drugs.db_query("SELECT COUNT(*) FROM Report_Facts") == [(6,)]
+    assert "6 reports (2 skipped" in capsys.readouterr().out
+
+
+def test_ingest_resumes_after_interruption(fda_db, monkeypatch):
+    monkeypatch.setattr(drugs, 'INGEST_BATCH_REPORTS', 2)
+    bulk_write = drugs.bulk_write
+    writes = []
+
+    def interrupted_write(statements):
+        writes.append(statements)
+        if len(writes) == 2:
+            raise KeyboardInterrupt
+        return bulk_write(statements)
+
+    monkeypatch.setattr(drugs, 'bulk_write', interrupted_write)
+    with pytest.raises(KeyboardInterrupt):
+        drugs.ingest([PART_1])
+    assert stored_reports() == [1001, 1002]
+    assert drugs.db_query("SELECT Reports, Done FROM Ingest_Checkpoints") == [(2, 0)]
+
+    monkeypatch.setattr(drugs, 'bulk_write', bulk_write)
+    drugs.ingest([PART_1])
+    assert stored_reports() == [1001, 1002, 1004, 1006]
+    assert drugs.db_query("SELECT Reports, Done FROM Ingest_Checkpoints") == [(6, 1)]
+
+
+def test_ingest_skips_finished_files(fda_db, capsys):
+    drugs.ingest([PART_2])
+    drugs.ingest([PART_2])
+
+    assert "already ingested (2 reports)" in capsys.readouterr().out
+    assert stored_reports() == [2001, 2002]
+
+
+def test_complete_refused_with_missing_part(fda_db, capsys):
+    drugs.ingest([PART_1], complete=True)
+
+    assert ingest_complete() == []
+    assert "missing 1 file(s)" in capsys.readouterr().out
+
+
+def test_complete_recorded_with_every_part(fda_db):
+    drugs.ingest([PART_1, PART_2], complete=True)
+
+    assert ingest_complete() == [(2,)]
+
+
+@pytest.mark.parametrize('name', ['truncated.json.zip', 'malformed.json.zip'])
+def test_bad_file_is_not_marked_finished(fda_db, name):
+    path = os.path.join(FIXTURES, name)
+
+    with pytest.raises(drugs.BulkFileError):
+        drugs.ingest_bulk_file(path)
+    assert drugs.db_query("SELECT Done FROM Ingest_Checkpoints") != [(1,)]
+
+    assert drugs.ingest([path, PART_2], complete=True) == [path]
+    assert stored_reports() == [2001, 2002]
+    assert ingest_complete() == []
+
+
+def test_file_without_results_list(tmp_path):
+    path = tmp_path / 'empty.json'
+    path.write_text('{"meta": {"results": {"total": 0}}}')
+
+    with pytest.raises(drugs.BulkFileError):
+        list(drugs.iter_bulk_reports(str(path)))
+
+
+def test_reports_split_across_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(drugs, 'INGEST_CHUNK_SIZE', 7)
+    path = tmp_path / 'small.json'
+    path.write_text('{"meta": {"results": {"total": 2}}, "results": '
+        '[{"safetyreportid": "1"}, {"safetyreportid": "2"}]}')
+
+    assert [report['safetyreportid'] for report in drugs.iter_bulk_reports(str(path))] == ['1', '2']
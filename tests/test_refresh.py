@@ -0,0 +1,87 @@
+import re
+
+import pytest
+
+import drugs
+
+
+def fda_reports(days, per_day=10):
+    return [{'safetyreportid': str(day * 100 + k), 'receivedate': f'202601{day:02d}',
+        'patient': {'reaction': [{'reactionmeddrapt': 'Nausea'}],
+            'drug': [{'medicinalproduct': 'ASPIRIN'}]}}
+        for day in days for k in range(per_day)]
+
+
+@pytest.fixture
+def fda(fda_db, monkeypatch):
+    '''
+    Stand-in for fetch_report_pages over the reports in fda.held,
+    honouring the receivedate window and sort of the query.
+    '''
+    state = {'held': [], 'read': set()}
+
+    def fetch_report_pages(search_query, max_reports, sort=None):
+        window = re.search(r'receivedate:\[(\d{8})\+TO\+(\d{8})\]', search_query)
+        available = [report for report in state['held'] if not window
+            or window.group(1) <= report['receivedate'] <= window.group(2)]
+        available.sort(key=lambda report: report['receivedate'],
+            reverse=sort == 'receivedate:desc')
+        retrieved = available[:max_reports]
+        state['read'].update(report['safetyreportid'] for report in retrieved)
+        for i in range(0, len(retrieved), 4):
+            yield retrieved[i:i + 4], len(available)
+
+    monkeypatch.setattr(drugs, 'fetch_report_pages', fetch_report_pages)
+    monkeypatch.setattr(drugs, 'total_reaction_by_drug', lambda name: None)
+    return state
+
+
+def saved_search():
+    return drugs.db_query("SELECT Total, Received FROM Search_Totals")[0]
+
+
+def test_full_refetch_reads_newest_day_in_full(fda):
+    fda['held'] = fda_reports(range(1, 6))
+    drugs.record_search_total('drug', 'ASPIRIN', 40)
+
+    result = drugs.refresh_search('aspirin', 'drug', max_reports=5)
+
+    # max_reports ended within day 5, so the rest of it was read too
+    assert result['new_reports'] == 10
+    assert saved_search() == (50, '20260105')
+    assert fda['read'] == {report['safetyreportid'] for report in fda_reports([5])}
+
+
+def test_small_budget_loses_no_new_reports(fda):
+    fda['held'] = fda_reports(range(1, 6))
+    drugs.record_search_total('drug', 'ASPIRIN', 40)
+    drugs.refresh_search('aspirin', 'drug', max_reports=15)
+    assert saved_search() == (50, '20260105')
+    fda['read'].clear()
+
+    # days with more reports than max_reports are still read in full
+    fda['held'] += fda_reports(range(6, 10))
+    for day in range(6, 10):
+        drugs.refresh_search('aspirin', 'drug', max_reports=7)
+        assert saved_search() == (50 + 10 * (day - 5), f'202601{day:02d}')
+
+    assert drugs.refresh_search('aspirin', 'drug', max_reports=7)['status'] == 'up to date'
+    assert fda['read'] == {report['safetyreportid'] for report in fda_reports(range(6, 10))}
+
+
+def test_truncated_delta_saves_last_full_day(fda):
+    fda['held'] = fda_reports(range(1, 6))
+    drugs.record_search_total('drug', 'ASPIRIN', 50, '20260105')
+    fda['held'] += fda_reports(range(6, 10))
+
+    drugs.refresh_search('aspirin', 'drug', max_reports=25)
+
+    # days 6 and 7 read in full, day 8 in part
+    assert saved_search() == (70, '20260107')
+
+
+def test_refresh_of_unknown_search_is_not_found(fda):
+    result = drugs.refresh_search('aspirin', 'drug')
+
+    assert result['status'] == 'not found'
+    assert drugs.db_query("SELECT * FROM Search_Totals") == []
@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+
+import drugs
+
+
+@pytest.fixture
+def memory_db(monkeypatch):
+    '''
+    In-memory DB used as the shared write connection.
+    '''
+    conn = sqlite3.connect(':memory:', check_same_thread=False)
+    monkeypatch.setattr(drugs, 'db_conn', conn)
+    yield conn
+    conn.close()
+
+
+def report_summary_v0(conn):
+    # Report_Summary as created before any migration
+    conn.execute('''CREATE TABLE "Report_Summary" ("ReportID" INTEGER NOT NULL,
+        "Drugs" TEXT NOT NULL, "Reactions" TEXT NOT NULL, "Age" INTEGER, "Gender" INTEGER,
+        UNIQUE (ReportID, Drugs, Reactions, Age, Gender) ON CONFLICT IGNORE)''')
+    conn.executemany('INSERT INTO "Report_Summary" VALUES(?,?,?,?,?)',
+        [(1001, 'ASPIRIN', 'Nausea', 45, 1), (1001, 'ASPIRIN', 'Headache', 45, 1),
+            (1002, 'IBUPROFEN', 'Nausea', None, 2)])
+    conn.commit()
+
+
+def test_new_db_chart_queries_use_indexes(memory_db):
+    drugs.create_database()
+
+    assert memory_db.execute("PRAGMA user_version").fetchone()[0] == len(drugs.SCHEMA_MIGRATIONS)
+    assert drugs.check_query_plans(memory_db) == []
+
+
+def test_upgrade_from_v0(memory_db):
+    report_summary_v0(memory_db)
+    statements = []
+    memory_db.set_trace_callback(statements.append)
+
+    drugs.create_database()
+
+    # Report_Summary is replaced by a view; no index is built on it first
+    assert not [statement for statement in statements
+        if 'INDEX' in statement and 'ON "Report_Summary"' in statement]
+    assert sorted(memory_db.execute("SELECT * FROM Report_Summary")) == [
+        (1001, 'ASPIRIN', 'Headache', 45, 1), (1001, 'ASPIRIN', 'Nausea', 45, 1),
+        (1002, 'IBUPROFEN', 'Nausea', None, 2)]
+    assert memory_db.execute('''SELECT Drugs, Reports FROM Drug_Names
+        ORDER BY Drugs''').fetchall() == [('ASPIRIN', 1), ('IBUPROFEN', 1)]
+    assert drugs.check_query_plans(memory_db) == []
+
+
+def test_failed_migration_is_rolled_back(memory_db, monkeypatch):
+    report_summary_v0(memory_db)
+    migrations = [list(statements) for statements in drugs.SCHEMA_MIGRATIONS]
+    migrations[3].append('SELECT missing FROM nowhere')
+    monkeypatch.setattr(drugs, 'SCHEMA_MIGRATIONS', migrations)
+
+    with pytest.raises(sqlite3.OperationalError):
+        drugs.create_database()
+
+    # migrations 1-3 applied; nothing of migration 4 is left behind
+    assert memory_db.execute("PRAGMA user_version").fetchone()[0] == 3
+    assert memory_db.execute('''SELECT name FROM sqlite_master
+        WHERE name = 'Pair_Counts' ''').fetchall() == []
+
+    migrations[3].pop()
+    drugs.create_database()
+    assert memory_db.execute("PRAGMA user_version").fetchone()[0] == len(migrations)
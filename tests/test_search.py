@@ -0,0 +1,95 @@
+import json
+
+import pytest
+import requests
+import urllib3.util.retry
+
+import drugs
+
+
+@pytest.fixture
+def offline_fda(fda_db, monkeypatch):
+    '''
+    FDA API that cannot be reached, as after the retries are used up.
+    '''
+    def fda_get(url):
+        raise requests.ConnectionError('connection refused')
+
+    monkeypatch.setattr(drugs, 'fda_get', fda_get)
+
+
+@pytest.mark.parametrize('find', [drugs.find_by_drug, drugs.find_by_reaction])
+def test_unreachable_fda_does_not_raise(offline_fda, find, capsys):
+    assert find('Nausea') is None
+    assert 'Could not reach the FDA (ConnectionError)' in capsys.readouterr().out
+
+
+@pytest.mark.parametrize('find', [drugs.find_by_drug, drugs.find_by_reaction])
+def test_rate_limit_is_raised(fda_db, monkeypatch, find):
+    def fda_get(url):
+        raise drugs.FdaRateLimitError('limit reached')
+
+    monkeypatch.setattr(drugs, 'fda_get', fda_get)
+
+    with pytest.raises(drugs.FdaRateLimitError):
+        find('Nausea')
+
+
+def test_http_session_without_retry_jitter(monkeypatch):
+    class Retry(urllib3.util.retry.Retry):
+        # urllib3 1.x signature
+        def __init__(self, backoff_jitter=None, **kwargs):
+            if backoff_jitter is not None:
+                raise TypeError("unexpected keyword argument 'backoff_jitter'")
+            super().__init__(**kwargs)
+
+    monkeypatch.setattr(urllib3.util.retry, 'Retry', Retry)
+    monkeypatch.setattr(drugs, 'http_session', None)
+
+    session = drugs.get_http_session()
+
+    assert session.get_adapter('https://api.fda.gov').max_retries.total == drugs.HTTP_RETRIES
+
+
+def fda_reports(count):
+    return [{'safetyreportid': str(1000 + i), 'receivedate': '20260101',
+        'patient': {'drug': [{'medicinalproduct': 'ASPIRIN'}],
+            'reaction': [{'reactionmeddrapt': 'Nausea'}, {'reactionmeddrapt': f'R{i % 3}'}]}}
+        for i in range(count)]
+
+
+@pytest.fixture
+def fda(fda_db, monkeypatch):
+    '''
+    FDA API holding 30 reports for every search, answering both
+    single requests and paginated searches (pages of 8).
+    '''
+    reports = fda_reports(30)
+
+    class Response:
+        text = json.dumps({'meta': {'results': {'total': len(reports)}}, 'results': reports})
+
+    def fetch_report_pages(search_query, max_reports, sort=None):
+        for i in range(0, min(max_reports, len(reports)), 8):
+            yield reports[i:i + 8], len(reports)
+
+    monkeypatch.setattr(drugs, 'fda_get', lambda url: Response())
+    monkeypatch.setattr(drugs, 'fetch_report_pages', fetch_report_pages)
+    monkeypatch.setattr(drugs, 'total_reaction_by_drug', lambda name, summary=None: None)
+    monkeypatch.setattr(drugs, 'total_drugs_by_reaction', lambda name, summary=None: None)
+    return reports
+
+
+@pytest.mark.parametrize('max_reports', [drugs.FDA_PAGE_SIZE, drugs.FDA_PAGE_SIZE + 1])
+def test_search_returns_report_batch(fda, max_reports):
+    found = drugs.find_by_drug('ASPIRIN', max_reports)
+
+    assert isinstance(found, drugs.ReportBatch)
+    assert len(found) == 60
+    assert sorted(found) == sorted(drugs.extract_columns(fda, 'ASPIRIN', 'drug'))
+
+
+def test_batch_search_counts_rows_of_paginated_search(fda):
+    result = drugs.batch_search('nausea', 'reaction', drugs.FDA_PAGE_SIZE + 1)
+
+    assert (result['status'], result['rows']) == ('ok', 30) # one drug per report
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+import drugs
+
+
+@pytest.fixture
+def client(fda_db, monkeypatch):
+    searches = []
+
+    def batch_search(term, search_type, max_reports=None):
+        searches.append((term, search_type, max_reports))
+        drugs.record_search_total(search_type, term, 40, '20260105')
+        return {'term': term, 'type': search_type, 'status': 'ok', 'rows': 0}
+
+    monkeypatch.setattr(drugs, 'batch_search', batch_search)
+    test_client = drugs.get_service_app().test_client()
+    test_client.searches = searches
+    return test_client
+
+
+def test_get_does_not_search(client):
+    response = client.get('/api/drug/aspirin')
+
+    assert response.status_code == 404
+    assert client.searches == []
+
+
+def test_post_searches(client):
+    response = client.post('/api/drug/aspirin?max_reports=50')
+
+    assert response.status_code == 200
+    assert client.searches == [('aspirin', 'drug', 50)]
+
+
+def test_get_reports_stored_search(client):
+    client.post('/api/drug/aspirin')
+
+    response = client.get('/api/drug/aspirin')
+
+    assert response.status_code == 200
+    assert response.get_json() == {'drug': 'aspirin', 'reports': 0, 'fda_total': 40,
+        'received': '20260105'}
+    assert len(client.searches) == 1
+
+
+def test_unknown_kind(client):
+    assert client.get('/api/device/x').status_code == 404
+    assert client.post('/api/device/x').status_code == 404
+
+
+def test_get_counts_ingested_reports(client):
+    drugs.ingest([os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures',
+        'drug-event-0001-of-0002.json.zip')])
+
+    response = client.get('/api/drug/Aspirin')
+
+    assert response.get_json() == {'drug': 'Aspirin', 'reports': 3, 'fda_total': None,
+        'received': None}
@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import drugs
+
+
+def run_python(code, cwd):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(drugs.__file__)))
+    output = subprocess.run([sys.executable, '-c', code], env=env, cwd=cwd,
+        capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_startup_imports_no_heavy_module(tmp_path):
+    imported = run_python("import sys, json; import drugs; drugs.create_database(); "
+        "print(json.dumps(sorted(name for name in drugs.STARTUP_HEAVY_MODULES "
+        "if name in sys.modules)))", tmp_path)
+
+    assert imported == []
+    assert (tmp_path / drugs.DB_PATH).exists()
+
+
+def test_heavy_modules_load_on_first_use(tmp_path):
+    imported = run_python("import sys, json; import drugs; "
+        "drugs.get_http_session(); drugs.numpy.array([1]); "
+        "print(json.dumps(sorted(name for name in drugs.STARTUP_HEAVY_MODULES "
+        "if name in sys.modules)))", tmp_path)
+
+    assert imported == ['numpy', 'requests']
+
+
+def test_missing_credentials_module(monkeypatch):
+    monkeypatch.setattr(drugs, 'credentials', None)
+    monkeypatch.setattr(drugs, 'CREDENTIALS_MODULE', 'secret_drugs_not_there')
+
+    with pytest.raises(drugs.CredentialError, match='secret_drugs_not_there.py was not found'):
+        drugs.get_credential('FDA_API_KEY')
+    assert drugs.credentials is None
+
+
+def test_missing_credential_setting(monkeypatch):
+    monkeypatch.setattr(drugs, 'credentials', object())
+
+    with pytest.raises(drugs.CredentialError, match='does not define FDA_API_KEY'):
+        drugs.get_credential('FDA_API_KEY')
+
+
+def test_check_startup_within_budget(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+
+    assert drugs.check_startup(runs=3)
+    output = capsys.readouterr().out
+    assert 'budget {} ms'.format(drugs.STARTUP_BUDGET_MS) in output
+    assert output.rstrip().endswith('OK')
+
+
+def test_check_startup_over_budget(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+
+    assert not drugs.check_startup(budget_ms=0, runs=1)
+    assert capsys.readouterr().out.rstrip().endswith('OVER BUDGET')